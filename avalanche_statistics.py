@@ -0,0 +1,136 @@
+import sandpile_calculations as sp
+
+import argparse
+import json
+from time import perf_counter
+
+import numpy as np
+
+'''
+Avalanche statistics: drops grains one at a time on a stable pile and records
+each drop's avalanche (see Avalanche Drops in sandpile_calculations).
+
+The pile is a square or cylinder lattice with any neighborhood (the grains
+need the open edges as a sink). It starts from the maximal stable pile
+(threshold - 1 grains on every cell, already critical), an empty pile, or a
+saved .npy pile. Grains go on one fixed cell or on cells drawn from a seeded
+random generator, in batches. Warm-up drops are relaxed but not recorded.
+
+Records are streamed to a .npy file of AVALANCHE_DTYPE records written batch
+by batch through a memory map, so the whole run never sits in memory:
+
+    records = np.load('avalanches.npy', mmap_mode='r')
+    sizes = records['size']
+
+A _meta.json file next to it holds the lattice, seed and run summary.
+'''
+
+AVALANCHE_DTYPE = np.dtype([('site', np.int32), ('size', np.int64), ('area', np.int32), ('duration', np.int32), ('lost', np.int32)])
+DROP_BATCH = 1 << 16 # Drops relaxed per kernel call (and written per batch)
+LATTICE_TYPES = ['square', 'cylinder']
+
+def lattice_graph(type, xMax, yMax, topple):
+    graph = sp.grid_graph(xMax, yMax, tuple(sp.resolve_neighborhood(topple)), type)
+    if not np.any(graph.degrees() < graph.threshold):
+        raise ValueError(f'{type} lattice has no cells losing grains, single grain drops would never stop toppling')
+    return graph
+
+def start_pile(graph, start):
+    # Flat stable starting pile: 'max' (threshold - 1 everywhere), 'empty' or the path of a saved .npy pile
+    if start == 'max':
+        return np.full(graph.numCells, graph.threshold - 1, dtype=np.int64)
+    elif start == 'empty':
+        return np.zeros(graph.numCells, dtype=np.int64)
+    flatSandbox = np.load(start).reshape(-1).astype(np.int64)
+    if flatSandbox.shape[0] != graph.numCells:
+        raise ValueError(f'{start} has {flatSandbox.shape[0]} cells, the lattice has {graph.numCells}')
+    return sp.topple_graph_worklist(flatSandbox, graph)[0]
+
+def drop_sites(rng, numDrops, numCells, site=None):
+    if site is None:
+        return rng.integers(0, numCells, numDrops, dtype=np.int64)
+    return np.full(numDrops, site, dtype=np.int64)
+
+class AvalancheRun():
+    def __init__(self, graph, flatSandbox, seed=0, site=None):
+        self.graph = graph
+        self.flatSandbox = flatSandbox
+        self.site = site
+        self.rng = np.random.default_rng(seed)
+        self.lastDrop = np.full(graph.numCells, -1, dtype=np.int64)
+        self.numDropped = 0
+
+    def drop(self, numDrops):
+        # Relaxes numDrops grains, returns (sites, sizes, areas, durations, losses)
+        sites = drop_sites(self.rng, numDrops, self.graph.numCells, self.site)
+        columns = [np.empty(numDrops, dtype=np.int64) for _ in range(4)]
+        sp.topple_graph_avalanches(self.flatSandbox, self.graph, sites, *columns, self.lastDrop, self.numDropped)
+        self.numDropped += numDrops
+        return (sites, *columns)
+
+    def run(self, numDrops, records=None, batch=DROP_BATCH):
+        # Drops in batches, writing into records (an AVALANCHE_DTYPE array) if given
+        for first in range(0, numDrops, batch):
+            last = min(first + batch, numDrops)
+            sites, sizes, areas, durations, losses = self.drop(last - first)
+            if records is not None:
+                for key, column in zip(['site', 'size', 'area', 'duration', 'lost'], [sites, sizes, areas, durations, losses]):
+                    records[key][first:last] = column
+
+def summarize(records, seconds):
+    sizes = records['size']
+    numDrops = len(records)
+    summary = {'drops': numDrops, 'seconds': seconds, 'dropsPerMinute': (60 * numDrops / seconds) if seconds > 0 else None,
+               'topples': int(sizes.sum()), 'avalanches': int(np.count_nonzero(sizes))}
+    if numDrops > 0:
+        summary.update({'meanSize': float(sizes.mean()), 'maxSize': int(sizes.max()), 'maxArea': int(records['area'].max()),
+                        'maxDuration': int(records['duration'].max()), 'lost': int(records['lost'].sum(dtype=np.int64))})
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description='Drop grains one at a time on a stable pile and record every avalanche')
+    parser.add_argument('--type', type=str, default='square', choices=LATTICE_TYPES, help='Lattice of the pile')
+    parser.add_argument('--size', type=int, nargs=2, default=[512, 512], metavar=('XMAX', 'YMAX'), help='Pile size')
+    parser.add_argument('--topple', type=str, default='von_neumann', help='Neighborhood name (threshold is its number of offsets)')
+    parser.add_argument('--drops', type=int, default=1000000, help='Recorded drops')
+    parser.add_argument('--warmup', type=int, default=0, help='Drops relaxed before recording')
+    parser.add_argument('--site', type=int, nargs=2, default=None, metavar=('X', 'Y'), help='Drop every grain on this cell instead of random cells')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random drop sites')
+    parser.add_argument('--start', type=str, default='max', help='Starting pile: max, empty or the path of a saved .npy pile')
+    parser.add_argument('-o', '--output', type=str, default='avalanches.npy', help='Avalanche records file')
+    parser.add_argument('--save-pile', type=str, default=None, help='Path to save the final pile to (.npy), to start a later run from')
+    args = parser.parse_args()
+
+    xMax, yMax = args.size
+    graph = lattice_graph(args.type, xMax, yMax, args.topple)
+    site = None
+    if args.site is not None:
+        site = (args.site[0] * yMax) + args.site[1]
+    avalanches = AvalancheRun(graph, start_pile(graph, args.start), seed=args.seed, site=site)
+
+    start = perf_counter()
+    avalanches.run(args.warmup)
+    warmupTime = perf_counter() - start
+
+    records = np.lib.format.open_memmap(args.output, mode='w+', dtype=AVALANCHE_DTYPE, shape=(args.drops,))
+    start = perf_counter()
+    avalanches.run(args.drops, records)
+    runTime = perf_counter() - start
+    records.flush()
+
+    summary = summarize(records, runTime)
+    summary['warmupSeconds'] = warmupTime
+    del records
+    meta = {'type': args.type, 'xMax': xMax, 'yMax': yMax, 'topple': args.topple, 'start': args.start, 'warmup': args.warmup,
+            'seed': args.seed, 'site': args.site, 'summary': summary}
+    with open(args.output.removesuffix('.npy') + '_meta.json', 'w') as metaFile:
+        json.dump(meta, metaFile, indent=4)
+    if args.save_pile is not None:
+        np.save(args.save_pile, avalanches.flatSandbox.reshape((xMax, yMax)))
+
+    print(f"{summary['drops']} drops in {runTime:.3f} sec ({summary['dropsPerMinute'] or 0:.0f} per minute), warm-up {args.warmup} drops in {warmupTime:.3f} sec.")
+    if summary['drops'] > 0:
+        print(f"Avalanches: {summary['avalanches']}, mean size {summary['meanSize']:.2f}, max size {summary['maxSize']}, max area {summary['maxArea']}, max duration {summary['maxDuration']}, grains lost {summary['lost']}.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+import sandpile_calculations as sp
+import draw_sandpile as draw_sp
+import sandpile_surface_toppling as sst
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import tempfile
+import tracemalloc
+from time import perf_counter, strftime
+
+import numpy as np
+
+'''
+Benchmarks the calculate_sandpile_* entry points and the renderers.
+
+Benchmark groups:
+    lattices      every pile type (square, plane, cylinder, squarewrap,
+                  cubesurface, icosahedronsurface) over the sizes x grains matrix
+    neighborhoods every named neighborhood on the square grid over the same matrix
+    configs       the pile_config/*.json files as named scenarios
+    render        SandpileImg, SandpileImgExtended (hex, tri, trihex), SandpileSvg
+                  and SandpileSvgCompact on a random pile of each size
+
+Size is the side of a square pile or cube face, and 2 * numRows for the
+icosahedron. Grains are dropped on one center spot. The closed surfaces
+(squarewrap, cubesurface, icosahedronsurface) have no sink and only surely
+stabilize with fewer grains than edges, so their grain counts are capped
+there.
+
+Each benchmark is timed --repeat times (best time kept) without any
+instrumentation, then run once more under tracemalloc for the peak memory,
+counting waves through the progress callback where the kernel has one
+(square and wrap-around piles, scan and worklist engines).
+
+Results are written as JSON. Given a baseline (an earlier results file) each
+benchmark is compared by name: slower than the baseline by more than the
+tolerance is a regression, and a different topple count means the pile
+changed. The exit code is 1 if any benchmark regressed.
+'''
+
+BENCHMARK_VERSION = 1
+DEFAULT_RESULTS_PATH = 'benchmark_results.json'
+DEFAULT_TOLERANCE = 1.2 # Times more than 1.2x the baseline are regressions
+LATTICE_TYPES = ['square', 'plane', 'cylinder', 'squarewrap', 'cubesurface', 'icosahedronsurface']
+RENDERERS = ['img', 'hex', 'tri', 'trihex', 'svg', 'svgcompact']
+
+def closed_grain_limit(type, xMax, yMax, numRows):
+    # Edges of a closed surface (a pile with fewer grains always stabilizes), None for piles with a sink
+    if type == 'squarewrap':
+        return 2 * xMax * yMax
+    elif type == 'cubesurface':
+        return 2 * 6 * xMax * yMax
+    elif type == 'icosahedronsurface':
+        return (3 * 20 * numRows * numRows) // 2
+    return None
+
+def lattice_params(type, size, grains, topple='von_neumann'):
+    # calculate_pile keyword arguments for a center drop on one pile type
+    params = {'type': type, 'xMax': size, 'yMax': size, 'zMax': size, 'numRows': 3, 'grains': grains, 'topple': topple,
+              'dropSpots': [(size // 2, size // 2, 1.0)], 'seed': 0, 'seedType': 'uniform', 'seedAttr': None}
+    if type == 'cubesurface':
+        params['dropSpots'] = [(size // 2, size // 2, 1.0, 'top')]
+    elif type == 'icosahedronsurface':
+        numRows = max(2, size // 2)
+        params.update({'xMax': 1 + (2 * (numRows - 1)), 'yMax': numRows, 'numRows': numRows, 'topple': 'default', 'dropSpots': [(0, numRows - 1, 1.0, 1)]})
+    grainLimit = closed_grain_limit(type, params['xMax'], params['yMax'], params['numRows'])
+    if grainLimit is not None:
+        params['grains'] = min(grains, grainLimit - 1)
+    return params
+
+def config_params(path):
+    # Pile params of a config file, without its drop spot printout
+    with contextlib.redirect_stdout(io.StringIO()):
+        return sst.pile_params(sst.load_JSON(path))
+
+def calculation_benchmarks(groups, sizes, grainCounts, engines, configDir):
+    # (group, name, benchmark dict) for every pile to calculate
+    benchmarks = []
+    for engine in engines:
+        if 'lattices' in groups:
+            for type in LATTICE_TYPES:
+                for size in sizes:
+                    for grains in grainCounts:
+                        params = lattice_params(type, size, grains)
+                        benchmarks.append(('lattices', f"{type}/{size}/{params['grains']}/{engine}", {'params': params, 'engine': engine}))
+        if 'neighborhoods' in groups:
+            for topple in sp.NEIGHBORHOOD_OFFSETS:
+                for size in sizes:
+                    for grains in grainCounts:
+                        benchmarks.append(('neighborhoods', f'{topple}/{size}/{grains}/{engine}', {'params': lattice_params('square', size, grains, topple), 'engine': engine}))
+        if 'configs' in groups:
+            for path in sorted(glob.glob(os.path.join(configDir, '*.json'))):
+                name = os.path.splitext(os.path.basename(path))[0]
+                benchmarks.append(('configs', f'{name}/{engine}', {'params': config_params(path), 'engine': engine}))
+    return benchmarks
+
+def render_benchmarks(sizes, pixelWidth):
+    return [('render', f'{renderer}/{size}/{pixelWidth}px', {'renderer': renderer, 'size': size, 'pixelWidth': pixelWidth}) for renderer in RENDERERS for size in sizes]
+
+def run_calculation(benchmark, progress=None):
+    params = dict(benchmark['params'])
+    return sst.calculate_pile(params.pop('type'), params.pop('xMax'), params.pop('yMax'), params.pop('zMax'), params.pop('numRows'), params.pop('grains'), params.pop('topple'), params.pop('dropSpots'),
+                              engine=benchmark['engine'], progress=progress, progressWaves=1, **params)
+
+def run_render(benchmark, directory):
+    # Renders a random pile, returns the size of the written file
+    size = benchmark['size']
+    sandpile = np.random.default_rng(0).integers(0, 4, (size, size), dtype=np.int64)
+    filenom = os.path.join(directory, benchmark['renderer'])
+    renderer = benchmark['renderer']
+    if renderer == 'img':
+        drawing = draw_sp.SandpileImg(size, size, sandpile, filenom=filenom, sideLength=benchmark['pixelWidth'])
+        drawing.draw_sandbox()
+    elif renderer == 'svg':
+        drawing = draw_sp.SandpileSvg(size, size, sandpile, filenom=filenom, sideLength=benchmark['pixelWidth'])
+        drawing.draw_sandbox()
+    elif renderer == 'svgcompact':
+        drawing = draw_sp.SandpileSvgCompact(size, size, sandpile, filenom=filenom, sideLength=benchmark['pixelWidth'])
+        drawing.draw_sandbox()
+    else:
+        drawing = draw_sp.SandpileImgExtended(size, size, sandpile, filenom=filenom, sideLength=benchmark['pixelWidth'], lattice=renderer)
+        if renderer == 'hex':
+            drawing.draw_hex_sandbox()
+        elif renderer == 'tri':
+            drawing.draw_tri_sandbox()
+        else:
+            drawing.draw_tri_hex_sandbox()
+    return os.path.getsize(drawing.imgFilenom)
+
+def measure(group, benchmark, repeat):
+    '''
+    Runs one benchmark, returns its result dict: best wall time of the timed
+    runs, then peak traced memory (MB) and waves from one instrumented run.
+    '''
+    waves = [0]
+    def count_wave(pile, toppleCtr):
+        waves[0] += 1
+
+    with tempfile.TemporaryDirectory() as directory:
+        run = lambda progress: run_render(benchmark, directory) if group == 'render' else run_calculation(benchmark, progress)
+        bestTime = None
+        for _ in range(max(1, repeat)):
+            start = perf_counter()
+            output = run(None)
+            runTime = perf_counter() - start
+            bestTime = runTime if bestTime is None else min(bestTime, runTime)
+
+        tracemalloc.start()
+        run(count_wave)
+        peakMemory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    result = {'time': bestTime, 'peakMB': peakMemory / (1024 * 1024)}
+    if group == 'render':
+        result['fileMB'] = output / (1024 * 1024)
+    elif output is None:
+        result['error'] = 'No pile (unsupported neighborhood for this pile type)'
+    else:
+        topples = sst.pile_topples(output)
+        result.update({'topples': topples, 'topplesPerSec': topples / bestTime if bestTime > 0 else None, 'waves': waves[0] if waves[0] > 0 else None})
+    return result
+
+def machine_info():
+    return {'platform': platform.platform(), 'python': platform.python_version(), 'numpy': np.__version__, 'cpus': os.cpu_count()}
+
+def compare_to_baseline(results, baseline, tolerance):
+    '''
+    Prints each benchmark's time against the baseline run of the same name.
+    Returns the names of the regressed benchmarks.
+    '''
+    baseResults = {result['name']: result for result in baseline['results']}
+    regressions = []
+    print(f"Baseline from {baseline.get('created')} ({baseline.get('machine', {}).get('platform')})")
+    print('Benchmark                                          | Baseline (sec) |   Now (sec) |  Ratio | Status')
+    for result in results:
+        base = baseResults.get(result['name'])
+        if base is None or 'time' not in base or 'time' not in result:
+            continue
+        ratio = result['time'] / base['time'] if base['time'] > 0 else float('inf')
+        status = 'ok'
+        if base.get('topples') != result.get('topples'):
+            status = 'TOPPLES CHANGED'
+        elif ratio > tolerance:
+            status = 'REGRESSION'
+            regressions.append(result['name'])
+        elif ratio < 1.0 / tolerance:
+            status = 'faster'
+        print(f"{result['name'][:50]:50} | {base['time']:14.3f} | {result['time']:11.3f} | {ratio:5.2f}x | {status}")
+    missing = [name for name in baseResults if name not in set(result['name'] for result in results)]
+    if len(missing) > 0:
+        print(f'{len(missing)} baseline benchmark(s) not run.')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the sandpile calculations and renderers')
+    parser.add_argument('--groups', nargs='+', default=['lattices', 'neighborhoods', 'configs', 'render'], choices=['lattices', 'neighborhoods', 'configs', 'render'], help='Benchmark groups to run')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[51, 101], help='Pile sizes (side of a square pile or cube face, 2 * numRows for the icosahedron)')
+    parser.add_argument('--grains', nargs='+', type=int, default=[10000, 40000], help='Grains dropped on the center spot')
+    parser.add_argument('--engines', nargs='+', default=['scan'], help='Toppling engines to run each calculation with (scan, worklist, vectorized, parallel, presolve)')
+    parser.add_argument('--config-dir', type=str, default='pile_config', help='Directory of the config scenarios')
+    parser.add_argument('--pixel-width', type=int, default=4, help='Cell width in pixels for the render group')
+    parser.add_argument('-k', '--filter', type=str, default=None, help='Only run benchmarks whose name contains this text')
+    parser.add_argument('--repeat', type=int, default=1, help='Timed runs per benchmark (best time kept)')
+    parser.add_argument('-o', '--output', type=str, default=DEFAULT_RESULTS_PATH, help='Results JSON file')
+    parser.add_argument('--baseline', type=str, default=None, help='Earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='Slowdown ratio counted as a regression')
+    parser.add_argument('--update-baseline', action='store_true', help='If flag present, also write these results to the --baseline file')
+    args = parser.parse_args()
+
+    benchmarks = calculation_benchmarks(args.groups, args.sizes, args.grains, args.engines, args.config_dir)
+    if 'render' in args.groups:
+        benchmarks += render_benchmarks(args.sizes, args.pixel_width)
+    if args.filter is not None:
+        benchmarks = [benchmark for benchmark in benchmarks if args.filter in f'{benchmark[0]}/{benchmark[1]}']
+
+    results = []
+    print('Benchmark                                          | Time (sec) | Topples/sec | Peak (MB) | Waves')
+    for group, name, benchmark in benchmarks:
+        result = {'group': group, 'name': f'{group}/{name}'}
+        result.update(measure(group, benchmark, args.repeat))
+        results.append(result)
+        topplesPerSec = f"{result['topplesPerSec']:11.0f}" if result.get('topplesPerSec') is not None else f"{'-':>11}"
+        waves = result.get('waves') if result.get('waves') is not None else '-'
+        print(f"{result['name'][:50]:50} | {result['time']:10.3f} | {topplesPerSec} | {result['peakMB']:9.1f} | {waves}")
+
+    report = {'version': BENCHMARK_VERSION, 'created': strftime('%Y-%m-%d %H:%M:%S'), 'machine': machine_info(), 'results': results}
+    with open(args.output, 'w') as jsonFile:
+        json.dump(report, jsonFile, indent=4)
+    print(f'Wrote {len(results)} result(s) to {args.output}.')
+
+    regressions = []
+    if args.baseline is not None:
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as jsonFile:
+                regressions = compare_to_baseline(results, json.load(jsonFile), args.tolerance)
+        else:
+            print(f'No baseline at {args.baseline} yet.')
+        if args.update_baseline:
+            with open(args.baseline, 'w') as jsonFile:
+                json.dump(report, jsonFile, indent=4)
+            print(f'Updated baseline {args.baseline}.')
+    if len(regressions) > 0:
+        print(f'{len(regressions)} regression(s): {", ".join(regressions)}')
+        raise SystemExit(1)
+
+# Command: python .\benchmark_sandpiles.py --groups lattices render --sizes 51 --grains 10000 --baseline benchmark_baseline.json
+if __name__ == '__main__':
+	main()
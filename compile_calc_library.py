@@ -1,5 +1,12 @@
-from setuptools import setup
+import sys
+from setuptools import setup, Extension
 from Cython.Build import cythonize
 
+# OpenMP flags for the parallel (prange) engine
+openmpCompileArgs = ['/openmp'] if sys.platform == 'win32' else ['-fopenmp']
+openmpLinkArgs = [] if sys.platform == 'win32' else ['-fopenmp']
+
+calcLibrary = Extension('sandpile_calculations', ['sandpile_calculations.pyx'], extra_compile_args=openmpCompileArgs, extra_link_args=openmpLinkArgs)
+
 # Build command: python compile_calc_library.py build_ext --inplace
-setup(ext_modules = cythonize("sandpile_calculations.pyx", compiler_directives={'language_level': 3}))
\ No newline at end of file
+setup(ext_modules = cythonize([calcLibrary], compiler_directives={'language_level': 3}))
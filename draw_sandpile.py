@@ -1,9 +1,14 @@
-import tkinter as tk
 import numpy as np
 import math
-import svgwrite
 from PIL import Image, ImageColor, ImageDraw
 
+# tkinter, PIL.ImageTk and svgwrite are imported by the classes using them, so PNG
+# renders (export workers, sweep jobs) don't load the window and svgwrite backends
+
+SQRT3 = math.sqrt(3.0)
+RENDER_BAND_PIXELS = 1 << 22 # Pixels composited at once by the stamp renderers
+SVG_ROWS_PER_WRITE = 64 # Cell rows of path data written at once by SandpileSvgCompact
+
 # TODO: Add "light bright" (borders) feature to different lattices.
 # TODO: Fix outer-edge border to be same thickness as inner borders on images.
 # TODO: Add "corner borders (cross-stitch)" to tkinter render.
@@ -44,8 +49,13 @@ class SandpileTk():
             width = (xMax*sideLength)
         if height == None:
             height = (yMax*sideLength)
+        self.width = width
+        self.height = height
 
         self.title = title
+        self.photo = None
+        self.closed = False
+        import tkinter as tk
         self.root = tk.Tk()
         self.root.title(title)
         self.root.resizable(0, 0)
@@ -59,14 +69,37 @@ class SandpileTk():
         off = self.sideLength + 1
         self.canvas.create_rectangle(x+1, y+1, x+off, y+off, outline=self.borderColor, fill=self.colors[val], width=self.borderWidth)
 
+    def render_image(self):
+        # Whole preview rendered the same way as the PNG (palette lookup per cell, upscaled with the cell stamps)
+        sandpileImg = SandpileImg(self.xMax, self.yMax, self.sandpile, bound=self.bound, sink=self.sink, sideLength=self.sideLength, colors=self.colors, width=self.width, height=self.height, bgColor=self.bgColor, bWidth=self.borderWidth // 2, bColor=self.borderColor, bStyle=self.borderStyle)
+        return Image.fromarray(sandpileImg.render_pixels(), 'RGBA')
+
     def draw_sandbox(self):
-        for x in range(0, self.xMax):
-            for y in range(0, self.yMax):
-                drawPx = (self.sink[x, y] == 0) and (self.bound[x, y] == 1)
-                if drawPx == True:
-                    self.draw_pixel(x*self.sideLength, y*self.sideLength, self.sandpile[x, y])
+        # One PhotoImage holds the whole pile, instead of one canvas rectangle per cell
+        from PIL import ImageTk
+        self.photo = ImageTk.PhotoImage(self.render_image())
+        self.canvas.create_image(0, 0, anchor='nw', image=self.photo)
         self.root.update()
 
+    def update_sandbox(self, sandpile, bound=None, title=None):
+        # Redraws the window from a new pile, e.g. every few waves while toppling (live preview)
+        import tkinter as tk
+        if self.closed:
+            return
+        self.sandpile = np.mod(sandpile, len(self.colors))
+        if bound is not None:
+            self.bound = bound
+        try:
+            if self.photo is None:
+                self.draw_sandbox()
+            else:
+                self.photo.paste(self.render_image())
+            if title != None:
+                self.root.title(title)
+            self.root.update()
+        except tk.TclError: # Window closed, keep toppling without redrawing
+            self.closed = True
+
 class SandpileTkExtended(SandpileTk):
     def __init__(self, xMax, yMax, sandpile, bound=None, title="AbelianSandpile", sideLength=2, colors=None, bgColor=None, lattice='square'):
         width = xMax * sideLength
@@ -164,30 +197,44 @@ class SandpileImg():
         self.imgFilenom = filenom + '.png'
         self.imgFile = Image.new('RGBA', (math.ceil(width), math.ceil(height)), self.bgColor)
 
-    def draw_pixel(self, x, y, val):
-        offX = x * self.sideLength
-        offY = y * self.sideLength
-        bMin = 0 + self.borderWidth
-        bMax = self.sideLength - self.borderWidth
-        for i in range(0, self.sideLength):
-            for j in range(0, self.sideLength):
-                if self.borderStyle == 'all':
-                    if i < bMin or i >= bMax or j < bMin or j >= bMax:
-                        self.imgFile.putpixel((offX+i, offY+j), self.borderColor)
-                    else:
-                        self.imgFile.putpixel((offX+i, offY+j), self.imgColors[val])
-                elif self.borderStyle == 'corners':
-                    if (i >= bMin and i < bMax) or (j >= bMin and j < bMax):
-                        self.imgFile.putpixel((offX+i, offY+j), self.imgColors[val])
-                    else:
-                        self.imgFile.putpixel((offX+i, offY+j), self.borderColor)
+    def cell_stamps(self):
+        # Per-cell (sideLength x sideLength) masks: pixels drawn at all, and pixels drawn in the cell color (the rest are border)
+        offsets = np.arange(self.sideLength)
+        inside = (offsets >= self.borderWidth) & (offsets < (self.sideLength - self.borderWidth))
+        drawStamp = np.ones((self.sideLength, self.sideLength), dtype = bool)
+        if self.borderStyle == 'all':
+            colorStamp = inside[:, None] & inside[None, :]
+        elif self.borderStyle == 'corners':
+            colorStamp = inside[:, None] | inside[None, :]
+        else:
+            drawStamp[:, :] = False
+            colorStamp = drawStamp
+        return (drawStamp, colorStamp)
+
+    def render_pixels(self):
+        # Whole image as a (height, width, 4) RGBA array, built as one uint32 word per pixel
+        width, height = self.imgFile.size
+        bgPixel = np.array(ImageColor.getcolor(self.bgColor, 'RGBA'), dtype = np.uint8).view(np.uint32)
+        borderPixel = np.array(self.borderColor, dtype = np.uint8).view(np.uint32)
+        palette = np.array(self.imgColors, dtype = np.uint8).view(np.uint32)[:, 0]
+        drawStamp, colorStamp = self.cell_stamps()
+
+        # Cells as (row, pixel row, column, pixel column): palette lookup per cell, then the
+        # stamps broadcast over every cell pick the cell color, border or background
+        cellPixels = palette[self.sandpile].T[:, None, :, None]
+        drawCells = ((self.sink == 0) & (self.bound == 1)).T[:, None, :, None]
+        cellsImg = np.where(colorStamp.T[None, :, None, :], cellPixels, borderPixel)
+        cellsImg = np.where(drawCells & drawStamp.T[None, :, None, :], cellsImg, bgPixel)
+        cellsImg = cellsImg.reshape((self.yMax * self.sideLength, self.xMax * self.sideLength))
+
+        pixels = np.full((height, width), bgPixel[0], dtype = np.uint32)
+        pixelsY = min(height, cellsImg.shape[0])
+        pixelsX = min(width, cellsImg.shape[1])
+        pixels[:pixelsY, :pixelsX] = cellsImg[:pixelsY, :pixelsX]
+        return pixels.view(np.uint8).reshape((height, width, 4))
 
     def draw_sandbox(self):
-        for x in range(0, self.xMax):
-            for y in range(0, self.yMax):
-                drawPx = (self.sink[x, y] == 0) and (self.bound[x, y] == 1)
-                if drawPx == True:
-                    self.draw_pixel(x, y, self.sandpile[x, y])
+        self.imgFile = Image.fromarray(self.render_pixels(), 'RGBA')
         self.imgFile.save(self.imgFilenom, dpi=(300, 300))
 
 class SandpileImgExtended(SandpileImg):
@@ -207,106 +254,194 @@ class SandpileImgExtended(SandpileImg):
         super().__init__(xMax, yMax, sandpile, bound=bound, sink=sink, filenom=filenom, sideLength=sideLength, colors=colors, width=width, height=height, bgColor=bgColor)
         self.draw = ImageDraw.Draw(self.imgFile)
     
-    def draw_down_triangle(self, x, y, val):
+    def down_triangle_vertices(self, x, y):
         x1 = x + (self.sideLength / 2.0)
         x2 = x + self.sideLength
-        y1 = y + ((math.sqrt(3.0) / 2.0) * self.sideLength)
-        self.draw.polygon(((x,y),(x2,y),(x1,y1)), fill=self.imgColors[val])
+        y1 = y + ((SQRT3 / 2.0) * self.sideLength)
+        return ((x,y),(x2,y),(x1,y1))
 
-    def draw_up_triangle(self, x, y, val):
+    def up_triangle_vertices(self, x, y):
         x1 = x + (self.sideLength / 2.0)
         x2 = x + self.sideLength
-        y1 = y + ((math.sqrt(3.0) / 2.0) * self.sideLength)
-        self.draw.polygon(((x,y1),(x2,y1),(x1,y)), fill=self.imgColors[val])
+        y1 = y + ((SQRT3 / 2.0) * self.sideLength)
+        return ((x,y1),(x2,y1),(x1,y))
 
-    def draw_hexagon(self, x1, y1, val):
+    def hexagon_vertices(self, x1, y1):
         x0 = x1 - (0.5 * self.sideLength)
         x2 = x1 + self.sideLength
         x3 = x1 + (1.5 * self.sideLength)
-        y2 = y1 + ((math.sqrt(3.0) / 2.0) * self.sideLength)
-        y3 = y1 + (math.sqrt(3.0) * self.sideLength)
-        self.draw.polygon(((x0,y2),(x1,y1),(x2,y1),(x3,y2),(x2,y3),(x1,y3)), fill=self.imgColors[val])
+        y2 = y1 + ((SQRT3 / 2.0) * self.sideLength)
+        y3 = y1 + (SQRT3 * self.sideLength)
+        return ((x0,y2),(x1,y1),(x2,y1),(x3,y2),(x2,y3),(x1,y3))
 
-    def draw_horiz_diamond(self, x, y, val):
-        x1 = x + ((math.sqrt(3.0) / 2.0) * self.sideLength)
-        x2 = x + (math.sqrt(3.0) * self.sideLength)
+    def horiz_diamond_vertices(self, x, y):
+        x1 = x + ((SQRT3 / 2.0) * self.sideLength)
+        x2 = x + (SQRT3 * self.sideLength)
         y1 = y - (0.5 * self.sideLength)
         y2 = y + (0.5 * self.sideLength)
-        self.draw.polygon(((x,y),(x1,y1),(x2,y),(x1,y2)), fill=self.imgColors[val])
-    
-    def draw_left_diamond(self, x, y, val):
-        x1 = x + ((math.sqrt(3.0) / 2.0) * self.sideLength)
+        return ((x,y),(x1,y1),(x2,y),(x1,y2))
+
+    def left_diamond_vertices(self, x, y):
+        x1 = x + ((SQRT3 / 2.0) * self.sideLength)
         y1 = y - (0.5 * self.sideLength)
         y2 = y + (0.5 * self.sideLength)
         y3 = y + self.sideLength
-        self.draw.polygon(((x,y),(x1,y1),(x1,y2),(x,y3)), fill=self.imgColors[val])
+        return ((x,y),(x1,y1),(x1,y2),(x,y3))
 
-    def draw_right_diamond(self, x, y, val):
-        x1 = x + ((math.sqrt(3.0) / 2.0) * self.sideLength)
+    def right_diamond_vertices(self, x, y):
+        x1 = x + ((SQRT3 / 2.0) * self.sideLength)
         y1 = y + (0.5 * self.sideLength)
         y2 = y + (self.sideLength)
         y3 = y + (1.5 * self.sideLength)
-        self.draw.polygon(((x,y),(x1,y1),(x1,y3),(x,y2)), fill=self.imgColors[val])
+        return ((x,y),(x1,y1),(x1,y3),(x,y2))
+
+    def draw_down_triangle(self, x, y, val):
+        self.draw.polygon(self.down_triangle_vertices(x, y), fill=self.imgColors[val])
+
+    def draw_up_triangle(self, x, y, val):
+        self.draw.polygon(self.up_triangle_vertices(x, y), fill=self.imgColors[val])
+
+    def draw_hexagon(self, x1, y1, val):
+        self.draw.polygon(self.hexagon_vertices(x1, y1), fill=self.imgColors[val])
+
+    def draw_horiz_diamond(self, x, y, val):
+        self.draw.polygon(self.horiz_diamond_vertices(x, y), fill=self.imgColors[val])
+
+    def draw_left_diamond(self, x, y, val):
+        self.draw.polygon(self.left_diamond_vertices(x, y), fill=self.imgColors[val])
+
+    def draw_right_diamond(self, x, y, val):
+        self.draw.polygon(self.right_diamond_vertices(x, y), fill=self.imgColors[val])
+
+    '''
+    Stamp rendering:
+
+    Each lattice lists its drawn cells as groups of (draw order, cell value,
+    polygon vertices), vertices being arrays over the group's cells, with the
+    same float arithmetic as the per-cell polygons. Cells whose vertices are
+    equal relative to an integer pixel origin rasterize to the same pixels, so
+    each distinct shape and sub-pixel offset is drawn once with ImageDraw into
+    a stamp and then placed at every cell's origin. Where stamps overlap, the
+    cell drawn last in the per-cell loop wins, as with the per-cell polygons.
+    The image is composited in horizontal bands to bound memory.
+    '''
+
+    def polygon_stamp(self, vertices):
+        # Pixel (dx, dy) offsets covered by a polygon, vertices relative to its integer origin
+        width = math.ceil(max(vx for vx, vy in vertices)) + 2
+        height = math.ceil(max(vy for vx, vy in vertices)) + 2
+        stampImg = Image.new('L', (width, height), 0)
+        ImageDraw.Draw(stampImg).polygon(vertices, fill=1)
+        dy, dx = np.nonzero(np.asarray(stampImg))
+        return (dx, dy)
+
+    def stamp_placements(self, groups):
+        # (dx, dy, originX, originY, order) per distinct stamp, cells sorted by originY
+        placements = []
+        for order, vertices in groups:
+            if len(order) == 0:
+                continue
+            vertexArr = np.stack([np.stack(np.broadcast_arrays(vx, vy), axis=-1) for vx, vy in vertices], axis=1).astype(np.float64)
+            origin = np.floor(vertexArr.min(axis=1))
+            relative = vertexArr - origin[:, None, :]
+            keys, inverse = np.unique(relative.reshape((len(order), -1)), axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+            for keyIdx in range(len(keys)):
+                cells = np.flatnonzero(inverse == keyIdx)
+                cells = cells[np.argsort(origin[cells, 1], kind='stable')]
+                dx, dy = self.polygon_stamp([tuple(vertex) for vertex in keys[keyIdx].reshape((-1, 2))])
+                placements.append((dx, dy, origin[cells, 0].astype(np.int64), origin[cells, 1].astype(np.int64), order[cells]))
+        return placements
+
+    def render_polygons(self, groups, cellValues):
+        # cellValues[order] is the color index of the cell drawn at that order
+        width, height = self.imgFile.size
+        palette = np.array(self.imgColors, dtype = np.uint8).view(np.uint32)[:, 0]
+        placements = self.stamp_placements(groups)
+        bandRows = max(1, RENDER_BAND_PIXELS // max(1, width))
+
+        for rowStart in range(0, height, bandRows):
+            rowStop = min(height, rowStart + bandRows)
+            lastOrder = np.full((rowStop - rowStart) * width, -1, dtype = np.int64)
+            for dx, dy, originX, originY, order in placements:
+                if len(dy) == 0:
+                    continue
+                first = np.searchsorted(originY, rowStart - dy.max(), side='left')
+                last = np.searchsorted(originY, rowStop - dy.min(), side='left')
+                if first >= last:
+                    continue
+                cellX = originX[first:last]
+                cellY = originY[first:last]
+                cellOrder = order[first:last]
+
+                # Stamps fully inside the band and image place with one offset add, the rest are clipped per pixel
+                inside = (cellY + dy.min() >= rowStart) & (cellY + dy.max() < rowStop) & (cellX + dx.min() >= 0) & (cellX + dx.max() < width)
+                cellOffsets = ((cellY[inside] - rowStart) * width) + cellX[inside]
+                np.maximum.at(lastOrder, (cellOffsets[:, None] + ((dy * width) + dx)[None, :]).reshape(-1), np.repeat(cellOrder[inside], len(dy)))
+                if not inside.all():
+                    pixelX = cellX[~inside, None] + dx[None, :]
+                    pixelY = cellY[~inside, None] + dy[None, :]
+                    inBand = (pixelY >= rowStart) & (pixelY < rowStop) & (pixelX >= 0) & (pixelX < width)
+                    flatPixels = ((pixelY - rowStart) * width) + pixelX
+                    np.maximum.at(lastOrder, flatPixels[inBand], np.broadcast_to(cellOrder[~inside, None], inBand.shape)[inBand])
+
+            drawn = lastOrder >= 0
+            band = np.array(self.imgFile.crop((0, rowStart, width, rowStop)), dtype = np.uint8).view(np.uint32).reshape(-1)
+            band[drawn] = palette[cellValues[lastOrder[drawn]]]
+            self.imgFile.paste(Image.fromarray(band.view(np.uint8).reshape((rowStop - rowStart, width, 4)), 'RGBA'), (0, rowStart))
+
+    def lattice_cells(self, order='xy'):
+        # Drawn cells in the per-cell loop order ('xy' loops x then y, 'yx' loops y then x)
+        x, y = np.meshgrid(np.arange(self.xMax), np.arange(self.yMax), indexing='ij')
+        if order == 'yx':
+            x = x.T
+            y = y.T
+        x = x.reshape(-1)
+        y = y.reshape(-1)
+        drawPx = (self.sink[x, y] == 0) & (self.bound[x, y] == 1)
+        drawOrder = np.arange(len(x))
+        cellValues = self.sandpile[x, y]
+        return (x[drawPx], y[drawPx], drawOrder[drawPx], cellValues)
 
     def draw_hex_sandbox(self):
         downTriangle = 0
         if self.orientation == 'inverted':
             downTriangle = 1
-        for x in range(0, self.xMax):
-            for y in range(0, self.yMax):
-                drawPx = (self.sink[x, y] == 0) and (self.bound[x, y] == 1)
-                if drawPx == True:
-                    x1 = x * (self.sideLength / 2.0)
-                    y1 = y * (math.sqrt(3.0) / 2.0) * self.sideLength
-                    if (x+y) % 2 == downTriangle:
-                        self.draw_down_triangle(x1, y1, self.sandpile[x, y])
-                    else:
-                        self.draw_up_triangle(x1, y1, self.sandpile[x, y])
+        x, y, order, cellValues = self.lattice_cells()
+        x1 = x * (self.sideLength / 2.0)
+        y1 = y * (SQRT3 / 2.0) * self.sideLength
+        down = (x+y) % 2 == downTriangle
+        groups = [(order[down], self.down_triangle_vertices(x1[down], y1[down])), (order[~down], self.up_triangle_vertices(x1[~down], y1[~down]))]
+        self.render_polygons(groups, cellValues)
         self.imgFile.save(self.imgFilenom, dpi=(300, 300))
 
     def draw_tri_sandbox(self):
-        for x in range(0, self.xMax):
-            for y in range(0, self.yMax):
-                drawPx = (self.sink[x, y] == 0) and (self.bound[x, y] == 1)
-                if drawPx == True:
-                    x1 = (x * 1.5 * self.sideLength) + (0.5 * self.sideLength)
-                    y1 = (y * math.sqrt(3.0) * self.sideLength) + ((x % 2) * ((math.sqrt(3.0) / 2.0) * self.sideLength))
-                    self.draw_hexagon(x1, y1, self.sandpile[x, y])
+        x, y, order, cellValues = self.lattice_cells()
+        x1 = (x * 1.5 * self.sideLength) + (0.5 * self.sideLength)
+        y1 = (y * SQRT3 * self.sideLength) + ((x % 2) * ((SQRT3 / 2.0) * self.sideLength))
+        self.render_polygons([(order, self.hexagon_vertices(x1, y1))], cellValues)
         self.imgFile.save(self.imgFilenom, dpi=(300, 300))
-    
-    def draw_tri_hex_sandbox(self):
-        for y in range(self.yMax):
-            xStart = 0
-            xStep = 1
-            if y % 4 == 1:
-                xStart = 0
-                xStep = 2
-            if y % 4 == 3:
-                xStart = 1
-                xStep = 2
-            for x in range(xStart, self.xMax, xStep):
-                drawPx = (self.sink[x, y] == 0) and (self.bound[x, y] == 1)
-                if drawPx == True:
-                    x1 = x * ((math.sqrt(3.0) / 2.0) * self.sideLength)
-                    y1 = y * self.sideLength - (int(y/4) * self.sideLength)
-                    if x % 2 == 0:
-                        y1 = y1 + (0.5 * self.sideLength)
-                        if y % 4 == 2:
-                            y1 = y1 - self.sideLength
-
-                    if y % 2 == 1:
-                        self.draw_horiz_diamond(x1, y1, self.sandpile[x, y])
-                    if y % 4 == 0:
-                        if x % 2 == 0:
-                            self.draw_left_diamond(x1, y1, self.sandpile[x, y])
-                        else:
-                            self.draw_right_diamond(x1, y1, self.sandpile[x, y])
-                    elif y % 4 == 2:
-                        if x % 2 == 1:
-                            self.draw_left_diamond(x1, y1, self.sandpile[x, y])
-                        else:
-                            self.draw_right_diamond(x1, y1, self.sandpile[x, y])
 
+    def draw_tri_hex_sandbox(self):
+        x, y, order, cellValues = self.lattice_cells(order='yx')
+        # Rows y % 4 == 1 only draw even x, rows y % 4 == 3 only odd x
+        inRow = ((y % 4) % 2 == 0) | ((y % 4 == 1) & (x % 2 == 0)) | ((y % 4 == 3) & (x % 2 == 1))
+        x = x[inRow]
+        y = y[inRow]
+        order = order[inRow]
+
+        x1 = x * ((SQRT3 / 2.0) * self.sideLength)
+        y1 = ((y * self.sideLength) - ((y // 4) * self.sideLength)).astype(np.float64)
+        evenX = x % 2 == 0
+        y1[evenX] = y1[evenX] + (0.5 * self.sideLength)
+        shiftUp = evenX & (y % 4 == 2)
+        y1[shiftUp] = y1[shiftUp] - self.sideLength
+
+        horiz = y % 2 == 1
+        left = ((y % 4 == 0) & evenX) | ((y % 4 == 2) & ~evenX)
+        right = ((y % 4 == 0) & ~evenX) | ((y % 4 == 2) & evenX)
+        groups = [(order[horiz], self.horiz_diamond_vertices(x1[horiz], y1[horiz])), (order[left], self.left_diamond_vertices(x1[left], y1[left])), (order[right], self.right_diamond_vertices(x1[right], y1[right]))]
+        self.render_polygons(groups, cellValues)
         self.imgFile.save(self.imgFilenom, dpi=(300, 300))
 
 class SandpileSvg():
@@ -345,6 +480,7 @@ class SandpileSvg():
             height = (yMax*sideLength)
 
         self.imgFilenom = filenom + '.svg'
+        import svgwrite
         self.dwg = svgwrite.Drawing(self.imgFilenom, profile='full', size=(math.ceil(width), math.ceil(height)))
         self.dwg.viewbox(minx=0, miny=0, width=math.ceil(width), height= math.ceil(height))
         self.dwg.add(self.dwg.rect(insert=(0,0), size=(math.ceil(width), math.ceil(height)), fill=self.bgColor, stroke_width=0))
@@ -372,4 +508,81 @@ class SandpileSvg():
                 drawPx = (self.sink[x, y] == 0) and (self.bound[x, y] == 1)
                 if drawPx == True:
                     self.draw_pixel(x, y, self.sandpile[x, y])
-        self.dwg.saveas(self.imgFilenom, pretty=False, indent=4)
\ No newline at end of file
+        self.dwg.saveas(self.imgFilenom, pretty=False, indent=4)
+
+class SandpileSvgCompact():
+    def __init__(self, xMax, yMax, sandpile, bound=None, sink=None, filenom="AbelianSandpile", sideLength=2, colors=None, width=None, height=None, bgColor=None):
+        self.xMax = xMax
+        self.yMax = yMax
+        self.sideLength = sideLength
+
+        if colors == None:
+            colors = ['black', 'green', 'purple', 'gold']
+        self.colors = colors
+        numColors = len(colors)
+
+        self.bgColor = bgColor
+        if bgColor == None:
+            self.bgColor = colors[0]
+
+        modArray = np.full((xMax, yMax), numColors, dtype = np.uint32)
+        modPile = np.mod(sandpile, modArray)
+        self.sandpile = modPile
+
+        if bound is None:
+            bound = np.ones((xMax, yMax), dtype = np.uint8)
+        self.bound = bound
+
+        if sink is None:
+            sink = np.zeros((xMax, yMax), dtype = np.uint8)
+        self.sink = sink
+
+        if width == None:
+            width = (xMax*sideLength)
+        if height == None:
+            height = (yMax*sideLength)
+        self.width = math.ceil(width)
+        self.height = math.ceil(height)
+
+        self.imgFilenom = filenom + '.svg'
+
+    '''
+    Same picture as SandpileSvg, written without building an svgwrite tree.
+    Horizontal runs of equal cells are merged into one rectangle each and the
+    pile is written a band of SVG_ROWS_PER_WRITE rows at a time: the runs of
+    a band are found, then its rectangles of one color become a single path
+    under one <g fill=...> per color. Memory stays at the runs of one band.
+    '''
+    def cell_runs(self, yStart, yEnd):
+        # Runs of equal drawn cells along rows yStart to yEnd: (row, start column, length, value) arrays in row order
+        numRows = yEnd - yStart
+        drawn = (self.sink[:, yStart:yEnd] == 0) & (self.bound[:, yStart:yEnd] == 1)
+        values = np.where(drawn.T, self.sandpile[:, yStart:yEnd].T.astype(np.int64), -1)
+        runStarts = np.ones((numRows, self.xMax), dtype = bool)
+        runStarts[:, 1:] = values[:, 1:] != values[:, :-1]
+        rows, starts = np.nonzero(runStarts)
+        lengths = np.diff(np.append((rows * self.xMax) + starts, self.xMax * numRows)) # Every row starts a run, so runs never wrap
+        runValues = values[rows, starts]
+        drawnRuns = runValues >= 0
+        return (rows[drawnRuns] + yStart, starts[drawnRuns], lengths[drawnRuns], runValues[drawnRuns])
+
+    def draw_sandbox(self):
+        side = self.sideLength
+        with open(self.imgFilenom, 'w') as svgFile:
+            svgFile.write('<?xml version="1.0" encoding="utf-8" ?>\n')
+            svgFile.write(f'<svg baseProfile="full" height="{self.height}" version="1.1" viewBox="0,0,{self.width},{self.height}" width="{self.width}" xmlns="http://www.w3.org/2000/svg">')
+            svgFile.write(f'<rect fill="{self.bgColor}" height="{self.height}" stroke-width="0" width="{self.width}" x="0" y="0" />')
+            svgFile.write('<g shape-rendering="crispEdges" stroke-width="0">')
+            for yStart in range(0, self.yMax, SVG_ROWS_PER_WRITE):
+                rows, starts, lengths, values = self.cell_runs(yStart, min(yStart + SVG_ROWS_PER_WRITE, self.yMax))
+                for val, color in enumerate(self.colors):
+                    colorRuns = values == val
+                    if not colorRuns.any():
+                        continue
+                    runX = (starts[colorRuns] * side).tolist()
+                    runY = (rows[colorRuns] * side).tolist()
+                    runW = (lengths[colorRuns] * side).tolist()
+                    svgFile.write(f'<g fill="{color}"><path d="')
+                    svgFile.write(''.join([f'M{x} {y}h{w}v{side}h-{w}z' for x, y, w in zip(runX, runY, runW)]))
+                    svgFile.write('" /></g>')
+            svgFile.write('</g></svg>')
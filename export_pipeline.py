@@ -0,0 +1,133 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+'''
+Export pipeline for the files written after a pile is calculated (np.save
+of the pile arrays and the PNG renders).
+
+Every export is an independent job. With more than one worker the jobs go
+to a process pool as they are queued, so PNG encoding of the first images
+runs while main() is still preparing and queuing the rest. Arrays are not
+pickled to the workers: each job's arrays are copied once into shared
+memory blocks when it is queued (a snapshot, so the caller may keep
+changing its arrays), and the worker maps them back as numpy arrays. The
+blocks are freed when the pipeline closes. With one worker the jobs run in
+order in this process, as before.
+'''
+
+def resolve_workers(workers):
+    # 0 (or less) uses every core
+    if workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+class SharedArray():
+    # Picklable handle to an array copied into a shared memory block
+    def __init__(self, array, blocks):
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        self.name = block.name
+        self.shape = array.shape
+        self.dtype = array.dtype.str
+
+    def attach(self, blocks):
+        block = shared_memory.SharedMemory(name=self.name)
+        blocks.append(block)
+        return np.ndarray(self.shape, dtype=np.dtype(self.dtype), buffer=block.buf)
+
+def share_arrays(values, blocks):
+    # Replaces every array in a list or dict of job arguments (and in lists and dicts inside it) with a SharedArray
+    def share(value):
+        if isinstance(value, np.ndarray):
+            return SharedArray(value, blocks)
+        elif isinstance(value, list):
+            return [share(item) for item in value]
+        elif isinstance(value, dict):
+            return {key: share(item) for key, item in value.items()}
+        return value
+    if isinstance(values, dict):
+        return {key: share(value) for key, value in values.items()}
+    return [share(value) for value in values]
+
+def attach_arrays(values, blocks):
+    def attach(value):
+        if isinstance(value, SharedArray):
+            return value.attach(blocks)
+        elif isinstance(value, list):
+            return [attach(item) for item in value]
+        elif isinstance(value, dict):
+            return {key: attach(item) for key, item in value.items()}
+        return value
+    if isinstance(values, dict):
+        return {key: attach(value) for key, value in values.items()}
+    return [attach(value) for value in values]
+
+def run_job(function, args, kwargs):
+    function(*args, **kwargs)
+
+def run_shared_job(function, args, kwargs):
+    # Worker side: map the job's arrays from shared memory, run it, unmap
+    blocks = []
+    try:
+        run_job(function, attach_arrays(args, blocks), attach_arrays(kwargs, blocks))
+    finally:
+        for block in blocks:
+            try:
+                block.close()
+            except BufferError: # A failed job's traceback still holds a view, the block is unmapped at exit
+                pass
+
+def save_array(path, array):
+    np.save(path, array)
+
+def render_image(drawClass, drawMethod, args, kwargs):
+    getattr(drawClass(*args, **kwargs), drawMethod)()
+
+class ExportPipeline():
+    def __init__(self, workers=0):
+        self.workers = resolve_workers(workers)
+        self.executor = None
+        if self.workers > 1:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.futures = []
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close(wait=excType is None)
+        return False
+
+    def submit(self, function, *args, **kwargs):
+        if self.executor is None:
+            run_job(function, args, kwargs)
+        else:
+            self.futures.append(self.executor.submit(run_shared_job, function, share_arrays(args, self.blocks), share_arrays(kwargs, self.blocks)))
+
+    def save(self, path, array):
+        self.submit(save_array, path, array)
+
+    def render(self, drawClass, drawMethod, *args, **kwargs):
+        # Builds drawClass(*args, **kwargs) in a worker and calls its drawMethod (e.g. 'draw_sandbox')
+        self.submit(render_image, drawClass, drawMethod, list(args), kwargs)
+
+    def close(self, wait=True):
+        # Waits for every job (raising the first failure) and frees the shared memory
+        try:
+            if self.executor is not None:
+                if wait:
+                    for future in self.futures:
+                        future.result()
+                self.executor.shutdown(wait=True, cancel_futures=not wait)
+        finally:
+            self.executor = None
+            self.futures = []
+            for block in self.blocks:
+                block.close()
+                block.unlink()
+            self.blocks = []
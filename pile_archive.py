@@ -0,0 +1,273 @@
+import pile_metadata as pile_meta
+
+import argparse
+import json
+import os
+import zlib
+
+import numpy as np
+
+'''
+Single file pile archive (.spile) for the arrays a run saves.
+
+A stable pile holds values below the threshold and bounds are 0/1, so every
+array is stored as (value - min) in the fewest bits of 1, 2, 4, 8, 16, 32
+or 64 which hold its range. 1, 2 and 4 bit values are packed several to a
+byte. Each array is cut into chunks of whole rows (axis 0) of about
+CHUNK_CELLS cells, each packed (and zlib compressed if asked) on its own,
+so one array or a band of rows loads without decoding the rest.
+
+File layout:
+
+    MAGIC (8 bytes), header length (uint64 little endian), JSON header,
+    then the chunks, each array's chunks back to back from an offset
+    aligned to DATA_ALIGN bytes
+
+The header holds the run's pile metadata, the generating config, the topple
+count and for every array its shape, dtype, min, bits and chunk list
+([first row, last row + 1, file offset, byte size]).
+
+Written with packBits=False the values keep whole bytes (8, 16, 32 or 64
+bits) and non-negative arrays keep min 0. Arrays like that (whatever
+packBits) written uncompressed are plain little endian rows in the file and
+load as read only memory mapped views of that unsigned width (a pile or bound
+as uint8), nothing is decoded. Every other array is decoded a chunk at a
+time.
+'''
+
+MAGIC = b'SANDPILE'
+ARCHIVE_VERSION = 1
+ARCHIVE_SUFFIX = '.spile'
+CHUNK_CELLS = 1 << 20 # Cells per chunk (rounded to whole rows)
+DATA_ALIGN = 64
+PACKED_BITS = [1, 2, 4]
+
+def value_bits(span):
+    # Fewest of 1, 2, 4, 8, 16, 32, 64 bits holding 0 .. span
+    for bits in [1, 2, 4, 8, 16, 32]:
+        if span < (1 << bits):
+            return bits
+    return 64
+
+def pack_values(values, bits):
+    # values: unsigned array of (value - min), returns the chunk's bytes
+    if bits not in PACKED_BITS:
+        return values.astype(f'<u{bits // 8}').tobytes()
+    perByte = 8 // bits
+    padded = np.zeros(-(-len(values) // perByte) * perByte, dtype=np.uint8)
+    padded[:len(values)] = values
+    shifts = (np.arange(perByte, dtype=np.uint8) * bits)
+    return np.bitwise_or.reduce(padded.reshape((-1, perByte)) << shifts, axis=1).astype(np.uint8).tobytes()
+
+def unpack_values(data, bits, numValues):
+    if bits not in PACKED_BITS:
+        return np.frombuffer(data, dtype=f'<u{bits // 8}', count=numValues)
+    perByte = 8 // bits
+    packed = np.frombuffer(data, dtype=np.uint8)
+    shifts = (np.arange(perByte, dtype=np.uint8) * bits)
+    return ((packed[:, None] >> shifts) & ((1 << bits) - 1)).reshape(-1)[:numValues]
+
+def chunk_rows(shape):
+    rowCells = int(np.prod(shape[1:], dtype=np.int64)) if len(shape) > 1 else 1
+    return max(1, CHUNK_CELLS // max(1, rowCells))
+
+def encode_array(array, compress, packBits=True):
+    # Returns (array header entry without offsets, list of chunk bytes)
+    array = np.asarray(array)
+    dtype = array.dtype.str
+    if array.dtype == np.bool_:
+        array = array.astype(np.uint8)
+    shape = array.shape
+    if array.ndim == 0:
+        array = array.reshape(1)
+    minValue = int(array.min()) if array.size > 0 else 0
+    maxValue = int(array.max()) if array.size > 0 else 0
+    if not packBits and minValue >= 0:
+        minValue = 0 # Stored values are the values themselves
+    bits = value_bits(maxValue - minValue)
+    if not packBits:
+        bits = max(8, bits)
+    rows = chunk_rows(array.shape)
+    chunks = []
+    bounds = []
+    for start in range(0, max(1, array.shape[0]), rows):
+        stop = min(start + rows, array.shape[0])
+        values = (array[start:stop].reshape(-1).astype(np.int64) - minValue).astype(np.uint64)
+        data = pack_values(values, bits)
+        if compress:
+            data = zlib.compress(data)
+        chunks.append(data)
+        bounds.append((start, stop))
+    entry = {'shape': list(shape), 'dtype': dtype, 'min': minValue, 'bits': bits, 'compressed': bool(compress), 'chunks': bounds}
+    return (entry, chunks)
+
+def write_archive(path, arrays, header=None, compress=True, packBits=True):
+    '''
+    Writes a dict of named arrays and a JSON-able header dict (metadata,
+    config, toppleCtr, ...) to one archive file. With packBits=False and
+    compress=False the arrays are stored so they load as views (see above).
+    '''
+    encoded = {name: encode_array(array, compress, packBits) for name, array in arrays.items()}
+    archiveHeader = dict(header or {})
+    archiveHeader.update({'version': ARCHIVE_VERSION, 'arrays': {}})
+
+    # Chunk offsets depend on the header length, which depends on the offsets: lay out with room for the widest header
+    def layout(dataStart):
+        offset = dataStart
+        entries = {}
+        for name, (entry, chunks) in encoded.items():
+            offset = -(-offset // DATA_ALIGN) * DATA_ALIGN
+            entry = dict(entry)
+            chunkList = []
+            for (start, stop), data in zip(entry['chunks'], chunks):
+                chunkList.append([start, stop, offset, len(data)])
+                offset += len(data)
+            entry['chunks'] = chunkList
+            entries[name] = entry
+        archiveHeader['arrays'] = entries
+        return json.dumps(archiveHeader).encode('utf-8')
+
+    headerBytes = layout(1 << 62)
+    dataStart = -(-(len(MAGIC) + 8 + len(headerBytes)) // DATA_ALIGN) * DATA_ALIGN
+    headerBytes = layout(dataStart).ljust(dataStart - len(MAGIC) - 8)
+
+    tempPath = path + '.tmp'
+    with open(tempPath, 'wb') as archiveFile:
+        archiveFile.write(MAGIC)
+        archiveFile.write(len(headerBytes).to_bytes(8, 'little'))
+        archiveFile.write(headerBytes)
+        for name, (entry, chunks) in encoded.items():
+            for (start, stop, offset, size), data in zip(archiveHeader['arrays'][name]['chunks'], chunks):
+                archiveFile.seek(offset)
+                archiveFile.write(data)
+    os.replace(tempPath, path)
+
+class PileArchive():
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        if self.file.read(len(MAGIC)) != MAGIC:
+            self.file.close()
+            raise ValueError(f'{path} is not a pile archive')
+        headerLength = int.from_bytes(self.file.read(8), 'little')
+        self.header = json.loads(self.file.read(headerLength).decode('utf-8'))
+        if self.header.get('version') != ARCHIVE_VERSION:
+            self.file.close()
+            raise ValueError(f"Pile archive version {self.header.get('version')} is not {ARCHIVE_VERSION}")
+        self.entries = self.header['arrays']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        self.file.close()
+
+    def names(self):
+        return list(self.entries.keys())
+
+    def is_view(self, name):
+        # Uncompressed whole byte values with min 0, written with packBits=False
+        entry = self.entries[name]
+        return not (entry['compressed'] or entry['bits'] < 8 or entry['min'] != 0 or len(entry['shape']) == 0 or 0 in entry['shape'])
+
+    def read_chunk(self, entry, chunk):
+        start, stop, offset, size = chunk
+        self.file.seek(offset)
+        data = self.file.read(size)
+        if entry['compressed']:
+            data = zlib.decompress(data)
+        rowCells = int(np.prod(entry['shape'][1:], dtype=np.int64)) if len(entry['shape']) > 1 else 1
+        return unpack_values(data, entry['bits'], (stop - start) * rowCells)
+
+    def rows(self, name, start=0, stop=None):
+        '''
+        Rows start .. stop - 1 (axis 0) of an array in its saved dtype, only
+        the chunks covering them are read. Arrays which can be (see is_view)
+        come back as read only memory mapped views in their stored unsigned
+        width instead.
+        '''
+        entry = self.entries[name]
+        shape = tuple(entry['shape'])
+        if len(shape) == 0:
+            return np.array(entry['min'] + int(self.read_chunk(entry, entry['chunks'][0])[0]), dtype=np.dtype(entry['dtype']))
+        stop = shape[0] if stop is None else min(stop, shape[0])
+        start = max(0, min(start, stop))
+        if self.is_view(name):
+            view = np.memmap(self.path, dtype=f"<u{entry['bits'] // 8}", mode='r', offset=entry['chunks'][0][2], shape=shape)
+            return view[start:stop]
+        parts = []
+        for chunk in entry['chunks']:
+            if chunk[1] <= start or chunk[0] >= stop:
+                continue
+            values = self.read_chunk(entry, chunk).reshape((chunk[1] - chunk[0],) + shape[1:])
+            parts.append(values[max(start, chunk[0]) - chunk[0]:min(stop, chunk[1]) - chunk[0]])
+        if len(parts) == 0:
+            return np.zeros((0,) + shape[1:], dtype=np.dtype(entry['dtype']))
+        return (np.concatenate(parts).astype(np.int64) + entry['min']).astype(np.dtype(entry['dtype']))
+
+    def array(self, name):
+        return self.rows(name)
+
+    def load_all(self):
+        return {name: self.array(name) for name in self.names()}
+
+    def to_npy(self, name, path):
+        # Unpacks one array into a .npy file a chunk at a time (memory stays at one chunk), e.g. to memory map it
+        entry = self.entries[name]
+        output = np.lib.format.open_memmap(path, mode='w+', dtype=np.dtype(entry['dtype']), shape=tuple(entry['shape']))
+        if output.ndim == 0:
+            output[...] = self.rows(name)
+        else:
+            for start, stop, offset, size in entry['chunks']:
+                output[start:stop] = self.rows(name, start, stop)
+        output.flush()
+        del output
+
+def archive_path(filenom, directory='saved_piles'):
+    return os.path.join(directory, f'{filenom}{ARCHIVE_SUFFIX}')
+
+def saved_npy_files(metaPath):
+    # {array name: path} of the .npy files saved with a pile's _meta.json
+    metadata = pile_meta.load_pile_metadata(metaPath)
+    directory = os.path.dirname(metaPath)
+    filenom = os.path.basename(metaPath).removesuffix('_meta.json')
+    files = {name: os.path.join(directory, pile_meta.npy_file(filenom, name)) for name in pile_meta.saved_array_names(metadata['pileType'])}
+    return {name: path for name, path in files.items() if os.path.exists(path)}
+
+def convert_npy_files(metaPath, compress=True, packBits=True):
+    '''
+    Packs the .npy files of a saved pile (found from its _meta.json) into
+    one archive next to them. Returns the archive path, the .npy files are
+    left in place.
+    '''
+    metadata = pile_meta.load_pile_metadata(metaPath)
+    metadata.pop('files', None)
+    arrays = {name: np.load(path) for name, path in saved_npy_files(metaPath).items()}
+    path = archive_path(os.path.basename(metaPath).removesuffix('_meta.json'), os.path.dirname(metaPath))
+    write_archive(path, arrays, {'metadata': metadata}, compress=compress, packBits=packBits)
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack saved piles into .spile archives, or list an archive')
+    parser.add_argument('paths', nargs='+', help='saved_piles/*_meta.json files to pack, or .spile archives to list')
+    parser.add_argument('--no-compress', action='store_true', help='If flag present, store the packed chunks without zlib')
+    parser.add_argument('--no-pack', action='store_true', help='If flag present, keep whole byte values (with --no-compress the arrays load as memory mapped views)')
+    args = parser.parse_args()
+
+    for path in args.paths:
+        if path.endswith(ARCHIVE_SUFFIX):
+            with PileArchive(path) as archive:
+                print(f"{path}: {os.path.getsize(path)} bytes, topples {archive.header.get('toppleCtr')}")
+                for name, entry in archive.entries.items():
+                    print(f"    {name:<16} {str(tuple(entry['shape'])):<16} {entry['bits']:>2} bits, {len(entry['chunks'])} chunk(s), {sum(chunk[3] for chunk in entry['chunks'])} bytes")
+        else:
+            npySize = sum(os.path.getsize(npyPath) for npyPath in saved_npy_files(path).values())
+            archive = convert_npy_files(path, compress=not args.no_compress, packBits=not args.no_pack)
+            print(f'{archive}: {os.path.getsize(archive)} bytes ({npySize} bytes of .npy files, {npySize / max(1, os.path.getsize(archive)):.1f}x smaller).')
+
+if __name__ == '__main__':
+    main()
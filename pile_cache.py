@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+'''
+Content addressed cache of stabilized piles.
+
+Piles are keyed by a sha256 of the physics fields of the config (the same
+fields pile_metadata records: pile type, dimensions, neighborhood, grains,
+seed and the resolved drop spots, which come from the dropType params), so
+re-rendering with new colors, borders or pixel widths reuses the pile. The
+engine is not part of the key since every engine gives the same stable pile,
+a cached toppleCtr is the one of the engine that first computed it.
+
+Each entry is one .npz file holding the pile tuple returned by calculate_pile.
+Entries are evicted least recently used first (hits refresh the file's
+modification time) once the cache is over its size limit.
+'''
+
+DEFAULT_CACHE_DIR = 'pile_cache'
+DEFAULT_CACHE_SIZE_MB = 1024
+
+def pile_key(metadata):
+    physics = {field: metadata.get(field) for field in ['pileType', 'xMax', 'yMax', 'zMax', 'numRows', 'topple', 'grains', 'initialSeed', 'seedType', 'seedAttributes', 'dropSpots']}
+    canonical = json.dumps(physics, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def pack_pile_tuple(pileTuple):
+    # Pile tuple items are arrays, topple counters or lists of arrays (icosahedron faces)
+    packed = {}
+    for idx, item in enumerate(pileTuple):
+        if isinstance(item, np.ndarray):
+            packed[f'{idx}_array'] = item
+        elif isinstance(item, (list, tuple)):
+            packed[f'{idx}_list'] = np.stack(item)
+        else:
+            packed[f'{idx}_int'] = np.int64(item)
+    return packed
+
+def unpack_pile_tuple(packed):
+    items = []
+    for name in sorted(packed.files, key=lambda name: int(name.split('_')[0])):
+        kind = name.split('_')[1]
+        if kind == 'array':
+            items.append(packed[name])
+        elif kind == 'list':
+            items.append(list(packed[name]))
+        else:
+            items.append(int(packed[name]))
+    return tuple(items)
+
+class PileCache():
+    def __init__(self, directory=DEFAULT_CACHE_DIR, sizeLimitMB=DEFAULT_CACHE_SIZE_MB):
+        self.directory = directory
+        self.sizeLimit = int(sizeLimitMB * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, f'{key}.npz')
+
+    def get(self, metadata):
+        # Returns the cached pile tuple, or None on a miss
+        path = self.entry_path(pile_key(metadata))
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        with np.load(path) as packed:
+            pileTuple = unpack_pile_tuple(packed)
+        os.utime(path) # Most recently used
+        self.hits += 1
+        return pileTuple
+
+    def put(self, metadata, pileTuple):
+        key = pile_key(metadata)
+        tempPath = os.path.join(self.directory, f'{key}.tmp.npz')
+        np.savez(tempPath, **pack_pile_tuple(pileTuple))
+        os.replace(tempPath, self.entry_path(key))
+        self.evict()
+
+    def entries(self):
+        # (path, size, last used) for every entry, least recently used first
+        entries = []
+        for fileName in os.listdir(self.directory):
+            if fileName.endswith('.npz') and not fileName.endswith('.tmp.npz'):
+                path = os.path.join(self.directory, fileName)
+                fileStat = os.stat(path)
+                entries.append((path, fileStat.st_size, fileStat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def size(self):
+        return sum(entry[1] for entry in self.entries())
+
+    def evict(self):
+        entries = self.entries()
+        totalSize = sum(entry[1] for entry in entries)
+        for path, fileSize, _ in entries:
+            if totalSize <= self.sizeLimit:
+                break
+            os.remove(path)
+            totalSize -= fileSize
+
+    def report(self):
+        entries = self.entries()
+        sizeMB = sum(entry[1] for entry in entries) / (1024 * 1024)
+        return f'Pile cache: {self.hits} hit(s), {self.misses} miss(es), {len(entries)} entries, {sizeMB:.1f}/{self.sizeLimit / (1024 * 1024):.0f} MB.'
@@ -0,0 +1,112 @@
+import json
+import os
+from time import perf_counter
+
+import numpy as np
+
+'''
+Checkpoints for long runs of the square pile scan and worklist kernels.
+
+The pile (sandbox) and its bound (pileBorders) live in memory mapped .npy
+files in the checkpoint directory instead of arrays in memory, so a grid
+larger than RAM can topple from disk (the scan kernel keeps only the wave's
+unstable cells in memory). The kernels call the checkpoint after every wave,
+and every `every` waves or `seconds` seconds it copies both arrays into one
+of two snapshot slots, flushes them, then atomically replaces
+checkpoint.json (slot, wave index, topple count, pile metadata). The working
+files may hold half a wave when a run dies, the slot being written is never
+the one checkpoint.json names, so the last complete checkpoint is intact.
+
+Resuming copies the named slot back into the working files and the kernel
+carries on from its wave and topple count. Waves are toppled from the pile
+alone, so the resumed run ends with the same pile, bound, topples and waves
+as an uninterrupted one.
+
+Files: sandbox.npy and borders.npy (working), sandbox_{0,1}.npy and
+borders_{0,1}.npy (slots), checkpoint.json. Disk use is three times the pile.
+'''
+
+CHECKPOINT_VERSION = 1
+CHECKPOINT_SECONDS = 600.0 # Default time between checkpoints
+CHECKPOINT_FILE = 'checkpoint.json'
+COPY_CELLS = 1 << 22 # Cells copied at once between the working files and the slots
+
+def copy_rows(source, dest):
+    # Copies a memory mapped array in bands of rows, so memory stays at one band
+    rows = max(1, COPY_CELLS // max(1, source.shape[1]))
+    for start in range(0, source.shape[0], rows):
+        dest[start:start + rows] = source[start:start + rows]
+    dest.flush()
+
+def open_array(path, shape, dtype):
+    # Working or slot file, reused if it has the right shape
+    if os.path.exists(path):
+        array = np.load(path, mmap_mode='r+')
+        if array.shape == shape and array.dtype == dtype:
+            return array
+        del array
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+def load_state(directory):
+    path = os.path.join(directory, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as stateFile:
+        state = json.load(stateFile)
+    if state.get('version') != CHECKPOINT_VERSION:
+        raise ValueError(f"Checkpoint version {state.get('version')} is not {CHECKPOINT_VERSION}")
+    return state
+
+class PileCheckpoint():
+    def __init__(self, directory, shape, metadata, every=0, seconds=CHECKPOINT_SECONDS, resume=False):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.shape = tuple(shape)
+        self.metadata = metadata
+        self.every = int(every)
+        self.seconds = float(seconds)
+        self.state = load_state(directory) if resume else None
+        if not resume and os.path.exists(os.path.join(directory, CHECKPOINT_FILE)):
+            os.remove(os.path.join(directory, CHECKPOINT_FILE)) # A fresh run overwrites the slots of an old one
+        if self.state is not None and self.state['metadata'] != metadata:
+            raise ValueError(f'Checkpoint in {directory} is of a different pile')
+        self.resumed = self.state is not None
+        self.waves = self.state['waves'] if self.resumed else 0
+        self.topples = self.state['topples'] if self.resumed else 0
+        self.saves = 0
+        self.savedWaves = self.waves
+        self.lastSave = perf_counter()
+
+        self.sandbox = open_array(self.path('sandbox'), self.shape, np.dtype(np.int64))
+        self.borders = open_array(self.path('borders'), self.shape, np.dtype(np.uint8))
+        if self.resumed:
+            for name, array in [('sandbox', self.sandbox), ('borders', self.borders)]:
+                copy_rows(np.load(self.path(name, self.state['slot']), mmap_mode='r'), array)
+        else:
+            self.borders[...] = 0
+
+    def path(self, name, slot=None):
+        if slot is None:
+            return os.path.join(self.directory, f'{name}.npy')
+        return os.path.join(self.directory, f'{name}_{slot}.npy')
+
+    def __call__(self, waves, toppleCtr):
+        # Called by the kernels after each wave
+        if (self.every > 0 and waves - self.savedWaves >= self.every) or (self.seconds > 0 and perf_counter() - self.lastSave >= self.seconds):
+            self.save(waves, toppleCtr)
+
+    def save(self, waves, toppleCtr):
+        slot = 0 if self.state is None else 1 - self.state['slot']
+        for name, array in [('sandbox', self.sandbox), ('borders', self.borders)]:
+            copy_rows(array, open_array(self.path(name, slot), self.shape, array.dtype))
+        state = {'version': CHECKPOINT_VERSION, 'slot': slot, 'waves': int(waves), 'topples': int(toppleCtr), 'metadata': self.metadata}
+        tempPath = os.path.join(self.directory, CHECKPOINT_FILE + '.tmp')
+        with open(tempPath, 'w') as stateFile:
+            json.dump(state, stateFile, indent=4)
+            stateFile.flush()
+            os.fsync(stateFile.fileno())
+        os.replace(tempPath, os.path.join(self.directory, CHECKPOINT_FILE))
+        self.state = state
+        self.saves += 1
+        self.savedWaves = waves
+        self.lastSave = perf_counter()
@@ -0,0 +1,128 @@
+import json
+import os
+import numpy as np
+
+'''
+Metadata saved next to each stable pile in saved_piles/, so a later run can
+check a saved pile was made by a compatible setup before building on it
+(incremental stabilization adds grains to a saved pile instead of toppling
+from zero).
+
+Every field except grains must match for two piles to be compatible: the
+geometry, the neighborhood, the seed and the drop spots.
+'''
+
+PILE_METADATA_VERSION = 1
+COMPATIBLE_FIELDS = ['pileType', 'xMax', 'yMax', 'zMax', 'numRows', 'topple', 'initialSeed', 'seedType', 'seedAttributes', 'dropSpots']
+
+def pile_metadata(pileType, xMax, yMax, zMax, numRows, topple, grains, seed, seedType, seedAttr, dropSpots):
+    # Plain JSON values (tuples to lists) so a saved and a fresh copy compare equal
+    if dropSpots != None:
+        dropSpots = [list(drop) for drop in dropSpots]
+    if not isinstance(topple, str):
+        topple = [list(offset) for offset in topple]
+    if seedAttr != None:
+        seedAttr = list(seedAttr)
+    if pileType != 'cubesurface':
+        zMax = None
+    if pileType != 'icosahedronsurface':
+        numRows = None
+    return {'version': PILE_METADATA_VERSION, 'pileType': pileType, 'xMax': xMax, 'yMax': yMax, 'zMax': zMax, 'numRows': numRows,
+            'topple': topple, 'grains': grains, 'initialSeed': seed, 'seedType': seedType, 'seedAttributes': seedAttr, 'dropSpots': dropSpots}
+
+CUBE_FACES = ['front', 'back', 'left', 'right', 'top', 'bottom']
+
+def pile_names(pileType):
+    # Names of the arrays holding the raw stable pile for each pile type (the order calculate_pile takes them back in)
+    if pileType == 'cubesurface':
+        return list(CUBE_FACES)
+    elif pileType == 'icosahedronsurface':
+        return ['raw']
+    return ['pile']
+
+def saved_array_names(pileType):
+    # Every array a run saves for a pile type
+    if pileType == 'cubesurface':
+        return CUBE_FACES + ['flatcube', 'flatcube_bound'] + [f'{face}_bound' for face in CUBE_FACES]
+    elif pileType == 'icosahedronsurface':
+        return ['raw', 'strips', 'strips_bound', 'strips_rot', 'strips_rot_bound']
+    elif pileType == 'plane':
+        return ['pile', 'bound', 'offset']
+    return ['pile', 'bound']
+
+def npy_file(filenom, name):
+    # .npy file name of a saved array ('pile' is the bare filenom)
+    if name == 'pile':
+        return f'{filenom}.npy'
+    return f'{filenom}_{name}.npy'
+
+def pile_files(filenom, pileType):
+    return [npy_file(filenom, name) for name in pile_names(pileType)]
+
+def metadata_path(filenom, directory='saved_piles'):
+    return os.path.join(directory, f'{filenom}_meta.json')
+
+def save_pile_metadata(filenom, metadata, directory='saved_piles', archive=False):
+    # With archive the pile is in saved_piles/{filenom}.spile instead of .npy files
+    metadata = dict(metadata)
+    metadata['files'] = [f'{filenom}.spile'] if archive else pile_files(filenom, metadata['pileType'])
+    with open(metadata_path(filenom, directory), 'w') as jsonFile:
+        json.dump(metadata, jsonFile, indent=4)
+
+def load_pile_metadata(path):
+    with open(path) as jsonFile:
+        return json.load(jsonFile)
+
+def check_compatible(baseMetadata, metadata):
+    '''
+    Raises ValueError if the saved pile can't be grown into the requested one:
+    any setup field differs, or the saved pile has more grains.
+    '''
+    if baseMetadata.get('version') != PILE_METADATA_VERSION:
+        raise ValueError(f"Saved pile metadata version {baseMetadata.get('version')} is not {PILE_METADATA_VERSION}")
+    mismatched = [field for field in COMPATIBLE_FIELDS if baseMetadata.get(field) != metadata.get(field)]
+    if len(mismatched) > 0:
+        details = ', '.join(f'{field}: {baseMetadata.get(field)} != {metadata.get(field)}' for field in mismatched)
+        raise ValueError(f'Saved pile does not match this config ({details})')
+    if baseMetadata['grains'] > metadata['grains']:
+        raise ValueError(f"Saved pile has {baseMetadata['grains']} grains, more than the {metadata['grains']} requested")
+
+def load_base_pile(path, metadata):
+    '''
+    Loads the saved stable pile described by the metadata file at path (or
+    the pile archive at path) after checking it against this run's metadata.
+    Returns (basePile, baseGrains, baseBound) in the form calculate_pile
+    takes, baseBound is None if the pile type has no bound array saved.
+    '''
+    import pile_archive
+    directory = os.path.dirname(path)
+    if path.endswith(pile_archive.ARCHIVE_SUFFIX):
+        with pile_archive.PileArchive(path) as archive:
+            baseMetadata = archive.header['metadata']
+    else:
+        baseMetadata = load_pile_metadata(path)
+    check_compatible(baseMetadata, metadata)
+    names = pile_names(baseMetadata['pileType'])
+
+    baseBound = None
+    files = baseMetadata.get('files') or []
+    archivePath = None
+    if path.endswith(pile_archive.ARCHIVE_SUFFIX):
+        archivePath = path
+    elif len(files) == 0:
+        raise ValueError(f'{path} lists no saved pile files')
+    elif files[0].endswith(pile_archive.ARCHIVE_SUFFIX):
+        archivePath = os.path.join(directory, files[0])
+    if archivePath is not None:
+        with pile_archive.PileArchive(archivePath) as archive:
+            arrays = [np.array(archive.array(name), dtype=np.int64) for name in names]
+            if baseMetadata['pileType'] == 'square' and 'bound' in archive.names():
+                baseBound = np.array(archive.array('bound'))
+    else:
+        arrays = [np.load(os.path.join(directory, fileName)) for fileName in files]
+        boundPath = os.path.join(directory, files[0].replace('.npy', '_bound.npy'))
+        if baseMetadata['pileType'] == 'square' and os.path.exists(boundPath):
+            baseBound = np.load(boundPath)
+    if baseMetadata['pileType'] == 'cubesurface':
+        return ((np.stack(arrays[0:2]), np.stack(arrays[2:4]), np.stack(arrays[4:6])), baseMetadata['grains'], None)
+    return (arrays[0], baseMetadata['grains'], baseBound)
@@ -0,0 +1,320 @@
+import draw_sandpile as draw_sp
+import export_pipeline
+import pile_archive
+import pile_metadata as pile_meta
+
+import argparse
+import json
+import math
+import os
+import struct
+import tempfile
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from time import perf_counter
+
+import numpy as np
+from PIL import Image
+
+'''
+Re-renders a saved square cell pile (square, cylinder, torus and plane piles,
+cube faces and the unfolded cube) from saved_piles/ without building the whole
+image in memory.
+
+The pile and its bound are memory mapped (.npy files directly, archive arrays
+through a .npy copy unpacked a chunk at a time), and the image is drawn in
+tiles with SandpileImg, so each tile's pixels equal the same part of the full
+render. Output is either:
+
+    png: one PNG written band by band. Each band of pixel rows is rendered
+         and deflated in a worker, the bands are joined into one zlib
+         stream (adler32 checksums combined) in order.
+    dzi: a Deep Zoom pyramid, {name}.dzi and {name}_files/{level}/{col}_{row}.png,
+         the top level rendered from the pile and every lower level
+         box filtered from the 2x2 tiles above it.
+
+Memory stays at a few bands or tiles per worker whatever the image size.
+Hex lattice arrays (icosahedron strips) are drawn per triangle and are not
+supported.
+'''
+
+DEFAULT_TILE_SIZE = 256 # Deep Zoom tile size (pixels)
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_DPI = 300 # Same as SandpileImg.draw_sandbox
+ADLER_BASE = 65521
+JOB_WINDOW = 2 # Jobs in flight per worker (bounds the bands waiting to be written)
+RENDER_FORMATS = ['png', 'dzi']
+
+'''
+############
+Pile Sources
+############
+'''
+
+def bound_name(name):
+    # Saved bound array of a pile array ('pile' -> 'bound', 'flatcube' -> 'flatcube_bound')
+    if name == 'pile':
+        return 'bound'
+    return f'{name}_bound'
+
+def default_array(pileType):
+    if pileType == 'cubesurface':
+        return 'flatcube'
+    elif pileType == 'icosahedronsurface':
+        raise ValueError('Icosahedron piles are drawn on a hex lattice, re-render them with sandpile_surface_toppling.py')
+    return 'pile'
+
+@lru_cache(maxsize=8)
+def open_array(path):
+    # Read only memory map, once per process
+    return np.load(path, mmap_mode='r')
+
+def open_source(path, name=None, scratch=None):
+    '''
+    Finds the pile array (and its bound) of a saved pile: a _meta.json file,
+    a .spile archive or a bare .npy file. Returns ({'pile': npy path,
+    'bound': npy path or None}, metadata, config). Archive arrays are
+    unpacked into .npy files in scratch, to be memory mapped.
+    '''
+    metadata = {}
+    config = {}
+    if path.endswith('_meta.json'):
+        metadata = pile_meta.load_pile_metadata(path)
+        files = metadata.get('files') or []
+        directory = os.path.dirname(path)
+        if len(files) > 0 and files[0].endswith(pile_archive.ARCHIVE_SUFFIX):
+            path = os.path.join(directory, files[0])
+        else:
+            name = name or default_array(metadata['pileType'])
+            filenom = os.path.basename(path).removesuffix('_meta.json')
+            pilePath = os.path.join(directory, pile_meta.npy_file(filenom, name))
+            boundPath = os.path.join(directory, pile_meta.npy_file(filenom, bound_name(name)))
+            return ({'pile': pilePath, 'bound': boundPath if os.path.exists(boundPath) else None}, metadata, config)
+
+    if path.endswith(pile_archive.ARCHIVE_SUFFIX):
+        with pile_archive.PileArchive(path) as archive:
+            metadata = archive.header.get('metadata') or metadata
+            config = archive.header.get('config') or {}
+            name = name or default_array(metadata.get('pileType'))
+            if name not in archive.names():
+                raise ValueError(f'{path} has no array {name} ({", ".join(archive.names())})')
+            paths = {'pile': None, 'bound': None}
+            for key, arrayName in [('pile', name), ('bound', bound_name(name))]:
+                if arrayName not in archive.names():
+                    continue
+                npyPath = os.path.join(scratch, f'{arrayName}.npy')
+                archive.to_npy(arrayName, npyPath)
+                paths[key] = npyPath
+            return (paths, metadata, config)
+
+    boundPath = path.removesuffix('.npy') + '_bound.npy'
+    return ({'pile': path, 'bound': boundPath if os.path.exists(boundPath) else None}, metadata, config)
+
+def render_settings(spData, sideLength=None):
+    # Drawing fields of a run config, as in sandpile_surface_toppling.main
+    borderData = spData.get('border') or {}
+    return {'sideLength': int(sideLength or spData.get('imagePixelWidth') or 1), 'colors': spData.get('colors') or None,
+            'bgColor': spData.get('backgroundColor') or None, 'bWidth': borderData.get('width') or 0,
+            'bColor': borderData.get('color') or '#000000', 'bStyle': borderData.get('style') or 'all',
+            'drawBounded': spData.get('drawBounded') != False}
+
+def image_size(paths, settings):
+    xMax, yMax = open_array(paths['pile']).shape
+    return (xMax * settings['sideLength'], yMax * settings['sideLength'])
+
+'''
+#########
+Rendering
+#########
+'''
+
+def render_tile(paths, settings, px, py, width, height):
+    # (height, width, 4) RGBA pixels at (px, py), drawn from the cells covering them
+    side = settings['sideLength']
+    pile = open_array(paths['pile'])
+    x0 = px // side
+    x1 = min(pile.shape[0], -(-(px + width) // side))
+    y0 = py // side
+    y1 = min(pile.shape[1], -(-(py + height) // side))
+    bound = None
+    if settings['drawBounded'] and paths['bound'] is not None:
+        bound = open_array(paths['bound'])[x0:x1, y0:y1]
+    cellsImg = draw_sp.SandpileImg(x1 - x0, y1 - y0, pile[x0:x1, y0:y1], bound=bound, sideLength=side, colors=settings['colors'],
+                                   bgColor=settings['bgColor'], bWidth=settings['bWidth'], bColor=settings['bColor'], bStyle=settings['bStyle'])
+    pixels = cellsImg.render_pixels()
+    offsetX = px - (x0 * side)
+    offsetY = py - (y0 * side)
+    return pixels[offsetY:offsetY + height, offsetX:offsetX + width]
+
+def run_jobs(executor, function, argsList, workers):
+    # Results of function(*args) in order, with at most JOB_WINDOW jobs per worker in flight
+    if executor is None:
+        for args in argsList:
+            yield function(*args)
+        return
+    pending = deque()
+    for args in argsList:
+        pending.append(executor.submit(function, *args))
+        if len(pending) >= JOB_WINDOW * workers:
+            yield pending.popleft().result()
+    while len(pending) > 0:
+        yield pending.popleft().result()
+
+'''
+#########
+PNG Bands
+#########
+'''
+
+def adler32_combine(adler1, adler2, length2):
+    # adler32 of A + B from adler32(A), adler32(B) and len(B), as zlib's adler32_combine
+    remainder = length2 % ADLER_BASE
+    sum1 = adler1 & 0xffff
+    sum2 = (remainder * sum1) % ADLER_BASE
+    sum1 += (adler2 & 0xffff) + ADLER_BASE - 1
+    sum2 += (adler1 >> 16) + (adler2 >> 16) + ADLER_BASE - remainder
+    return ((sum2 % ADLER_BASE) << 16) | (sum1 % ADLER_BASE)
+
+def png_chunk(chunkType, data):
+    return struct.pack('>I', len(data)) + chunkType + data + struct.pack('>I', zlib.crc32(chunkType + data))
+
+def encode_band(paths, settings, py, height, level):
+    '''
+    Renders pixel rows py .. py + height - 1 and deflates them (filter byte
+    0 per row) as raw deflate blocks ending on a byte boundary, so bands
+    can be joined in one stream. Returns (deflated bytes, adler32, length).
+    '''
+    width = image_size(paths, settings)[0]
+    pixels = render_tile(paths, settings, 0, py, width, height)
+    rows = np.zeros((height, (width * 4) + 1), dtype=np.uint8)
+    rows[:, 1:] = pixels.reshape((height, width * 4))
+    raw = rows.tobytes()
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return (compressor.compress(raw) + compressor.flush(zlib.Z_SYNC_FLUSH), zlib.adler32(raw), len(raw))
+
+def write_png(paths, settings, output, executor=None, workers=1, level=6):
+    width, height = image_size(paths, settings)
+    side = settings['sideLength']
+    bandRows = max(side, ((draw_sp.RENDER_BAND_PIXELS // max(1, width)) // side) * side)
+    bands = [(paths, settings, py, min(bandRows, height - py), level) for py in range(0, height, bandRows)]
+    pixelsPerMeter = int((PNG_DPI / 0.0254) + 0.5)
+
+    tempPath = output + '.tmp'
+    with open(tempPath, 'wb') as pngFile:
+        pngFile.write(PNG_SIGNATURE)
+        pngFile.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)))
+        pngFile.write(png_chunk(b'pHYs', struct.pack('>IIB', pixelsPerMeter, pixelsPerMeter, 1)))
+        pngFile.write(png_chunk(b'IDAT', b'\x78\x9c'))
+        adler = 1
+        for data, bandAdler, length in run_jobs(executor, encode_band, bands, workers):
+            pngFile.write(png_chunk(b'IDAT', data))
+            adler = adler32_combine(adler, bandAdler, length)
+        # Empty final deflate block, then the zlib checksum
+        pngFile.write(png_chunk(b'IDAT', b'\x03\x00' + struct.pack('>I', adler)))
+        pngFile.write(png_chunk(b'IEND', b''))
+    os.replace(tempPath, output)
+    return len(bands)
+
+'''
+##################
+Deep Zoom Pyramids
+##################
+'''
+
+def level_size(width, height, level, maxLevel):
+    scale = 1 << (maxLevel - level)
+    return (-(-width // scale), -(-height // scale))
+
+def tile_path(tilesDir, level, col, row):
+    return os.path.join(tilesDir, str(level), f'{col}_{row}.png')
+
+def write_top_tile(paths, settings, tilesDir, level, col, row, tileSize, width, height):
+    px = col * tileSize
+    py = row * tileSize
+    pixels = render_tile(paths, settings, px, py, min(tileSize, width - px), min(tileSize, height - py))
+    Image.fromarray(np.ascontiguousarray(pixels), 'RGBA').save(tile_path(tilesDir, level, col, row))
+
+def write_reduced_tile(tilesDir, level, col, row, tileSize, upperWidth, upperHeight):
+    # Tile of a lower level: the (up to) 2x2 tiles of the level above (upperWidth x upperHeight pixels), box filtered to half size
+    px = col * tileSize * 2
+    py = row * tileSize * 2
+    canvas = Image.new('RGBA', (min(2 * tileSize, upperWidth - px), min(2 * tileSize, upperHeight - py)))
+    for dx in range(2):
+        for dy in range(2):
+            if px + (dx * tileSize) < upperWidth and py + (dy * tileSize) < upperHeight:
+                with Image.open(tile_path(tilesDir, level + 1, (2 * col) + dx, (2 * row) + dy)) as upperTile:
+                    canvas.paste(upperTile, (dx * tileSize, dy * tileSize))
+    canvas.reduce(2).save(tile_path(tilesDir, level, col, row))
+
+def write_dzi(paths, settings, output, tileSize=DEFAULT_TILE_SIZE, executor=None, workers=1):
+    width, height = image_size(paths, settings)
+    maxLevel = max(0, math.ceil(math.log2(max(width, height))))
+    tilesDir = output.removesuffix('.dzi') + '_files'
+    numTiles = 0
+    for level in range(maxLevel, -1, -1):
+        levelWidth, levelHeight = level_size(width, height, level, maxLevel)
+        os.makedirs(os.path.join(tilesDir, str(level)), exist_ok=True)
+        tiles = [(col, row) for row in range(-(-levelHeight // tileSize)) for col in range(-(-levelWidth // tileSize))]
+        if level == maxLevel:
+            jobs = [(paths, settings, tilesDir, level, col, row, tileSize, width, height) for col, row in tiles]
+            function = write_top_tile
+        else:
+            upperSize = level_size(width, height, level + 1, maxLevel)
+            jobs = [(tilesDir, level, col, row, tileSize) + upperSize for col, row in tiles]
+            function = write_reduced_tile
+        for _ in run_jobs(executor, function, jobs, workers):
+            pass
+        numTiles += len(tiles)
+
+    with open(output, 'w') as dziFile:
+        dziFile.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        dziFile.write(f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="png" Overlap="0" TileSize="{tileSize}">\n')
+        dziFile.write(f'    <Size Width="{width}" Height="{height}"/>\n')
+        dziFile.write('</Image>\n')
+    return numTiles
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-render a saved pile in tiles, as a PNG written band by band or a Deep Zoom pyramid')
+    parser.add_argument('pile', type=str, help='Saved pile: saved_piles/*_meta.json, saved_piles/*.spile or a .npy pile')
+    parser.add_argument('-f', '--format', type=str, default='png', choices=RENDER_FORMATS, help='Striped PNG or Deep Zoom (.dzi) tile pyramid')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Output file (default images/{name}.png or images/{name}.dzi)')
+    parser.add_argument('--array', type=str, default=None, help='Saved array to draw (default pile, flatcube for cube surfaces)')
+    parser.add_argument('--config', type=str, default=None, help='Config JSON with the colors and borders (default the config saved in the archive)')
+    parser.add_argument('--pixel-width', type=int, default=None, help='Pixels per cell (overrides imagePixelWidth)')
+    parser.add_argument('--tile-size', type=int, default=DEFAULT_TILE_SIZE, help='Deep Zoom tile size (pixels)')
+    parser.add_argument('--level', type=int, default=6, help='PNG zlib compression level')
+    parser.add_argument('-w', '--workers', type=int, default=0, help='Processes rendering tiles (0 uses every core, 1 renders in this process)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='render_tiles_') as scratch:
+        paths, metadata, config = open_source(args.pile, args.array, scratch)
+        if args.config is not None:
+            with open(args.config) as configFile:
+                config = json.load(configFile)
+        settings = render_settings(config, args.pixel_width)
+        name = os.path.basename(args.pile).removesuffix('_meta.json').removesuffix(pile_archive.ARCHIVE_SUFFIX).removesuffix('.npy')
+        if args.array is not None:
+            name = f'{name}_{args.array}'
+        output = args.output or f'images/{name}.{args.format}'
+        width, height = image_size(paths, settings)
+
+        workers = export_pipeline.resolve_workers(args.workers)
+        executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        start = perf_counter()
+        try:
+            if args.format == 'png':
+                numJobs = write_png(paths, settings, output, executor, workers, args.level)
+                unit = 'bands'
+            else:
+                numJobs = write_dzi(paths, settings, output, args.tile_size, executor, workers)
+                unit = 'tiles'
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        renderTime = perf_counter() - start
+        print(f'{output}: {width} x {height} pixels, {numJobs} {unit} in {renderTime:.3f} sec ({width * height / max(renderTime, 1e-9) / 1e6:.1f} Mpixels/sec, {workers} worker(s)).')
+
+if __name__ == '__main__':
+    main()
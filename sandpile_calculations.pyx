@@ -1,6 +1,13 @@
 import numpy as np
-from cython import boundscheck, wraparound
+from cython import boundscheck, wraparound, cdivision
+from cython.parallel cimport prange, parallel
+from libc.stdlib cimport qsort
+from cpython.time cimport perf_counter
+import os
+from functools import lru_cache
 from random import randint
+from time import time
+from sandpile_layouts import extract_icosahedron_faces
 
 # TODO: Refresh understanding of boundscheck, wraparound (determine if they need to be in front of every function)
 # TODO: ?? Convert pile tuple return to class ?? (Probably only if continue to add more params to return)
@@ -20,33 +27,326 @@ different seed quantities and configurations.
 # Calculate Sandpiles #
 #######################
 
+PROGRESS_WAVES = 100
+
+'''
+Progress callbacks: the scan and worklist kernels of square and wrap-around
+piles call progress(sandpile, toppleCtr) every progressWaves waves with the
+pile as it stands mid-toppling (the live tkinter preview redraws from it).
+The vectorized, parallel and presolve engines run without callbacks.
+'''
+
+'''
+Wave Metrics: the same kernels (and the worklist engine of the cube and
+icosahedron piles) call metrics(record) after every wave if metrics is
+given. The cube and icosahedron scan kernels are not instrumented, with
+metrics given those piles topple on the graph worklist kernel instead (same
+stable pile and topple count). The vectorized, parallel and presolve engines
+are not instrumented either. The record is a dict of:
+
+wave        waves so far (restarts at 1 for each multiscale level)
+unstable    cells toppled in the wave
+topples     toppleCtr so far
+excess      grains above the stable height in those cells as they toppled
+lost        grains sent off a bounded edge in the wave
+scanTime    seconds finding unstable cells (the np.where before the
+            wave, or collecting the worklist after it)
+relaxTime   seconds toppling the wave's cells
+touched     cells flagged in pileBorders so far
+bbox        [x0, x1, y0, y1] (inclusive) of the flagged cells, None for the
+            flat cube graph
+
+The wrap-around scan kernel keeps no pileBorders, its touched and bbox cover
+the cells which toppled. With metrics=None none of it is counted or timed.
+'''
+
+'''
+Checkpoints: the scan and worklist kernels of square piles take a
+checkpoint (see pile_checkpoint.PileCheckpoint) whose memory mapped borders
+array they use as pileBorders, starting their wave and topple counts from
+its waves and topples, and call checkpoint(waves, toppleCtr) after every
+wave. calculate_sandpile_grid_seeded seeds the pile into its memory mapped
+sandbox array (or leaves a resumed one as it is).
+'''
+
+cdef struct WaveStats:
+    long long excess
+    long long lost
+    long long touched
+    long long x0
+    long long x1
+    long long y0
+    long long y1
+    double scanTime
+    double relaxTime
+
+cdef inline void reset_wave(WaveStats* waveStats) noexcept nogil:
+    waveStats.excess = 0
+    waveStats.lost = 0
+    waveStats.scanTime = 0
+    waveStats.relaxTime = 0
+
+cdef inline void reset_stats(WaveStats* waveStats) noexcept nogil:
+    reset_wave(waveStats)
+    waveStats.touched = 0
+    waveStats.x0 = -1
+    waveStats.x1 = -1
+    waveStats.y0 = -1
+    waveStats.y1 = -1
+
+cdef inline void touch_cell(WaveStats* waveStats, long long x, long long y) noexcept nogil:
+    # Counts a newly flagged cell and grows the bounding box around it
+    if waveStats.touched == 0 or x < waveStats.x0:
+        waveStats.x0 = x
+    if waveStats.touched == 0 or x > waveStats.x1:
+        waveStats.x1 = x
+    if waveStats.touched == 0 or y < waveStats.y0:
+        waveStats.y0 = y
+    if waveStats.touched == 0 or y > waveStats.y1:
+        waveStats.y1 = y
+    waveStats.touched += 1
+
+cdef dict wave_record(long long waves, long long numUnstable, long long toppleCtr, WaveStats* waveStats, bint hasBox):
+    bbox = None
+    if hasBox and waveStats.touched > 0:
+        bbox = [waveStats.x0, waveStats.x1, waveStats.y0, waveStats.y1]
+    return {'wave': waves, 'unstable': numUnstable, 'topples': toppleCtr, 'excess': waveStats.excess, 'lost': waveStats.lost,
+            'scanTime': waveStats.scanTime, 'relaxTime': waveStats.relaxTime, 'touched': waveStats.touched, 'bbox': bbox}
+
 @boundscheck(False)
 @wraparound(False)
-def calculate_sandpile_grid_seeded(int xMax, int yMax, int grains, neighbors, list dropSpots=None, int seed=0, seedType='uniform', seedAttr=None):
-    sandbox = np.full((xMax, yMax), seed, dtype = np.int64)
-    if seedType == 'checker':
-        sandbox = checkerboard_seed(xMax, yMax, sandbox, seedAttr)
-    sandbox = drop_all_grains(xMax, yMax, grains, sandbox, dropSpots)
-    if neighbors == "von_neumann" or neighbors == "von_neumann2" or neighbors == "xcross" or neighbors == "knightleft" or neighbors == "knightright":
-        return topple_grid_algorithm2_neighborhoods_bounded(xMax, yMax, sandbox, neighbors, 4)
-    elif neighbors == "moore" or neighbors == "moore2" or neighbors == "knight" or neighbors == "knightsweepleft" or neighbors == "knightsweepright":
-        return topple_grid_algorithm2_neighborhoods_bounded(xMax, yMax, sandbox, neighbors, 8)
-    elif neighbors == "pinwheelleft" or neighbors == "pinwheelright" or neighbors == "8cross" or neighbors == "8pointstar":
-        return topple_grid_algorithm2_neighborhoods_bounded(xMax, yMax, sandbox, neighbors, 8)
+def calculate_sandpile_grid_seeded(int xMax, int yMax, int grains, neighbors, list dropSpots=None, int seed=0, seedType='uniform', seedAttr=None, engine='scan', int threads=0, multiscale=False, stats=None, basePile=None, int baseGrains=0, progress=None, long long progressWaves=PROGRESS_WAVES, metrics=None, symmetry='none', checkpoint=None):
+    if checkpoint is not None and (engine not in ['scan', 'worklist'] or multiscale or symmetry != 'none'):
+        raise ValueError('Checkpoints need the scan or worklist engine, without multiscale or symmetry')
+    if checkpoint is not None and checkpoint.resumed:
+        sandbox = checkpoint.sandbox
+    else:
+        sandbox = seeded_grid(xMax, yMax, grains, dropSpots, seed, seedType, seedAttr, checkpoint.sandbox if checkpoint is not None else None)
+    if basePile is not None and (checkpoint is None or not checkpoint.resumed):
+        sandbox[...] = add_grain_difference((basePile,), (sandbox,), (seeded_grid(xMax, yMax, baseGrains, dropSpots, seed, seedType, seedAttr),))[0]
+    offsets = resolve_neighborhood(neighbors)
+    if symmetry != 'none':
+        reduced = topple_symmetric(sandbox, grid_graph(xMax, yMax, tuple(offsets), 'square'), xMax, yMax, 'square', symmetry, multiscale, stats, metrics)
+        if reduced is not None:
+            return reduced
+    topple_grid = lambda xMax, yMax, pile, offsets, threshold: topple_grid_algorithm2_neighborhoods_bounded(xMax, yMax, pile, offsets, threshold, progress, progressWaves, metrics, checkpoint=checkpoint)
+    if engine == 'worklist':
+        topple_grid = lambda xMax, yMax, pile, offsets, threshold: topple_grid_worklist_neighborhoods_bounded(xMax, yMax, pile, offsets, threshold, progress, progressWaves, metrics, checkpoint)
+    elif engine == 'vectorized':
+        topple_grid = topple_grid_vectorized_neighborhoods
+    elif engine == 'parallel':
+        topple_grid = lambda xMax, yMax, pile, offsets, threshold: topple_grid_parallel_neighborhoods(xMax, yMax, pile, offsets, threshold, threads=threads)
+    elif engine == 'presolve':
+        graph = grid_graph(xMax, yMax, tuple(offsets), 'square')
+        topple_grid = lambda xMax, yMax, pile, offsets, threshold: topple_graph_pile(pile, graph, engine, stats=stats)
+    if multiscale:
+        return stabilize_multiscale((sandbox,), lambda pile: topple_grid(xMax, yMax, pile, offsets, len(offsets)))
+    return topple_grid(xMax, yMax, sandbox, offsets, len(offsets))
+
+PLANE_START_MARGIN = 16 # Cells around the drop spots in the first plane array
+
+'''
+Plane Piles (Auto-growing Domain):
+
+A square lattice pile on an unbounded plane. The array starts as the drop
+spots' bounding box plus PLANE_START_MARGIN cells and is toppled with the
+cells within reach (the neighborhood's longest offset) of the edge held
+back, so no grains fall off. If any held back cell ends up unstable the
+array is padded on that side by half its size (at least reach), with the
+seed on the new cells, and toppling continues. By the abelian property the
+stable pile is the one of an array large enough to never lose grains, and
+the scan cost follows the pile instead of a guessed xMax, yMax. toppleCtr
+adds up the rounds' waves, so it can differ a little from a fixed array's.
+
+xMax, yMax only place the drop spots (as in a square pile). Only uniform
+seeds below threshold - 1 are allowed (a higher seed spreads without end).
+
+Returns a tuple (sandpile, toppleCtr, pileBorder, offset) cropped to the
+cells which toppled, received grains or hold the drop spots, where offset
+is the int64 array [x, y] of the drop spot coordinates of sandpile[0, 0].
+'''
+
+def plane_reach(offsets):
+    return max(max(abs(dx), abs(dy)) for dx, dy in offsets)
+
+def grow_plane(sandbox, pileBorders, int reach, int threshold, int seed):
+    # Pads the sides with unstable held back cells, returns (sandbox, pileBorders, (padLowX, padLowY)) or None if stable
+    xMax, yMax = sandbox.shape
+    unstable = sandbox >= threshold
+    sides = [unstable[:reach].any(), unstable[xMax-reach:].any(), unstable[:, :reach].any(), unstable[:, yMax-reach:].any()]
+    if not any(sides):
+        return None
+    padX = max(reach, xMax // 2)
+    padY = max(reach, yMax // 2)
+    pads = ((padX * sides[0], padX * sides[1]), (padY * sides[2], padY * sides[3]))
+    return (np.pad(sandbox, pads, constant_values=seed), np.pad(pileBorders, pads), (pads[0][0], pads[1][0]))
+
+def calculate_sandpile_plane_seeded(int xMax, int yMax, int grains, neighbors, list dropSpots=None, int seed=0, seedType='uniform', seedAttr=None, int startMargin=PLANE_START_MARGIN, metrics=None):
+    offsets = resolve_neighborhood(neighbors)
+    threshold = len(offsets)
+    if seedType != 'uniform' or seed >= threshold - 1:
+        raise ValueError(f'Plane piles need a uniform seed below {threshold - 1}, got {seedType} seed {seed}')
+    reach = plane_reach(offsets)
+    if dropSpots == None:
+        dropSpots = [(int(xMax/2), int(yMax/2), 1.0)]
+
+    # Drop spot coordinate of sandbox[0, 0]
+    x0 = min(drop[0] for drop in dropSpots) - startMargin - reach
+    y0 = min(drop[1] for drop in dropSpots) - startMargin - reach
+    width = max(drop[0] for drop in dropSpots) - x0 + startMargin + reach + 1
+    height = max(drop[1] for drop in dropSpots) - y0 + startMargin + reach + 1
+    shifted = [(drop[0] - x0, drop[1] - y0, drop[2]) for drop in dropSpots]
+    sandbox = drop_all_grains(width, height, grains, np.full((width, height), seed, dtype=np.int64), shifted)
+    pileBorders = np.zeros((width, height), dtype=np.uint8)
+    for drop in shifted:
+        pileBorders[drop[0], drop[1]] = 1
+
+    toppleCtr = 0
+    while True:
+        sandbox, topples, borders = topple_grid_algorithm2_neighborhoods_bounded(sandbox.shape[0], sandbox.shape[1], sandbox, offsets, threshold, metrics=metrics, margin=reach)
+        toppleCtr += topples
+        pileBorders |= borders
+        grown = grow_plane(sandbox, pileBorders, reach, threshold, seed)
+        if grown is None:
+            break
+        sandbox, pileBorders, (padX, padY) = grown
+        x0 -= padX
+        y0 -= padY
+
+    # Crop to the cells the pile reached
+    rows = np.flatnonzero(pileBorders.any(axis=1))
+    cols = np.flatnonzero(pileBorders.any(axis=0))
+    crop = (slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1))
+    offset = np.array([x0 + rows[0], y0 + cols[0]], dtype=np.int64)
+    return (sandbox[crop].copy(), toppleCtr, pileBorders[crop].copy(), offset)
 
 @boundscheck(False)
 @wraparound(False)
-def calculate_sandpile_wraparound_seeded(int xMax, int yMax, int grains, topple, list dropSpots=None, int seed=0, seedType='uniform', seedAttr=None, shape='cylinder'):
-    sandbox = np.full((xMax, yMax), seed, dtype = np.int64)
-    if seedType == 'checker':
-        sandbox = checkerboard_seed(xMax, yMax, sandbox, seedAttr)
-    sandbox = drop_all_grains(xMax, yMax, grains, sandbox, dropSpots)
+def calculate_sandpile_wraparound_seeded(int xMax, int yMax, int grains, topple, list dropSpots=None, int seed=0, seedType='uniform', seedAttr=None, shape='cylinder', engine='scan', int threads=0, multiscale=False, stats=None, basePile=None, int baseGrains=0, progress=None, long long progressWaves=PROGRESS_WAVES, metrics=None, symmetry='none'):
+    sandbox = seeded_grid(xMax, yMax, grains, dropSpots, seed, seedType, seedAttr)
+    if basePile is not None:
+        sandbox = add_grain_difference((basePile,), (sandbox,), (seeded_grid(xMax, yMax, baseGrains, dropSpots, seed, seedType, seedAttr),))[0]
+    if symmetry != 'none':
+        reduced = topple_symmetric(sandbox, grid_graph(xMax, yMax, tuple(resolve_neighborhood(topple)), shape), xMax, yMax, shape, symmetry, multiscale, stats, metrics)
+        if reduced is not None:
+            return reduced[:2]
+    if engine == 'vectorized':
+        offsets = resolve_neighborhood(topple)
+        topple_wrap = lambda pile: topple_grid_vectorized_neighborhoods(xMax, yMax, pile, offsets, len(offsets), shape=shape)[:2]
+    elif engine == 'parallel':
+        offsets = resolve_neighborhood(topple)
+        topple_wrap = lambda pile: topple_grid_parallel_neighborhoods(xMax, yMax, pile, offsets, len(offsets), shape=shape, threads=threads)[:2]
+    elif topple == "von_neumann" and engine == 'scan':
+        topple_wrap = lambda pile: topple_grid_algorithm2_von_neumann_wraparound(xMax, yMax, pile, shape, progress, progressWaves, metrics)
+    else:
+        # The worklist and presolve engines, and the scan engine with other neighborhoods (the graph worklist gives the same pile and topple count)
+        graph = grid_graph(xMax, yMax, tuple(resolve_neighborhood(topple)), shape)
+        topple_wrap = lambda pile: topple_graph_pile(pile, graph, engine, stats=stats, progress=progress, progressWaves=progressWaves, metrics=metrics)[:2]
+    if multiscale:
+        return stabilize_multiscale((sandbox,), topple_wrap)
+    return topple_wrap(sandbox)
+
+@boundscheck(False)
+@wraparound(False)
+def calculate_sandpile_cubesurface_seeded(int xMax, int yMax, int zMax, int grains, topple, list dropSpots=None, int seed=0, seedType='uniform', seedAttr=None, engine='scan', int threads=0, multiscale=False, stats=None, basePile=None, int baseGrains=0, metrics=None):
+    sandbox_frontback, sandbox_leftright, sandbox_bottomtop = seeded_cubesurface(xMax, yMax, zMax, grains, dropSpots, seed, seedType, seedAttr)
+    if basePile is not None:
+        sandbox_frontback, sandbox_leftright, sandbox_bottomtop = add_grain_difference(basePile, (sandbox_frontback, sandbox_leftright, sandbox_bottomtop), seeded_cubesurface(xMax, yMax, zMax, baseGrains, dropSpots, seed, seedType, seedAttr))
+
     if topple == "von_neumann":
-        return topple_grid_algorithm2_von_neumann_wraparound(xMax, yMax, sandbox, shape)
+        if engine != 'scan' or metrics is not None:
+            graph = cubesurface_graph(xMax, yMax, zMax)
+            topple_cube = lambda frontback, leftright, bottomtop: topple_graph_cubesurface(frontback, leftright, bottomtop, graph, engine, threads, stats=stats, metrics=metrics)
+        else:
+            topple_cube = lambda frontback, leftright, bottomtop: topple_grid_algorithm2_von_neumann_cubesurface(xMax, yMax, zMax, frontback, leftright, bottomtop)
+        if multiscale:
+            return stabilize_multiscale((sandbox_frontback, sandbox_leftright, sandbox_bottomtop), topple_cube)
+        return topple_cube(sandbox_frontback, sandbox_leftright, sandbox_bottomtop)
 
 @boundscheck(False)
 @wraparound(False)
-def calculate_sandpile_cubesurface_seeded(int xMax, int yMax, int zMax, int grains, topple, list dropSpots=None, int seed=0, seedType='uniform', seedAttr=None):
+def calculate_sandpile_icosahedronsurface_seeded(int xMax, int yMax, int numRows, int grains, topple, list dropSpots=None, int seed=0, seedType='uniform', seedAttr=None, engine='scan', int threads=0, multiscale=False, stats=None, basePile=None, int baseGrains=0, metrics=None):
+    arrX = 2 * (xMax + 1)
+    arrY = 5 * yMax
+    sandbox = seeded_icosahedron(xMax, yMax, arrX, arrY, grains, dropSpots, seed, seedType, seedAttr)
+    if basePile is not None:
+        sandbox = add_grain_difference((basePile,), (sandbox,), (seeded_icosahedron(xMax, yMax, arrX, arrY, baseGrains, dropSpots, seed, seedType, seedAttr),))[0]
+
+    # Toppling goes here...
+    if engine != 'scan' or metrics is not None:
+        graph = icosahedron_graph(xMax, yMax, arrX, arrY)
+        topple_ico = lambda pile: topple_graph_pile(pile, graph, engine, threads=threads, stats=stats, metrics=metrics)[:2]
+    else:
+        topple_ico = lambda pile: topple_sandpile_icosahedron_surface(xMax, yMax, arrX, arrY, pile)
+    if multiscale:
+        sandboxTuple = stabilize_multiscale((sandbox,), topple_ico)
+    else:
+        sandboxTuple = topple_ico(sandbox)
+    sandbox = sandboxTuple[0]
+    toppleCtr = sandboxTuple[1]
+
+    pileArray, boundArray = extract_icosahedron_faces(sandbox, xMax, yMax)
+    return (pileArray, toppleCtr, boundArray, sandbox)
+
+##############################
+#  Multiscale Stabilization  #
+##############################
+
+MULTISCALE_MIN_STACK = 256
+
+'''
+Multiscale Stabilization (Grain Doubling):
+
+By the abelian property stab(c) = stab(2 * stab(c // 2) + (c % 2)), so the
+starting pile is halved until its tallest stack is below minStack, the small
+pile is stabilized, then each level is doubled, has its odd grains added back
+and is re-stabilized. The 2 * odometer(c // 2) firings of the direct method are
+done once at half scale. The kernels already topple a whole stack per wave, so
+the saving is in waves rather than firings and varies with the pile (the
+--compare-direct flag of sandpile_surface_toppling.py measures it).
+
+The stable pile is identical to the direct method. The toppled cells of the
+direct method are the union of the toppled cells of every level, so the
+pileBorders/bound arrays (the OR over levels) are identical as well.
+
+stabilize(*piles) is any topple kernel call returning (*piles, toppleCtr, ...).
+Returns the same tuple with toppleCtr summed over every level.
+'''
+
+def stabilize_multiscale(piles, stabilize, long long minStack=MULTISCALE_MIN_STACK):
+    piles = tuple(piles)
+    numPiles = len(piles)
+    remainders = []
+    while max(int(pile.max()) for pile in piles) >= minStack:
+        remainders.append(tuple(pile & 1 for pile in piles))
+        piles = tuple(pile >> 1 for pile in piles)
+
+    result = tuple(stabilize(*piles))
+    toppleCtr = result[numPiles]
+    borders = list(result[numPiles+1:])
+    for remainder in reversed(remainders):
+        piles = tuple((2 * pile) + odd for pile, odd in zip(result[:numPiles], remainder))
+        result = tuple(stabilize(*piles))
+        toppleCtr += result[numPiles]
+        for idx, border in enumerate(result[numPiles+1:]):
+            borders[idx] = borders[idx] | border
+    return result[:numPiles] + (toppleCtr,) + tuple(borders)
+
+#########################
+# Seeds and grain drops #
+#########################
+
+def seeded_grid(int xMax, int yMax, int grains, list dropSpots=None, int seed=0, seedType='uniform', seedAttr=None, sandbox=None):
+    # Seeds into sandbox if given (e.g. a memory mapped checkpoint array)
+    if sandbox is None:
+        sandbox = np.full((xMax, yMax), seed, dtype = np.int64)
+    else:
+        sandbox[...] = seed
+    if seedType == 'checker':
+        sandbox = checkerboard_seed(xMax, yMax, sandbox, seedAttr)
+    return drop_all_grains(xMax, yMax, grains, sandbox, dropSpots)
+
+def seeded_cubesurface(int xMax, int yMax, int zMax, int grains, list dropSpots=None, int seed=0, seedType='uniform', seedAttr=None):
     sandbox_frontback = np.full((2, xMax, yMax), seed, dtype = np.int64)
     sandbox_leftright = np.full((2, zMax, yMax), seed, dtype = np.int64)
     sandbox_bottomtop = np.full((2, xMax, zMax), seed, dtype = np.int64)
@@ -59,65 +359,34 @@ def calculate_sandpile_cubesurface_seeded(int xMax, int yMax, int zMax, int grai
     sandbox_frontback = drop_all_grains_faces(xMax, yMax, grains, sandbox_frontback, "frontback", dropSpots)
     sandbox_leftright = drop_all_grains_faces(zMax, yMax, grains, sandbox_leftright, "leftright", dropSpots)
     sandbox_bottomtop = drop_all_grains_faces(xMax, zMax, grains, sandbox_bottomtop, "bottomtop", dropSpots)
+    return (sandbox_frontback, sandbox_leftright, sandbox_bottomtop)
 
-    if topple == "von_neumann":
-        return topple_grid_algorithm2_von_neumann_cubesurface(xMax, yMax, zMax, sandbox_frontback, sandbox_leftright, sandbox_bottomtop)
-
-@boundscheck(False)
-@wraparound(False)
-def calculate_sandpile_icosahedronsurface_seeded(int xMax, int yMax, int numRows, int grains, topple, list dropSpots=None, int seed=0, seedType='uniform', seedAttr=None):
-    arrX = 2 * (xMax + 1)
-    arrY = 5 * yMax
+def seeded_icosahedron(int xMax, int yMax, int arrX, int arrY, int grains, list dropSpots=None, int seed=0, seedType='uniform', seedAttr=None):
     sandbox = np.full((arrX, arrY), seed, dtype = np.int64)
-
     if seedType == 'checker':
         sandbox = checkerboard_seed_icosahedron(arrX, arrY, sandbox, seedAttr)
-    sandbox = drop_all_grains_icosahedron(xMax, yMax, arrX, arrY, grains, sandbox, dropSpots)
+    return drop_all_grains_icosahedron(xMax, yMax, arrX, arrY, grains, sandbox, dropSpots)
 
-    # Toppling goes here...
-    sandboxTuple = topple_sandpile_icosahedron_surface(xMax, yMax, arrX, arrY, sandbox)
-    sandbox = sandboxTuple[0]
-    toppleCtr = sandboxTuple[1]
+'''
+Incremental Stabilization:
 
-    pileArray = []
-    boundArray = []
-    for side in range(20):
-        tempArr = np.zeros((xMax, yMax), dtype = np.int64)
-        boundTempArr = np.zeros((xMax, yMax), dtype = np.int64)
-        y_sidx_offset = int(side / 4) * yMax
-        sy_range = y_sidx_offset
-        ey_range = y_sidx_offset + yMax
-        
-        col = side % 4
-        if side % 2 == 1: # odd
-            x_sidx_offset = 1 + (int(col/3) * (xMax+1))    
-            for y_sidx in range(sy_range, ey_range):
-                y_eidx = y_sidx - y_sidx_offset
-                
-                sx_range = (y_eidx*2) + x_sidx_offset
-                ex_range = xMax + x_sidx_offset
-                for x_sidx in range(sx_range, ex_range):
-                    x_eidx = (x_sidx - x_sidx_offset) - y_eidx
-                    tempArr[x_eidx][y_eidx] = sandbox[x_sidx][y_sidx]
-                    boundTempArr[x_eidx][y_eidx] = 1
-        else:
-            x_sidx_offset = (int(col/2) * (xMax+1))
-            for y_sidx in range(sy_range, ey_range):
-                y_eidx = y_sidx - y_sidx_offset
-                
-                sx_range = x_sidx_offset
-                ex_range = (y_eidx*2) + x_sidx_offset + 1
-                for x_sidx in range(sx_range, ex_range):
-                    x_eidx = (x_sidx - x_sidx_offset) + (int(xMax/2) - y_eidx)
-                    tempArr[x_eidx][y_eidx] = sandbox[x_sidx][y_sidx]
-                    boundTempArr[x_eidx][y_eidx] = 1
-        pileArray.append(tempArr)
-        boundArray.append(boundTempArr)
-    return (pileArray, toppleCtr, boundArray, sandbox)
+By the abelian property stab(c2) = stab(stab(c1) + (c2 - c1)), so a pile with
+more grains can start from a saved stable pile of the same setup. The grains
+to add are the difference of the two starting piles (so drop spot rounding
+and seeds match the direct run exactly). The result is identical to
+stabilizing c2 from scratch.
+'''
 
-#########################
-# Seeds and grain drops #
-#########################
+def add_grain_difference(basePiles, startPiles, baseStartPiles):
+    piles = []
+    for basePile, startPile, baseStartPile in zip(basePiles, startPiles, baseStartPiles):
+        if basePile.shape != startPile.shape:
+            raise ValueError(f'Saved pile shape {basePile.shape} does not match {startPile.shape}')
+        grainDifference = startPile - baseStartPile
+        if np.any(grainDifference < 0):
+            raise ValueError('Incremental piles can only add grains to the saved pile')
+        piles.append(basePile.astype(np.int64) + grainDifference)
+    return tuple(piles)
 
 @boundscheck(False)
 @wraparound(False)
@@ -267,6 +536,68 @@ def checkerboard_seed_icosahedron(int xMax, int yMax, sandbox, seeds):
             sandbox_view[x, y] = val
     return sandbox
 
+###################
+#  Neighborhoods  #
+###################
+
+'''
+Neighborhood offsets (dx, dy) for the grid lattice. Each toppled cell sends
+one grain per offset, so the topple threshold of a neighborhood is the number
+of offsets it holds. Besides the named neighborhoods, a list of offsets can be
+given directly (e.g. "topple": [[1, 0], [-1, 0], [0, 2], [0, -2]] in a
+pile_config JSON), and repeated offsets send that many grains.
+'''
+
+ORTHOGONAL_OFFSETS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+DIAGONAL_OFFSETS = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+KNIGHT_RIGHT_OFFSETS = [(-1, -2), (1, 2), (-2, 1), (2, -1)]
+KNIGHT_LEFT_OFFSETS = [(-2, -1), (2, 1), (1, -2), (-1, 2)]
+ORTHOGONAL2_OFFSETS = [(-2, 0), (2, 0), (0, -2), (0, 2)]
+DIAGONAL2_OFFSETS = [(-2, -2), (2, -2), (-2, 2), (2, 2)]
+
+NEIGHBORHOOD_OFFSETS = {
+    'von_neumann': ORTHOGONAL_OFFSETS,
+    'von_neumann2': ORTHOGONAL2_OFFSETS,
+    'xcross': DIAGONAL_OFFSETS,
+    'knightleft': KNIGHT_LEFT_OFFSETS,
+    'knightright': KNIGHT_RIGHT_OFFSETS,
+    'moore': ORTHOGONAL_OFFSETS + DIAGONAL_OFFSETS,
+    'moore2': ORTHOGONAL2_OFFSETS + DIAGONAL2_OFFSETS,
+    'knight': KNIGHT_RIGHT_OFFSETS + KNIGHT_LEFT_OFFSETS,
+    'knightsweepleft': KNIGHT_LEFT_OFFSETS + ORTHOGONAL2_OFFSETS,
+    'knightsweepright': KNIGHT_RIGHT_OFFSETS + ORTHOGONAL2_OFFSETS,
+    'pinwheelleft': ORTHOGONAL_OFFSETS + KNIGHT_LEFT_OFFSETS,
+    'pinwheelright': ORTHOGONAL_OFFSETS + KNIGHT_RIGHT_OFFSETS,
+    '8cross': ORTHOGONAL_OFFSETS + ORTHOGONAL2_OFFSETS,
+    '8pointstar': DIAGONAL_OFFSETS + ORTHOGONAL2_OFFSETS,
+}
+
+def resolve_neighborhood(neighbors):
+    if isinstance(neighbors, str):
+        if neighbors not in NEIGHBORHOOD_OFFSETS:
+            raise ValueError(f'Unknown neighborhood: {neighbors}')
+        return NEIGHBORHOOD_OFFSETS[neighbors]
+
+    # Repeated offsets are kept (each sends one grain, see above)
+    offsets = []
+    for offset in neighbors:
+        if len(offset) != 2:
+            raise ValueError(f'Neighborhood offsets must be (dx, dy) pairs, got {offset}')
+        if not all(isinstance(value, (int, np.integer)) and not isinstance(value, bool) for value in offset):
+            raise ValueError(f'Neighborhood offsets must be integers, got {offset}')
+        dx = int(offset[0])
+        dy = int(offset[1])
+        if dx == 0 and dy == 0:
+            raise ValueError('Neighborhood offsets cannot include (0, 0)')
+        offsets.append((dx, dy))
+    if len(offsets) == 0:
+        raise ValueError('Neighborhood needs at least one offset')
+    return offsets
+
+def neighborhood_table(neighbors):
+    # Compiles a neighborhood into a C-contiguous (numOffsets, 2) int array for the nogil kernels
+    return np.array(resolve_neighborhood(neighbors), dtype=np.intc).reshape((-1, 2))
+
 #######################
 #  Topple Algorithms  #
 #######################
@@ -278,119 +609,96 @@ Same as Algorithm 2, but adds a second array which tracks the
 spread of the grains of sand. This enables easy setting of a
 different background color from the 0 grain color.
 
+The neighborhood (a name or a list of offsets) is compiled into a table of
+(dx, dy) offsets up front, so each wave walks the table in a nogil loop.
+Cells within margin of the edge never topple (they collect the grains sent
+to them, nothing falls off), which the plane piles grow from.
+
 Returns a tuple (sandpile, toppleCtr, pileBorder).
 '''
 
 @boundscheck(False)
 @wraparound(False)
-def topple_grid_algorithm2_neighborhoods_bounded(int xMax, int yMax, sandbox, neighbors, int threshold):
+@cdivision(True)
+def topple_grid_algorithm2_neighborhoods_bounded(int xMax, int yMax, sandbox, neighbors, int threshold, progress=None, long long progressWaves=PROGRESS_WAVES, metrics=None, int margin=0, checkpoint=None):
     cdef int x
     cdef int y
-    cdef int idx
+    cdef int nx
+    cdef int ny
+    cdef int o
+    cdef int numOffsets
+    cdef Py_ssize_t idx
+    cdef Py_ssize_t numUnstable
     cdef tuple arr
     cdef long long numToMove
     cdef long long toppleCtr = 0
+    cdef long long waves = 0
+    cdef bint reportProgress = progress is not None and progressWaves > 0
+    cdef bint reportMetrics = metrics is not None
+    cdef WaveStats waveStats
+    cdef double clock = 0
     cdef long long [:, :] sandbox_view = sandbox
-    direction = "odd"
-
-    pileBorders = np.full((xMax, yMax), False, dtype=np.uint8)
+    cdef Py_ssize_t [:] arrX_view
+    cdef Py_ssize_t [:] arrY_view
+    cdef int [:, ::1] offsets_view = neighborhood_table(neighbors) # Offsets are compiled once, no neighborhood checks while toppling
+    numOffsets = offsets_view.shape[0]
+    reset_stats(&waveStats)
+
+    if checkpoint is not None:
+        pileBorders = checkpoint.borders
+        toppleCtr = checkpoint.topples
+        waves = checkpoint.waves
+    else:
+        pileBorders = np.full((xMax, yMax), False, dtype=np.uint8)
     cdef char[:, :] pileBorders_view = pileBorders
 
-    arr = np.where(sandbox >= threshold) # Topples piles of sand with a number of grains greater than or equal to a threshold
+    if reportMetrics:
+        clock = perf_counter()
+    interior = sandbox[margin:xMax-margin, margin:yMax-margin] # Cells within margin of the edge hold their grains without toppling
+    arr = np.where(interior >= threshold) # Topples piles of sand with a number of grains greater than or equal to a threshold
     while len(arr[0]) > 0:
-        toppleCtr += len(arr[0])
-        for idx in range(len(arr[0])):
-            x = int(arr[0][idx])
-            y = int(arr[1][idx])
-            numToMove = int(sandbox_view[x, y] / threshold) # Does this work for int64 numbers?
-            pileBorders_view[x, y] = 1
-
-            if neighbors == 'von_neumann' or neighbors == 'moore' or neighbors == 'pinwheelright' or neighbors == 'pinwheelleft' or neighbors == '8cross':
-                if (x > 0):
-                    sandbox_view[x-1, y] += numToMove
-                    pileBorders_view[x-1, y] = 1
-                if ((x+1) < xMax):
-                    sandbox_view[x+1, y] += numToMove
-                    pileBorders_view[x+1, y] = 1
-                if (y > 0):
-                    sandbox_view[x, y-1] += numToMove
-                    pileBorders_view[x, y-1] = 1
-                if ((y+1) < yMax):
-                    sandbox_view[x, y+1] += numToMove
-                    pileBorders_view[x, y+1] = 1
-
-            if neighbors == 'xcross' or neighbors == 'moore' or neighbors == '8pointstar':
-                if (x > 0 and y > 0):
-                    sandbox_view[x-1, y-1] += numToMove
-                    pileBorders_view[x-1, y-1] = 1
-                if (x > 0 and (y+1) < yMax):
-                    sandbox_view[x-1, y+1] += numToMove
-                    pileBorders_view[x-1, y+1] = 1
-                if ((x+1) < xMax and y > 0):
-                    sandbox_view[x+1, y-1] += numToMove
-                    pileBorders_view[x+1, y-1] = 1
-                if ((x+1) < xMax and (y+1) < yMax):
-                    sandbox_view[x+1, y+1] += numToMove
-                    pileBorders_view[x+1, y+1] = 1
-
-            if neighbors == 'knight' or neighbors == 'knightright' or neighbors == 'knightsweepright' or neighbors == 'pinwheelright':
-                if (y > 1 and x > 0):
-                    sandbox_view[x-1, y-2] += numToMove
-                    pileBorders_view[x-1, y-2] = 1
-                if ((y+2) < yMax and (x+1) < xMax):
-                    sandbox_view[x+1, y+2] += numToMove
-                    pileBorders_view[x+1, y+2] = 1
-                if (x > 1 and (y+1) < yMax):
-                    sandbox_view[x-2, y+1] += numToMove
-                    pileBorders_view[x-2, y+1] = 1
-                if ((x+2) < xMax and y > 0):
-                    sandbox_view[x+2, y-1] += numToMove
-                    pileBorders_view[x+2, y-1] = 1
-
-            if neighbors == 'knight' or neighbors == 'knightleft' or neighbors == 'knightsweepleft' or neighbors == 'pinwheelleft':
-                if (x > 1 and y > 0):
-                    sandbox_view[x-2, y-1] += numToMove
-                    pileBorders_view[x-2, y-1] = 1
-                if ((x+2) < xMax and (y+1) < yMax):
-                    sandbox_view[x+2, y+1] += numToMove
-                    pileBorders_view[x+2, y+1] = 1
-                if (y > 1 and (x+1) < xMax):
-                    sandbox_view[x+1, y-2] += numToMove
-                    pileBorders_view[x+1, y-2] = 1
-                if ((y+2) < yMax and x > 0):
-                    sandbox_view[x-1, y+2] += numToMove
-                    pileBorders_view[x-1, y+2] = 1
-
-            if neighbors == 'von_neumann2' or neighbors == 'moore2' or neighbors == 'knightsweepleft' or neighbors == 'knightsweepright' or neighbors == '8cross' or neighbors == '8pointstar':
-                if (x > 1):
-                    sandbox_view[x-2, y] += numToMove
-                    pileBorders_view[x-2, y] = 1
-                if ((x+2) < xMax):
-                    sandbox_view[x+2, y] += numToMove
-                    pileBorders_view[x+2, y] = 1
-                if (y > 1):
-                    sandbox_view[x, y-2] += numToMove
-                    pileBorders_view[x, y-2] = 1
-                if ((y+2) < yMax):
-                    sandbox_view[x, y+2] += numToMove
-                    pileBorders_view[x, y+2] = 1
-
-            if neighbors == 'moore2':
-                if (x > 1 and y > 1):
-                    sandbox_view[x-2, y-2] += numToMove
-                    pileBorders_view[x-2, y-2] = 1
-                if (y > 1 and (x+2) < xMax):
-                    sandbox_view[x+2, y-2] += numToMove
-                    pileBorders_view[x+2, y-2] = 1
-                if ((y+2) < yMax and x > 1):
-                    sandbox_view[x-2, y+2] += numToMove
-                    pileBorders_view[x-2, y+2] = 1
-                if ((x+2) < xMax and (y+2) < yMax):
-                    sandbox_view[x+2, y+2] += numToMove
-                    pileBorders_view[x+2, y+2] = 1
-            
-            sandbox_view[x, y] -= (threshold * numToMove)
-        arr = np.where(sandbox >= threshold)
+        numUnstable = len(arr[0])
+        toppleCtr += numUnstable
+        arrX_view = arr[0]
+        arrY_view = arr[1]
+        if reportMetrics:
+            waveStats.scanTime = perf_counter() - clock
+            clock = perf_counter()
+        with nogil:
+            for idx in range(numUnstable):
+                x = <int>arrX_view[idx] + margin
+                y = <int>arrY_view[idx] + margin
+                numToMove = sandbox_view[x, y] // threshold
+                if reportMetrics:
+                    waveStats.excess += sandbox_view[x, y] - (threshold - 1)
+                    if pileBorders_view[x, y] == 0:
+                        touch_cell(&waveStats, x, y)
+                pileBorders_view[x, y] = 1
+
+                for o in range(numOffsets):
+                    nx = x + offsets_view[o, 0]
+                    ny = y + offsets_view[o, 1]
+                    if nx >= 0 and nx < xMax and ny >= 0 and ny < yMax:
+                        sandbox_view[nx, ny] += numToMove
+                        if reportMetrics and pileBorders_view[nx, ny] == 0:
+                            touch_cell(&waveStats, nx, ny)
+                        pileBorders_view[nx, ny] = 1
+                    elif reportMetrics:
+                        waveStats.lost += numToMove
+
+                sandbox_view[x, y] -= (threshold * numToMove)
+        waves += 1
+        if reportMetrics:
+            waveStats.relaxTime = perf_counter() - clock
+            metrics(wave_record(waves, numUnstable, toppleCtr, &waveStats, True))
+            reset_wave(&waveStats)
+        if reportProgress and waves % progressWaves == 0:
+            progress(sandbox, toppleCtr)
+        if checkpoint is not None:
+            checkpoint(waves, toppleCtr)
+        if reportMetrics:
+            clock = perf_counter()
+        arr = np.where(interior >= threshold)
     return (sandbox, toppleCtr, pileBorders)
 
 '''
@@ -403,22 +711,43 @@ Returns a tuple (sandpile, toppleCtr)
 '''
 @boundscheck(False)
 @wraparound(False)
-def topple_grid_algorithm2_von_neumann_wraparound(int xMax, int yMax, sandbox, shape):
+def topple_grid_algorithm2_von_neumann_wraparound(int xMax, int yMax, sandbox, shape, progress=None, long long progressWaves=PROGRESS_WAVES, metrics=None):
     cdef int x
     cdef int y
     cdef int idx
     cdef tuple arr
     cdef long long numToMove
     cdef long long toppleCtr = 0
+    cdef long long waves = 0
+    cdef bint reportProgress = progress is not None and progressWaves > 0
+    cdef bint reportMetrics = metrics is not None
+    cdef WaveStats waveStats
+    cdef double clock = 0
+    cdef long long grainsBefore = 0
     cdef long long [:, :] sandbox_view = sandbox
+    cdef char[:, :] toppled_view
+    reset_stats(&waveStats)
+
+    if reportMetrics:
+        toppled_view = np.zeros((xMax, yMax), dtype=np.uint8) # Cells toppled so far, for touched and bbox
 
+        clock = perf_counter()
+        grainsBefore = int(sandbox.sum())
     arr = np.where(sandbox > 3) # Topples at 4 grains tall or greater
     while len(arr[0]) > 0:
         toppleCtr += len(arr[0])
+        if reportMetrics:
+            waveStats.scanTime = perf_counter() - clock
+            clock = perf_counter()
         for idx in range(len(arr[0])):
             x = int(arr[0][idx])
             y = int(arr[1][idx])
             numToMove = int(sandbox_view[x, y] / 4)
+            if reportMetrics:
+                waveStats.excess += sandbox_view[x, y] - 3
+                if toppled_view[x, y] == 0:
+                    toppled_view[x, y] = 1
+                    touch_cell(&waveStats, x, y)
             if x > 0:
                 sandbox_view[x-1, y] += numToMove
             if (x+1) < xMax:
@@ -440,6 +769,17 @@ def topple_grid_algorithm2_von_neumann_wraparound(int xMax, int yMax, sandbox, s
             if ((y+1) == yMax) and (shape == 'squarewrap'):
                 sandbox_view[x, 0] += numToMove
             sandbox_view[x, y] -= (4 * numToMove)
+        waves += 1
+        if reportMetrics:
+            waveStats.relaxTime = perf_counter() - clock
+            waveStats.lost = grainsBefore - int(sandbox.sum()) # Off the open ends of a cylinder
+            grainsBefore -= waveStats.lost
+            metrics(wave_record(waves, len(arr[0]), toppleCtr, &waveStats, True))
+            reset_wave(&waveStats)
+        if reportProgress and waves % progressWaves == 0:
+            progress(sandbox, toppleCtr)
+        if reportMetrics:
+            clock = perf_counter()
         arr = np.where(sandbox > 3)
     return (sandbox, toppleCtr)
 
@@ -677,4 +1017,1358 @@ def topple_sandpile_icosahedron_surface(int xMax, int yMax, int arrX, int arrY,
 
             sandbox_view[x, y] -= (3 * numToMove)
         arr = np.where(sandbox > 2)
-    return (sandbox, toppleCtr)
\ No newline at end of file
+    return (sandbox, toppleCtr)
+
+###########################
+#  Vectorized Algorithms  #
+###########################
+
+'''
+Vectorized Topple Algorithm (Synchronous Waves):
+
+Every unstable cell topples at once each wave. q = sandbox // threshold is
+taken off each cell and added back to the sandbox once per neighborhood offset
+as a shifted whole-array slice, so there is no per-cell branching. Grains
+shifted past a bounded edge fall off; 'cylinder' wraps the x-axis and
+'squarewrap' wraps both axes like np.roll. Each wave only works on the
+bounding window of the unstable cells.
+
+The stable pile is the same as the per-cell kernels (abelian property), but
+toppleCtr counts the synchronous waves so it differs from Algorithm 2.
+
+Returns a tuple (sandpile, toppleCtr, pileBorder).
+'''
+
+def axis_segments(int start, int stop, int d, int n, bint wrap):
+    # Pairs of (source slice relative to start, destination slice) for shifting
+    # the window [start, stop) by d along an axis of length n
+    cdef int pos
+    cdef int segEnd
+    cdef int lo
+    cdef int hi
+    cdef int k
+    segments = []
+    if wrap == False:
+        lo = max(start + d, 0)
+        hi = min(stop + d, n)
+        if lo < hi:
+            segments.append((slice(lo - d - start, hi - d - start), slice(lo, hi)))
+        return segments
+    pos = start + d
+    while pos < stop + d:
+        k = pos // n
+        segEnd = min(stop + d, (k + 1) * n)
+        segments.append((slice(pos - d - start, segEnd - d - start), slice(pos - (k * n), segEnd - (k * n))))
+        pos = segEnd
+    return segments
+
+def unstable_window(sandbox, int threshold, int x0, int x1, int y0, int y1):
+    unstable = sandbox[x0:x1, y0:y1] >= threshold
+    rows = np.flatnonzero(unstable.any(axis=1))
+    if len(rows) == 0:
+        return None
+    cols = np.flatnonzero(unstable.any(axis=0))
+    return (x0 + int(rows[0]), x0 + int(rows[-1]) + 1, y0 + int(cols[0]), y0 + int(cols[-1]) + 1)
+
+def grow_window(int start, int stop, int reach, int n, bint wrap):
+    start -= reach
+    stop += reach
+    if wrap == True and (start < 0 or stop > n):
+        return (0, n)
+    return (max(start, 0), min(stop, n))
+
+def topple_grid_vectorized_neighborhoods(int xMax, int yMax, sandbox, neighbors, int threshold, shape='square'):
+    cdef long long toppleCtr = 0
+    cdef int reach
+    cdef bint wrapX = (shape == 'cylinder' or shape == 'squarewrap')
+    cdef bint wrapY = (shape == 'squarewrap')
+
+    offsets = resolve_neighborhood(neighbors)
+    reach = max(max(abs(dx), abs(dy)) for (dx, dy) in offsets)
+    pileBorders = np.full((xMax, yMax), False, dtype=np.uint8)
+
+    window = unstable_window(sandbox, threshold, 0, xMax, 0, yMax)
+    while window is not None:
+        x0, x1, y0, y1 = window
+        q = sandbox[x0:x1, y0:y1] // threshold
+        toppled = q > 0
+        toppleCtr += np.count_nonzero(toppled)
+        sandbox[x0:x1, y0:y1] -= threshold * q
+        pileBorders[x0:x1, y0:y1] |= toppled
+
+        for (dx, dy) in offsets:
+            for (srcX, dstX) in axis_segments(x0, x1, dx, xMax, wrapX):
+                for (srcY, dstY) in axis_segments(y0, y1, dy, yMax, wrapY):
+                    sandbox[dstX, dstY] += q[srcX, srcY]
+                    pileBorders[dstX, dstY] |= toppled[srcX, srcY]
+
+        gx0, gx1 = grow_window(x0, x1, reach, xMax, wrapX)
+        gy0, gy1 = grow_window(y0, y1, reach, yMax, wrapY)
+        window = unstable_window(sandbox, threshold, gx0, gx1, gy0, gy1)
+    return (sandbox, toppleCtr, pileBorders)
+
+#########################
+#  Parallel Algorithms  #
+#########################
+
+'''
+Parallel Topple Algorithm (Row Stripes):
+
+Synchronous waves like the vectorized engine, run in OpenMP threads with the
+GIL released. Each wave has two passes over stripes of rows: the first
+computes q = sandbox // threshold for every cell, the second gathers into each
+cell the q of every cell that sends to it (the halo rows of the neighboring
+stripes are read straight from q). A cell is only ever written by the thread
+that owns its row, so the passes need no locks. Only the rows within reach of
+the previous wave's unstable rows are visited.
+
+Because the sandpile is abelian the stable pile is identical to the serial
+kernels; toppleCtr counts synchronous waves like the vectorized engine.
+
+threads <= 0 uses every core. Returns a tuple (sandpile, toppleCtr, pileBorder).
+'''
+
+def resolve_threads(int threads):
+    if threads <= 0:
+        return os.cpu_count() or 1
+    return threads
+
+cdef inline void grow_span(int start, int end, int reach, int n, bint wrap, int* growStart, int* growEnd) noexcept nogil:
+    if wrap and (start - reach < 0 or end + reach > n):
+        growStart[0] = 0
+        growEnd[0] = n
+    else:
+        growStart[0] = max(start - reach, 0)
+        growEnd[0] = min(end + reach, n)
+
+@boundscheck(False)
+@wraparound(False)
+@cdivision(True)
+def topple_grid_parallel_neighborhoods(int xMax, int yMax, sandbox, neighbors, int threshold, shape='square', int threads=0):
+    cdef int x
+    cdef int y
+    cdef int sx
+    cdef int sy
+    cdef int o
+    cdef int numOffsets
+    cdef int reach = 0
+    cdef int numThreads = resolve_threads(threads)
+    cdef int rowStart = 0
+    cdef int rowEnd = xMax
+    cdef int colStart = 0
+    cdef int colEnd = yMax
+    cdef int activeRowStart
+    cdef int activeRowEnd
+    cdef int activeColStart
+    cdef int activeColEnd
+    cdef long long numUnstable
+    cdef long long toppleCtr = 0
+    cdef long long numToMove
+    cdef long long total
+    cdef long long sent
+    cdef bint touched
+    cdef bint wrapX = (shape == 'cylinder' or shape == 'squarewrap')
+    cdef bint wrapY = (shape == 'squarewrap')
+
+    pileBorders = np.full((xMax, yMax), False, dtype=np.uint8)
+    q = np.zeros((xMax, yMax), dtype=np.int64)
+    rowFirst = np.zeros(xMax, dtype=np.intc)
+    rowLast = np.zeros(xMax, dtype=np.intc)
+
+    cdef long long[:, :] sandbox_view = sandbox
+    cdef long long[:, ::1] q_view = q
+    cdef unsigned char[:, ::1] pileBorders_view = pileBorders
+    cdef int[::1] rowFirst_view = rowFirst # First and last unstable column of each row (rowLast == -1 if none)
+    cdef int[::1] rowLast_view = rowLast
+    cdef int[:, ::1] offsets_view = neighborhood_table(neighbors)
+    numOffsets = offsets_view.shape[0]
+    for o in range(numOffsets):
+        reach = max(reach, max(abs(offsets_view[o, 0]), abs(offsets_view[o, 1])))
+        if abs(offsets_view[o, 0]) >= xMax or abs(offsets_view[o, 1]) >= yMax:
+            raise ValueError('Neighborhood offsets must be smaller than the sandbox')
+
+    while True:
+        # Pass 1: grains to move from each cell in the window
+        numUnstable = 0
+        with nogil, parallel(num_threads=numThreads):
+            for x in prange(rowStart, rowEnd, schedule='static'):
+                rowFirst_view[x] = colEnd
+                rowLast_view[x] = -1
+                for y in range(colStart, colEnd):
+                    if sandbox_view[x, y] >= threshold:
+                        q_view[x, y] = sandbox_view[x, y] // threshold
+                        if rowLast_view[x] < 0:
+                            rowFirst_view[x] = y
+                        rowLast_view[x] = y
+                        numUnstable += 1
+        if numUnstable == 0:
+            break
+        toppleCtr += numUnstable
+
+        # Bounding window of the unstable cells
+        activeRowStart = xMax
+        activeRowEnd = 0
+        activeColStart = yMax
+        activeColEnd = 0
+        for x in range(rowStart, rowEnd):
+            if rowLast_view[x] >= 0:
+                activeRowStart = min(activeRowStart, x)
+                activeRowEnd = x + 1
+                activeColStart = min(activeColStart, rowFirst_view[x])
+                activeColEnd = max(activeColEnd, rowLast_view[x] + 1)
+        grow_span(activeRowStart, activeRowEnd, reach, xMax, wrapX, &rowStart, &rowEnd)
+        grow_span(activeColStart, activeColEnd, reach, yMax, wrapY, &colStart, &colEnd)
+
+        # Pass 2: every cell gathers the grains sent to it
+        with nogil, parallel(num_threads=numThreads):
+            for x in prange(rowStart, rowEnd, schedule='static'):
+                for y in range(colStart, colEnd):
+                    numToMove = q_view[x, y]
+                    total = -(threshold * numToMove)
+                    touched = numToMove > 0
+                    for o in range(numOffsets):
+                        sx = x - offsets_view[o, 0]
+                        sy = y - offsets_view[o, 1]
+                        if sx < 0 or sx >= xMax:
+                            if wrapX == False:
+                                continue
+                            sx = sx + xMax if sx < 0 else sx - xMax
+                        if sy < 0 or sy >= yMax:
+                            if wrapY == False:
+                                continue
+                            sy = sy + yMax if sy < 0 else sy - yMax
+                        sent = q_view[sx, sy]
+                        if sent > 0:
+                            total = total + sent
+                            touched = True
+                    if touched:
+                        sandbox_view[x, y] += total
+                        pileBorders_view[x, y] = 1
+
+        q[activeRowStart:activeRowEnd, activeColStart:activeColEnd] = 0
+    return (sandbox, toppleCtr, pileBorders)
+
+#########################
+#  Worklist Algorithms  #
+#########################
+
+'''
+Worklist Topple Algorithms:
+
+Same waves as the Algorithm 2 kernels, but instead of rescanning the whole
+sandbox with np.where after every wave, only the cells which received grains
+during the wave are checked. A flag array keeps each cell in the worklist at
+most once, and the unstable cells are sorted back into np.where (row-major)
+order before the next wave, so the stable piles and topple counts are
+identical to the matching Algorithm 2 kernel.
+'''
+
+cdef int compare_cells(const void* a, const void* b) noexcept nogil:
+    cdef long long cellA = (<const long long*>a)[0]
+    cdef long long cellB = (<const long long*>b)[0]
+    return (cellA > cellB) - (cellA < cellB)
+
+cdef inline void add_grains(long long* sandbox, unsigned char* queued, long long* nextCells, Py_ssize_t* numNext, long long cell, long long numToMove) noexcept nogil:
+    sandbox[cell] += numToMove
+    if queued[cell] == 0:
+        queued[cell] = 1
+        nextCells[numNext[0]] = cell
+        numNext[0] += 1
+
+cdef Py_ssize_t collect_unstable(long long* sandbox, unsigned char* queued, long long* cells, Py_ssize_t numCells, long long threshold) noexcept nogil:
+    cdef Py_ssize_t idx
+    cdef Py_ssize_t numUnstable = 0
+    cdef long long cell
+
+    for idx in range(numCells):
+        cell = cells[idx]
+        queued[cell] = 0
+        if sandbox[cell] >= threshold:
+            cells[numUnstable] = cell
+            numUnstable += 1
+    qsort(cells, numUnstable, sizeof(long long), compare_cells)
+    return numUnstable
+
+def initial_worklist(flatSandbox, long long threshold):
+    numCells = flatSandbox.shape[0]
+    activeCells = np.empty(numCells, dtype=np.int64)
+    unstable = np.flatnonzero(flatSandbox >= threshold)
+    activeCells[:len(unstable)] = unstable
+    return (activeCells, len(unstable))
+
+@boundscheck(False)
+@wraparound(False)
+@cdivision(True)
+def topple_grid_worklist_neighborhoods_bounded(int xMax, int yMax, sandbox, neighbors, int threshold, progress=None, long long progressWaves=PROGRESS_WAVES, metrics=None, checkpoint=None):
+    cdef int x
+    cdef int y
+    cdef int nx
+    cdef int ny
+    cdef int o
+    cdef int numOffsets
+    cdef long long cell
+    cdef Py_ssize_t idx
+    cdef Py_ssize_t numActive
+    cdef Py_ssize_t numNext
+    cdef long long numToMove
+    cdef long long toppleCtr = 0
+    cdef long long waves = 0
+    cdef bint reportProgress = progress is not None and progressWaves > 0
+    cdef bint reportMetrics = metrics is not None
+    cdef bint saveCheckpoints = checkpoint is not None
+    cdef WaveStats waveStats
+    cdef double clock = 0
+    cdef Py_ssize_t numUnstable
+    cdef long long* active
+    cdef long long* nextCells
+    cdef long long* swapCells
+    reset_stats(&waveStats)
+
+    if reportMetrics:
+        clock = perf_counter()
+    flatSandbox = sandbox.reshape(-1)
+    if saveCheckpoints:
+        pileBorders = checkpoint.borders
+        toppleCtr = checkpoint.topples
+        waves = checkpoint.waves
+    else:
+        pileBorders = np.full((xMax, yMax), False, dtype=np.uint8)
+    activeCells, numActive = initial_worklist(flatSandbox, threshold)
+    nextCellsArr = np.empty(xMax * yMax, dtype=np.int64)
+    queued = np.zeros(xMax * yMax, dtype=np.uint8)
+
+    cdef long long[::1] sandbox_view = flatSandbox
+    cdef unsigned char[::1] pileBorders_view = pileBorders.reshape(-1)
+    cdef unsigned char[::1] queued_view = queued
+    cdef long long[::1] active_view = activeCells
+    cdef long long[::1] next_view = nextCellsArr
+    cdef int[:, ::1] offsets_view = neighborhood_table(neighbors)
+    numOffsets = offsets_view.shape[0]
+    active = &active_view[0]
+    nextCells = &next_view[0]
+
+    with nogil:
+        if reportMetrics:
+            waveStats.scanTime = perf_counter() - clock
+            clock = perf_counter()
+        while numActive > 0:
+            toppleCtr += numActive
+            numNext = 0
+            for idx in range(numActive):
+                cell = active[idx]
+                x = <int>(cell // yMax)
+                y = <int>(cell % yMax)
+                numToMove = sandbox_view[cell] // threshold
+                if reportMetrics:
+                    waveStats.excess += sandbox_view[cell] - (threshold - 1)
+                    if pileBorders_view[cell] == 0:
+                        touch_cell(&waveStats, x, y)
+                pileBorders_view[cell] = 1
+                for o in range(numOffsets):
+                    nx = x + offsets_view[o, 0]
+                    ny = y + offsets_view[o, 1]
+                    if nx >= 0 and nx < xMax and ny >= 0 and ny < yMax:
+                        add_grains(&sandbox_view[0], &queued_view[0], nextCells, &numNext, (<long long>nx * yMax) + ny, numToMove)
+                        if reportMetrics and pileBorders_view[(<long long>nx * yMax) + ny] == 0:
+                            touch_cell(&waveStats, nx, ny)
+                        pileBorders_view[(<long long>nx * yMax) + ny] = 1
+                    elif reportMetrics:
+                        waveStats.lost += numToMove
+                sandbox_view[cell] -= (threshold * numToMove)
+            if reportMetrics:
+                waveStats.relaxTime = perf_counter() - clock
+                clock = perf_counter()
+            numUnstable = numActive
+            numActive = collect_unstable(&sandbox_view[0], &queued_view[0], nextCells, numNext, threshold)
+            swapCells = active
+            active = nextCells
+            nextCells = swapCells
+            waves += 1
+            if reportMetrics:
+                waveStats.scanTime += perf_counter() - clock
+                with gil:
+                    metrics(wave_record(waves, numUnstable, toppleCtr, &waveStats, True))
+                reset_wave(&waveStats)
+            if reportProgress and waves % progressWaves == 0:
+                with gil:
+                    progress(flatSandbox.reshape((xMax, yMax)), toppleCtr)
+            if saveCheckpoints:
+                with gil:
+                    checkpoint(waves, toppleCtr)
+            if reportMetrics:
+                clock = perf_counter()
+    return (flatSandbox.reshape((xMax, yMax)), toppleCtr, pileBorders)
+
+
+######################
+#  Graph Algorithms  #
+######################
+
+'''
+Graph Topple Algorithms (CSR Adjacency):
+
+Every geometry is flattened into one cell array plus a CSR neighbor table
+(indptr, indices): the cells a toppled cell sends grains to are
+indices[indptr[cell]:indptr[cell+1]], with repeats for cells receiving more
+than one grain. The seam rules of each surface live in its adjacency builder,
+which runs once per geometry, so the toppling kernels have no edge cases and
+are shared by every surface. Grains sent off a bounded edge have no entry in
+the table and fall off. A new surface only needs a builder.
+
+The flat cell order matches the scan order of the Algorithm 2 kernels (row
+major, and front/back, left/right, bottom/top for the cube), so the graph
+worklist kernel gives the same stable piles and topple counts.
+'''
+
+class SandpileGraph():
+    def __init__(self, indptr, indices, int threshold):
+        self.indptr = indptr
+        self.indices = indices
+        self.threshold = threshold
+        self.numCells = len(indptr) - 1
+        self.reverseGraph = None
+
+    def degrees(self):
+        return np.diff(self.indptr)
+
+    def reverse(self):
+        # Transposed table (the cells sending grains to each cell) for gather kernels
+        if self.reverseGraph is None:
+            sources = np.repeat(np.arange(self.numCells, dtype=np.int64), self.degrees())
+            order = np.argsort(self.indices, kind='stable')
+            counts = np.bincount(self.indices, minlength=self.numCells)
+            indptr = np.zeros(self.numCells + 1, dtype=np.int64)
+            np.cumsum(counts, out=indptr[1:])
+            self.reverseGraph = SandpileGraph(indptr, sources[order], self.threshold)
+        return self.reverseGraph
+
+cdef inline long long add_edge(long long* indices, long long pos, long long target) noexcept nogil:
+    indices[pos] = target
+    return pos + 1
+
+@lru_cache(maxsize=8)
+def grid_graph(int xMax, int yMax, tuple offsets, shape='square'):
+    return build_grid_graph(xMax, yMax, offsets, shape)
+
+@lru_cache(maxsize=8)
+def cubesurface_graph(int xMax, int yMax, int zMax):
+    return build_cubesurface_graph(xMax, yMax, zMax)
+
+@lru_cache(maxsize=8)
+def icosahedron_graph(int xMax, int yMax, int arrX, int arrY):
+    return build_icosahedron_graph(xMax, yMax, arrX, arrY)
+
+@boundscheck(False)
+@wraparound(False)
+@cdivision(True)
+def build_grid_graph(int xMax, int yMax, neighbors, shape='square'):
+    # Bounded square, or wrapped on x ('cylinder') or on x and y ('squarewrap')
+    cdef int x
+    cdef int y
+    cdef int nx
+    cdef int ny
+    cdef int o
+    cdef int numOffsets
+    cdef long long cell
+    cdef long long pos = 0
+    cdef long long numCells = <long long>xMax * yMax
+    cdef bint wrapX = (shape == 'cylinder' or shape == 'squarewrap')
+    cdef bint wrapY = (shape == 'squarewrap')
+    cdef int[:, ::1] offsets_view = neighborhood_table(neighbors)
+    numOffsets = offsets_view.shape[0]
+
+    indptr = np.zeros(numCells + 1, dtype=np.int64)
+    indices = np.empty(numCells * numOffsets, dtype=np.int64)
+    cdef long long[::1] indptr_view = indptr
+    cdef long long[::1] indices_view = indices
+    cdef long long* indicesPtr = &indices_view[0]
+
+    for x in range(xMax):
+        for y in range(yMax):
+            cell = (<long long>x * yMax) + y
+            indptr_view[cell] = pos
+            for o in range(numOffsets):
+                nx = x + offsets_view[o, 0]
+                ny = y + offsets_view[o, 1]
+                if wrapX:
+                    nx = ((nx % xMax) + xMax) % xMax
+                elif nx < 0 or nx >= xMax:
+                    continue
+                if wrapY:
+                    ny = ((ny % yMax) + yMax) % yMax
+                elif ny < 0 or ny >= yMax:
+                    continue
+                pos = add_edge(indicesPtr, pos, (<long long>nx * yMax) + ny)
+    indptr_view[numCells] = pos
+    return SandpileGraph(indptr, indices[:pos].copy(), numOffsets)
+
+'''
+Cube surface cells are flattened as the front/back faces, then left/right,
+then bottom/top, each in row-major (face, col, row) order.
+'''
+
+@boundscheck(False)
+@wraparound(False)
+@cdivision(True)
+def build_cubesurface_graph(int xMax, int yMax, int zMax):
+    cdef int x
+    cdef int y
+    cdef int z
+    cdef int faceIdx
+    cdef long long cell
+    cdef long long faceCell
+    cdef long long pos = 0
+    cdef long long fbFace = <long long>xMax * yMax
+    cdef long long lrFace = <long long>zMax * yMax
+    cdef long long btFace = <long long>xMax * zMax
+    cdef long long lrStart = 2 * fbFace
+    cdef long long btStart = lrStart + (2 * lrFace)
+    cdef long long numCells = btStart + (2 * btFace)
+
+    indptr = np.zeros(numCells + 1, dtype=np.int64)
+    indices = np.empty(numCells * 4, dtype=np.int64)
+    cdef long long[::1] indptr_view = indptr
+    cdef long long[::1] indices_view = indices
+    cdef long long* indicesPtr = &indices_view[0]
+
+    for cell in range(numCells):
+        indptr_view[cell] = pos
+        if cell < lrStart:
+            faceIdx = <int>(cell // fbFace)
+            faceCell = cell % fbFace
+            x = <int>(faceCell // yMax)
+            y = <int>(faceCell % yMax)
+
+            if x > 0:
+                pos = add_edge(indicesPtr, pos, cell - yMax)
+            if (x+1) < xMax:
+                pos = add_edge(indicesPtr, pos, cell + yMax)
+            if y > 0:
+                pos = add_edge(indicesPtr, pos, cell - 1)
+            if (y+1) < yMax:
+                pos = add_edge(indicesPtr, pos, cell + 1)
+
+            if faceIdx == 0: # Front (xy)
+                if x == 0:
+                    pos = add_edge(indicesPtr, pos, lrStart + ((zMax-1) * yMax) + y) # Left (zy)
+                if ((x+1) == xMax):
+                    pos = add_edge(indicesPtr, pos, lrStart + lrFace + y) # Right (zy)
+                if y == 0:
+                    pos = add_edge(indicesPtr, pos, btStart + (x * zMax) + (zMax-1)) # Bottom (xz)
+                if ((y+1) == yMax):
+                    pos = add_edge(indicesPtr, pos, btStart + btFace + (x * zMax)) # Top (xz)
+            elif faceIdx == 1: # Back (xy)
+                if x == 0:
+                    pos = add_edge(indicesPtr, pos, lrStart + lrFace + ((zMax-1) * yMax) + y) # Right (zy)
+                if ((x+1) == xMax):
+                    pos = add_edge(indicesPtr, pos, lrStart + y) # Left (zy)
+                if y == 0:
+                    pos = add_edge(indicesPtr, pos, btStart + (((xMax-1)-x) * zMax)) # Bottom (xz)
+                if ((y+1) == yMax):
+                    pos = add_edge(indicesPtr, pos, btStart + btFace + (((xMax-1)-x) * zMax) + (zMax-1)) # Top (xz)
+
+        elif cell < btStart:
+            faceIdx = <int>((cell - lrStart) // lrFace)
+            faceCell = (cell - lrStart) % lrFace
+            z = <int>(faceCell // yMax)
+            y = <int>(faceCell % yMax)
+
+            if z > 0:
+                pos = add_edge(indicesPtr, pos, cell - yMax)
+            if (z+1) < zMax:
+                pos = add_edge(indicesPtr, pos, cell + yMax)
+            if y > 0:
+                pos = add_edge(indicesPtr, pos, cell - 1)
+            if (y+1) < yMax:
+                pos = add_edge(indicesPtr, pos, cell + 1)
+
+            if faceIdx == 0: # Left (zy)
+                if z == 0:
+                    pos = add_edge(indicesPtr, pos, fbFace + ((xMax-1) * yMax) + y) # Back (xy)
+                if ((z+1) == zMax):
+                    pos = add_edge(indicesPtr, pos, y) # Front (xy)
+                if y == 0:
+                    pos = add_edge(indicesPtr, pos, btStart + z) # Bottom (xz)
+                if ((y+1) == yMax):
+                    pos = add_edge(indicesPtr, pos, btStart + btFace + ((zMax-1)-z)) # Top (xz)
+            elif faceIdx == 1: # Right (zy)
+                if z == 0:
+                    pos = add_edge(indicesPtr, pos, ((xMax-1) * yMax) + y) # Front (xy)
+                if ((z+1) == zMax):
+                    pos = add_edge(indicesPtr, pos, fbFace + y) # Back (xy)
+                if y == 0:
+                    pos = add_edge(indicesPtr, pos, btStart + ((xMax-1) * zMax) + ((zMax-1)-z)) # Bottom (xz)
+                if ((y+1) == yMax):
+                    pos = add_edge(indicesPtr, pos, btStart + btFace + ((xMax-1) * zMax) + z) # Top (xz)
+
+        else:
+            faceIdx = <int>((cell - btStart) // btFace)
+            faceCell = (cell - btStart) % btFace
+            x = <int>(faceCell // zMax)
+            z = <int>(faceCell % zMax)
+
+            if x > 0:
+                pos = add_edge(indicesPtr, pos, cell - zMax)
+            if (x+1) < xMax:
+                pos = add_edge(indicesPtr, pos, cell + zMax)
+            if z > 0:
+                pos = add_edge(indicesPtr, pos, cell - 1)
+            if (z+1) < zMax:
+                pos = add_edge(indicesPtr, pos, cell + 1)
+
+            if faceIdx == 0: # Bottom (xz)
+                if x == 0:
+                    pos = add_edge(indicesPtr, pos, lrStart + (z * yMax)) # Left (zy)
+                if ((x+1) == xMax):
+                    pos = add_edge(indicesPtr, pos, lrStart + lrFace + (((zMax-1)-z) * yMax)) # Right (zy)
+                if z == 0:
+                    pos = add_edge(indicesPtr, pos, fbFace + (((xMax-1)-x) * yMax)) # Back (xy)
+                if ((z+1) == zMax):
+                    pos = add_edge(indicesPtr, pos, x * yMax) # Front (xy)
+            elif faceIdx == 1: # Top (xz)
+                if x == 0:
+                    pos = add_edge(indicesPtr, pos, lrStart + (((zMax-1)-z) * yMax) + (yMax-1)) # Left (zy)
+                if ((x+1) == xMax):
+                    pos = add_edge(indicesPtr, pos, lrStart + lrFace + (z * yMax) + (yMax-1)) # Right (zy)
+                if z == 0:
+                    pos = add_edge(indicesPtr, pos, (x * yMax) + (yMax-1)) # Front (xy)
+                if ((z+1) == zMax):
+                    pos = add_edge(indicesPtr, pos, fbFace + (((xMax-1)-x) * yMax) + (yMax-1)) # Back (xy)
+    indptr_view[numCells] = pos
+    return SandpileGraph(indptr, indices[:pos].copy(), 4)
+
+@boundscheck(False)
+@wraparound(False)
+@cdivision(True)
+def build_icosahedron_graph(int xMax, int yMax, int arrX, int arrY):
+    cdef int x
+    cdef int y
+    cdef int strip
+    cdef int rowStart
+    cdef int rowEnd
+    cdef int targetX
+    cdef int targetY
+    cdef int yOffset
+    cdef int arrXmid = arrX // 2
+    cdef long long cell
+    cdef long long pos = 0
+    cdef long long numCells = <long long>arrX * arrY
+
+    indptr = np.zeros(numCells + 1, dtype=np.int64)
+    indices = np.empty(numCells * 6, dtype=np.int64)
+    cdef long long[::1] indptr_view = indptr
+    cdef long long[::1] indices_view = indices
+    cdef long long* indicesPtr = &indices_view[0]
+
+    for cell in range(numCells):
+        indptr_view[cell] = pos
+        x = <int>(cell // arrY)
+        y = <int>(cell % arrY)
+
+        strip = y // yMax
+        rowStart = yMax * strip
+        rowEnd = rowStart + (yMax - 1)
+
+        # Internal to strip x toppling
+        if x > 0:
+            pos = add_edge(indicesPtr, pos, cell - arrY)
+        if x < (arrX - 1):
+            pos = add_edge(indicesPtr, pos, cell + arrY)
+
+        # Internal to strip y toppling
+        if x % 2 == 0 and y < rowEnd: # Even xIdx
+            pos = add_edge(indicesPtr, pos, cell + arrY + 1)
+        if x % 2 == 1 and y > rowStart: # Odd xIdx
+            pos = add_edge(indicesPtr, pos, cell - arrY - 1)
+
+        # faceIdx % 4 == 0 toppling edge cases
+        if x == 0: # left edge goes up to bottom edge
+            yOffset = y % yMax
+            targetX = ((yMax-1) - yOffset) * 2
+            if strip == 0:
+                targetY = arrY - 1
+            else:
+                targetY = rowStart - 1
+            pos = add_edge(indicesPtr, pos, (<long long>targetX * arrY) + targetY)
+
+        if x % 2 == 0 and x < xMax and y == rowEnd: # bottom edge goes down to left edge
+            targetY = ((xMax-1) - x) // 2
+            if strip < 4:
+                targetY = targetY + rowEnd + 1
+            pos = add_edge(indicesPtr, pos, targetY)
+
+        # faceIdx % 4 == 1 toppling edge cases
+        if x % 2 == 1 and x < arrXmid and y == rowStart: # top edge goes up to bottom edge
+            targetX = x + xMax
+            if strip == 0:
+                targetY = arrY - 1
+            else:
+                targetY = rowStart - 1
+            pos = add_edge(indicesPtr, pos, (<long long>targetX * arrY) + targetY)
+
+        # faceIdx % 4 == 2 toppling edge cases
+        if x % 2 == 0 and x >= arrXmid and x < (arrX-1) and y == rowEnd: # bottom edge goes down to top edge
+            targetX = x - xMax
+            if strip == 4:
+                targetY = 0
+            else:
+                targetY = rowEnd + 1
+            pos = add_edge(indicesPtr, pos, (<long long>targetX * arrY) + targetY)
+
+        # faceIdx % 4 == 3 toppling edge cases
+        if x == (arrX-1): # right edge goes down to top edge
+            yOffset = y % yMax
+            targetX = (((yMax-1) - yOffset) * 2) + (arrX - xMax)
+            if strip == 4:
+                targetY = 0
+            else:
+                targetY = rowEnd + 1
+            pos = add_edge(indicesPtr, pos, (<long long>targetX * arrY) + targetY)
+
+        if x % 2 == 1 and x >= (arrX - xMax) and y == rowStart: # top edge goes up to right edge
+            targetX = arrX - 1
+            targetY = ((arrX-1) - x) // 2
+            if strip == 0:
+                targetY = targetY + (arrY - yMax)
+            else:
+                targetY = targetY + (rowStart - yMax)
+            pos = add_edge(indicesPtr, pos, (<long long>targetX * arrY) + targetY)
+
+    indptr_view[numCells] = pos
+    return SandpileGraph(indptr, indices[:pos].copy(), 3)
+
+def topple_graph(flatSandbox, graph, engine='worklist', int threads=0, stats=None, progress=None, long long progressWaves=PROGRESS_WAVES, metrics=None, gridShape=None):
+    if engine == 'vectorized':
+        return topple_graph_vectorized(flatSandbox, graph)
+    elif engine == 'parallel':
+        return topple_graph_parallel(flatSandbox, graph, threads=threads)
+    elif engine == 'presolve':
+        return topple_graph_presolved(flatSandbox, graph, stats=stats)
+    return topple_graph_worklist(flatSandbox, graph, progress=progress, progressWaves=progressWaves, metrics=metrics, gridShape=gridShape)
+
+def topple_graph_pile(pile, graph, engine='worklist', int threads=0, stats=None, progress=None, long long progressWaves=PROGRESS_WAVES, metrics=None):
+    # Graph kernel on a 2D pile, returns (pile, toppleCtr, pileBorders)
+    flatProgress = None
+    if progress is not None:
+        flatProgress = lambda flat, toppleCtr: progress(flat.reshape(pile.shape), toppleCtr)
+    flatSandbox, toppleCtr, touched = topple_graph(pile.reshape(-1), graph, engine, threads=threads, stats=stats, progress=flatProgress, progressWaves=progressWaves, metrics=metrics, gridShape=pile.shape)
+    return (flatSandbox.reshape(pile.shape), toppleCtr, touched.reshape(pile.shape))
+
+def topple_graph_cubesurface(sandbox_frontback, sandbox_leftright, sandbox_bottomtop, graph, engine='worklist', int threads=0, stats=None, metrics=None):
+    # Graph kernel on the three cube face pairs, returns (frontback, leftright, bottomtop, toppleCtr)
+    flatSandbox = np.concatenate((sandbox_frontback.reshape(-1), sandbox_leftright.reshape(-1), sandbox_bottomtop.reshape(-1)))
+    flatSandbox, toppleCtr = topple_graph(flatSandbox, graph, engine, threads=threads, stats=stats, metrics=metrics)[:2]
+    fbEnd = sandbox_frontback.size
+    lrEnd = fbEnd + sandbox_leftright.size
+    return (flatSandbox[:fbEnd].reshape(sandbox_frontback.shape), flatSandbox[fbEnd:lrEnd].reshape(sandbox_leftright.shape), flatSandbox[lrEnd:].reshape(sandbox_bottomtop.shape), toppleCtr)
+
+'''
+Graph Worklist Topple Algorithm:
+
+The worklist kernel on the CSR table, with waves in flat cell order.
+
+Returns a tuple (flatSandpile, toppleCtr, touched) where touched flags every
+cell which toppled or received grains. If an odometer array is given, each
+cell's number of topples is added to it. If progress is given it is called
+with (flatSandpile, toppleCtr) every progressWaves waves. Grains lost in the
+wave metrics are those a cell with fewer neighbors than the threshold sends
+off the table. gridShape (xMax, yMax) gives the bounding box of a flat 2D pile.
+'''
+
+@boundscheck(False)
+@wraparound(False)
+@cdivision(True)
+def topple_graph_worklist(flatSandbox, graph, odometer=None, progress=None, long long progressWaves=PROGRESS_WAVES, metrics=None, gridShape=None):
+    cdef long long cell
+    cdef long long edge
+    cdef long long target
+    cdef Py_ssize_t idx
+    cdef Py_ssize_t numActive
+    cdef Py_ssize_t numNext
+    cdef long long numToMove
+    cdef long long toppleCtr = 0
+    cdef long long waves = 0
+    cdef bint reportProgress = progress is not None and progressWaves > 0
+    cdef bint reportMetrics = metrics is not None
+    cdef bint hasBox = gridShape is not None
+    cdef long long gridY = gridShape[1] if hasBox else 1
+    cdef WaveStats waveStats
+    cdef double clock = 0
+    cdef Py_ssize_t numUnstable
+    cdef long long threshold = graph.threshold
+    cdef long long* sandboxPtr
+    cdef unsigned char* queuedPtr
+    cdef unsigned char* touchedPtr
+    cdef long long* active
+    cdef long long* nextCells
+    cdef long long* swapCells
+    cdef long long* odometerPtr = NULL
+    cdef long long[::1] odometer_view
+    reset_stats(&waveStats)
+
+    if reportMetrics:
+        clock = perf_counter()
+    activeCells, numActive = initial_worklist(flatSandbox, threshold)
+    nextCellsArr = np.empty(graph.numCells, dtype=np.int64)
+    queued = np.zeros(graph.numCells, dtype=np.uint8)
+    touched = np.zeros(graph.numCells, dtype=np.uint8)
+    if odometer is not None:
+        odometer_view = odometer
+        odometerPtr = &odometer_view[0]
+
+    cdef long long[::1] sandbox_view = flatSandbox
+    cdef long long[::1] indptr_view = graph.indptr
+    cdef long long[::1] indices_view = graph.indices
+    cdef unsigned char[::1] queued_view = queued
+    cdef unsigned char[::1] touched_view = touched
+    cdef long long[::1] active_view = activeCells
+    cdef long long[::1] next_view = nextCellsArr
+    sandboxPtr = &sandbox_view[0]
+    queuedPtr = &queued_view[0]
+    touchedPtr = &touched_view[0]
+    active = &active_view[0]
+    nextCells = &next_view[0]
+
+    with nogil:
+        if reportMetrics:
+            waveStats.scanTime = perf_counter() - clock
+            clock = perf_counter()
+        while numActive > 0:
+            toppleCtr += numActive
+            numNext = 0
+            for idx in range(numActive):
+                cell = active[idx]
+                numToMove = sandboxPtr[cell] // threshold
+                if reportMetrics:
+                    waveStats.excess += sandboxPtr[cell] - (threshold - 1)
+                    waveStats.lost += (threshold - (indptr_view[cell+1] - indptr_view[cell])) * numToMove
+                    if touchedPtr[cell] == 0:
+                        touch_cell(&waveStats, cell // gridY, cell % gridY)
+                touchedPtr[cell] = 1
+                if odometerPtr != NULL:
+                    odometerPtr[cell] += numToMove
+                for edge in range(indptr_view[cell], indptr_view[cell+1]):
+                    target = indices_view[edge]
+                    add_grains(sandboxPtr, queuedPtr, nextCells, &numNext, target, numToMove)
+                    if reportMetrics and touchedPtr[target] == 0:
+                        touch_cell(&waveStats, target // gridY, target % gridY)
+                    touchedPtr[target] = 1
+                sandboxPtr[cell] -= (threshold * numToMove)
+            if reportMetrics:
+                waveStats.relaxTime = perf_counter() - clock
+                clock = perf_counter()
+            numUnstable = numActive
+            numActive = collect_unstable(sandboxPtr, queuedPtr, nextCells, numNext, threshold)
+            swapCells = active
+            active = nextCells
+            nextCells = swapCells
+            waves += 1
+            if reportMetrics:
+                waveStats.scanTime += perf_counter() - clock
+                with gil:
+                    metrics(wave_record(waves, numUnstable, toppleCtr, &waveStats, hasBox))
+                reset_wave(&waveStats)
+            if reportProgress and waves % progressWaves == 0:
+                with gil:
+                    progress(flatSandbox, toppleCtr)
+            if reportMetrics:
+                clock = perf_counter()
+    return (flatSandbox, toppleCtr, touched)
+
+'''
+Graph Vectorized Topple Algorithm:
+
+Synchronous waves on the CSR table: the unstable cells' neighbor lists are
+gathered with one fancy index and the grains added with np.add.at.
+'''
+
+def topple_graph_vectorized(flatSandbox, graph):
+    cdef long long toppleCtr = 0
+    threshold = graph.threshold
+    degrees = graph.degrees()
+    touched = np.zeros(graph.numCells, dtype=np.uint8)
+
+    active = np.flatnonzero(flatSandbox >= threshold)
+    while len(active) > 0:
+        toppleCtr += len(active)
+        numToMove = flatSandbox[active] // threshold
+        flatSandbox[active] -= threshold * numToMove
+        touched[active] = 1
+
+        # Concatenated neighbor lists of the active cells
+        counts = degrees[active]
+        ends = np.cumsum(counts)
+        edges = np.arange(ends[-1] if len(ends) > 0 else 0, dtype=np.int64) + np.repeat(graph.indptr[active] - (ends - counts), counts)
+        targets = graph.indices[edges]
+        np.add.at(flatSandbox, targets, np.repeat(numToMove, counts))
+        touched[targets] = 1
+        active = np.flatnonzero(flatSandbox >= threshold)
+    return (flatSandbox, toppleCtr, touched)
+
+'''
+Graph Parallel Topple Algorithm:
+
+Synchronous waves on the CSR table in OpenMP threads. Like the row stripe
+kernel, the first pass computes q = sandbox // threshold and the second pass
+gathers each cell's grains through the reversed table, so each cell is only
+written by one thread.
+'''
+
+@boundscheck(False)
+@wraparound(False)
+@cdivision(True)
+def topple_graph_parallel(flatSandbox, graph, int threads=0):
+    cdef long long cell
+    cdef long long edge
+    cdef long long numCells = graph.numCells
+    cdef long long numUnstable
+    cdef long long toppleCtr = 0
+    cdef long long total
+    cdef long long sent
+    cdef long long threshold = graph.threshold
+    cdef int numThreads = resolve_threads(threads)
+    cdef bint touchedCell
+
+    reverseGraph = graph.reverse()
+    q = np.zeros(numCells, dtype=np.int64)
+    touched = np.zeros(numCells, dtype=np.uint8)
+
+    cdef long long[::1] sandbox_view = flatSandbox
+    cdef long long[::1] q_view = q
+    cdef unsigned char[::1] touched_view = touched
+    cdef long long[::1] rindptr_view = reverseGraph.indptr
+    cdef long long[::1] rindices_view = reverseGraph.indices
+
+    while True:
+        numUnstable = 0
+        with nogil, parallel(num_threads=numThreads):
+            for cell in prange(numCells, schedule='static'):
+                if sandbox_view[cell] >= threshold:
+                    q_view[cell] = sandbox_view[cell] // threshold
+                    numUnstable += 1
+                else:
+                    q_view[cell] = 0
+        if numUnstable == 0:
+            break
+        toppleCtr += numUnstable
+
+        with nogil, parallel(num_threads=numThreads):
+            for cell in prange(numCells, schedule='static'):
+                total = -(threshold * q_view[cell])
+                touchedCell = q_view[cell] > 0
+                for edge in range(rindptr_view[cell], rindptr_view[cell+1]):
+                    sent = q_view[rindices_view[edge]]
+                    if sent > 0:
+                        total = total + sent
+                        touchedCell = True
+                if touchedCell:
+                    sandbox_view[cell] += total
+                    touched_view[cell] = 1
+    return (flatSandbox, toppleCtr, touched)
+
+
+##########################
+#  Symmetry Reduction    #
+##########################
+
+SYMMETRY_GENERATORS = {'D2': ['reflectX', 'reflectY'], 'D4': ['reflectX', 'reflectY', 'transpose'], 'translation': ['translateX', 'translateY'],
+                       'auto': ['reflectX', 'reflectY', 'transpose', 'translateX', 'translateY']}
+
+'''
+Symmetry Reduction (Fundamental Domain):
+
+A pile whose starting grains and lattice are both unchanged by a set of
+cell permutations (reflections, the transpose of a square array, shifts
+along a wrapped axis) stays symmetric while it topples, so only one cell
+of each orbit needs to be toppled. Each symmetry family named by the config
+('D2', 'D4', 'translation' or 'auto' for all of them) is tried in turn, the
+first candidate of each kind which leaves both the pile and the CSR table
+unchanged is kept, and the orbits are the cells linked by the kept ones.
+
+The quotient table has one cell per orbit (its lowest flat index, so the
+domain keeps row-major order). A domain cell receives a grain from the
+orbit of every cell which sends one to it, so each full table edge
+(cell -> target) with target in the domain becomes (orbit of cell ->
+target). Seams need no special cases: a cell beside a mirror line receives
+from its own orbit through the mirrored neighbor. The worklist kernel topples
+the quotient (whatever the engine) and the full pile and bound are read
+back through the orbit map, identical to toppling the full pile. toppleCtr
+counts the domain cells toppled.
+'''
+
+def reflect_positions(int size, bint wrap):
+    # Candidate mirrors of one axis: the flip of a bounded axis, or every c - x of a wrapped one
+    positions = np.arange(size, dtype=np.int64)
+    if not wrap:
+        return [(size - 1) - positions]
+    return [(c - positions) % size for c in range(size)]
+
+def translate_positions(int size, bint wrap):
+    # Candidate shifts of a wrapped axis, shortest first
+    positions = np.arange(size, dtype=np.int64)
+    if not wrap:
+        return []
+    return [(positions + shift) % size for shift in range(1, size) if size % shift == 0]
+
+def symmetry_candidates(generator, int xMax, int yMax, shape):
+    # Flat index permutations to try for one generator kind
+    wrapX = shape == 'cylinder' or shape == 'squarewrap'
+    wrapY = shape == 'squarewrap'
+    xs, ys = np.meshgrid(np.arange(xMax, dtype=np.int64), np.arange(yMax, dtype=np.int64), indexing='ij')
+    if generator == 'reflectX':
+        return [(newX[xs] * yMax) + ys for newX in reflect_positions(xMax, wrapX)]
+    elif generator == 'reflectY':
+        return [(xs * yMax) + newY[ys] for newY in reflect_positions(yMax, wrapY)]
+    elif generator == 'transpose' and xMax == yMax and wrapX == wrapY:
+        return [(ys * yMax) + xs]
+    elif generator == 'translateX':
+        return [(newX[xs] * yMax) + ys for newX in translate_positions(xMax, wrapX)]
+    elif generator == 'translateY':
+        return [(xs * yMax) + newY[ys] for newY in translate_positions(yMax, wrapY)]
+    return []
+
+def graph_edge_keys(graph, perm=None):
+    # Sorted (cell, target) edge keys of the table, with the cells renamed by perm if given
+    sources = np.repeat(np.arange(graph.numCells, dtype=np.int64), graph.degrees())
+    targets = graph.indices
+    if perm is not None:
+        sources = perm[sources]
+        targets = perm[targets]
+    return np.sort((sources * graph.numCells) + targets)
+
+def find_symmetries(flatSandbox, graph, int xMax, int yMax, shape, symmetry='auto'):
+    # Permutations (each with its inverse) leaving the pile and the table unchanged
+    if symmetry not in SYMMETRY_GENERATORS:
+        raise ValueError(f'Unknown symmetry: {symmetry}')
+    edgeKeys = None
+    perms = []
+    for generator in SYMMETRY_GENERATORS[symmetry]:
+        for perm in symmetry_candidates(generator, xMax, yMax, shape):
+            perm = perm.reshape(-1)
+            if not np.array_equal(flatSandbox[perm], flatSandbox):
+                continue
+            if edgeKeys is None:
+                edgeKeys = graph_edge_keys(graph)
+            if np.array_equal(graph_edge_keys(graph, perm), edgeKeys):
+                inverse = np.empty_like(perm)
+                inverse[perm] = np.arange(len(perm), dtype=np.int64)
+                perms.extend([perm, inverse])
+                break
+    return perms
+
+def symmetry_orbits(perms, long long numCells):
+    # Lowest flat index of each cell's orbit
+    orbit = np.arange(numCells, dtype=np.int64)
+    while True:
+        linked = np.minimum.reduce([orbit] + [orbit[perm] for perm in perms])
+        if np.array_equal(linked, orbit):
+            return orbit
+        orbit = linked
+
+def quotient_graph(graph, orbit):
+    # Returns (quotient SandpileGraph, domain cells, full cell -> domain index)
+    domain = np.flatnonzero(orbit == np.arange(graph.numCells))
+    domainIndex = np.searchsorted(domain, orbit)
+    sources = np.repeat(np.arange(graph.numCells, dtype=np.int64), graph.degrees())
+    inDomain = orbit[graph.indices] == graph.indices
+    quotientSources = domainIndex[sources[inDomain]]
+    order = np.argsort(quotientSources, kind='stable')
+    indptr = np.zeros(len(domain) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(quotientSources, minlength=len(domain)), out=indptr[1:])
+    indices = domainIndex[graph.indices[inDomain]][order]
+    return (SandpileGraph(indptr, np.ascontiguousarray(indices), graph.threshold), domain, domainIndex)
+
+def topple_symmetric(pile, graph, int xMax, int yMax, shape, symmetry='auto', multiscale=False, stats=None, metrics=None):
+    # Stabilizes a 2D grid pile on its fundamental domain, returns (pile, toppleCtr, pileBorders) or None without symmetries
+    perms = find_symmetries(pile.reshape(-1), graph, xMax, yMax, shape, symmetry)
+    if len(perms) == 0:
+        return None
+    quotient, domain, domainIndex = quotient_graph(graph, symmetry_orbits(perms, graph.numCells))
+    if stats is not None:
+        stats.update({'symmetryCells': graph.numCells, 'domainCells': len(domain)})
+    topple_domain = lambda domainPile: topple_graph_worklist(domainPile, quotient, metrics=metrics)
+    if multiscale:
+        domainPile, toppleCtr, touched = stabilize_multiscale((pile.reshape(-1)[domain].copy(),), topple_domain)
+    else:
+        domainPile, toppleCtr, touched = topple_domain(pile.reshape(-1)[domain].copy())
+    return (domainPile[domainIndex].reshape((xMax, yMax)), toppleCtr, touched[domainIndex].reshape((xMax, yMax)))
+
+
+#############################
+#  Odometer Pre-solve        #
+#############################
+
+PRESOLVE_DENSITY = 0.53 # Pre-solve target grains per cell, as a fraction of the threshold
+PRESOLVE_ITERATIONS = 2 # Active set solves, the correction finishes whatever they leave
+
+'''
+Odometer Pre-solve:
+
+The odometer u (how many times each cell topples) gives the stable pile as
+c - L u, where L = threshold * I - A^T is the graph Laplacian (A[i, j] is the
+number of grains cell i sends to cell j). By the least action principle u is
+the smallest u >= 0 with c - L u <= threshold - 1.
+
+presolve_odometer approximates u with the obstacle problem v >= 0,
+c - L v <= density, solved by a primal-dual active set loop of sparse solves,
+and floor(v) is toppled in bulk. correct_odometer then makes it exact: the
+worklist kernel topples what is left (cells under-toppled by the guess), and
+cells the guess over-toppled are unfired by a burning pass until no set of
+cells can be unfired, at which point the odometer is the least action one.
+The stable pile is identical to the direct method.
+'''
+
+def graph_laplacian(graph, dtype=np.float64):
+    from scipy.sparse import csr_matrix, identity
+    numCells = graph.numCells
+    adjacency = csr_matrix((np.ones(len(graph.indices), dtype=dtype), graph.indices, graph.indptr), shape=(numCells, numCells))
+    adjacency.sum_duplicates()
+    return (graph.threshold * identity(numCells, dtype=dtype, format='csr')) - adjacency.T.tocsr()
+
+def presolve_odometer(flatSandbox, graph, density=None, int maxIterations=PRESOLVE_ITERATIONS):
+    from scipy.sparse.linalg import spsolve
+    if density is None:
+        density = PRESOLVE_DENSITY * graph.threshold
+    laplacian = graph_laplacian(graph)
+    rhs = flatSandbox.astype(np.float64) - density
+    numCells = graph.numCells
+    closed = bool(np.all(graph.degrees() == graph.threshold)) # No grains fall off (cube and icosahedron surfaces)
+
+    free = np.ones(numCells, dtype=bool)
+    if closed:
+        # Singular Laplacian: the grains either cover the whole surface (v is the
+        # balanced solution shifted to min 0) or v = 0 at the point furthest from them
+        balanced = np.zeros(numCells)
+        balanced[1:] = spsolve(laplacian[1:, 1:].tocsc(), flatSandbox[1:] - flatSandbox.mean())
+        if flatSandbox.sum() >= density * numCells:
+            return np.floor(balanced - balanced.min()).astype(np.int64)
+        free[np.argmin(balanced)] = False
+
+    odometer = np.zeros(numCells)
+    for _ in range(maxIterations):
+        odometer[:] = 0
+        if free.any():
+            odometer[free] = spsolve(laplacian[free][:, free].tocsc(), rhs[free])
+        residual = (laplacian @ odometer) - rhs
+        nextFree = (odometer - residual) > 0
+        if np.array_equal(nextFree, free):
+            break
+        free = nextFree
+    return np.floor(np.maximum(odometer, 0)).astype(np.int64)
+
+@boundscheck(False)
+@wraparound(False)
+@cdivision(True)
+def unfire_graph_odometer(flatSandbox, odometer, graph):
+    '''
+    Unfires (reverses one topple of) the largest set of toppled cells which
+    stays stable, until no set can be unfired. Burning: start from every cell
+    with odometer > 0 and remove cells receiving too few grains from the set to
+    stay stable when unfired. Returns the number of unfire rounds.
+    '''
+    cdef long long cell
+    cdef long long edge
+    cdef long long target
+    cdef long long numCells = graph.numCells
+    cdef long long threshold = graph.threshold
+    cdef Py_ssize_t numBurn
+    cdef Py_ssize_t numInSet
+    cdef long long rounds = 0
+
+    inSet = np.zeros(numCells, dtype=np.uint8)
+    received = np.zeros(numCells, dtype=np.int64)
+    burnStack = np.empty(numCells, dtype=np.int64)
+
+    cdef long long[::1] sandbox_view = flatSandbox
+    cdef long long[::1] odometer_view = odometer
+    cdef long long[::1] indptr_view = graph.indptr
+    cdef long long[::1] indices_view = graph.indices
+    cdef unsigned char[::1] inSet_view = inSet
+    cdef long long[::1] received_view = received
+    cdef long long[::1] burn_view = burnStack
+
+    with nogil:
+        while True:
+            numInSet = 0
+            for cell in range(numCells):
+                inSet_view[cell] = odometer_view[cell] > 0
+                received_view[cell] = 0
+            for cell in range(numCells):
+                if inSet_view[cell]:
+                    numInSet += 1
+                    for edge in range(indptr_view[cell], indptr_view[cell+1]):
+                        received_view[indices_view[edge]] += 1
+
+            # Unfiring the set adds threshold - received grains to each cell in it
+            numBurn = 0
+            for cell in range(numCells):
+                if inSet_view[cell] and sandbox_view[cell] + threshold - received_view[cell] >= threshold:
+                    inSet_view[cell] = 0
+                    burn_view[numBurn] = cell
+                    numBurn += 1
+            while numBurn > 0:
+                numBurn -= 1
+                cell = burn_view[numBurn]
+                numInSet -= 1
+                for edge in range(indptr_view[cell], indptr_view[cell+1]):
+                    target = indices_view[edge]
+                    received_view[target] -= 1
+                    if inSet_view[target] and sandbox_view[target] + threshold - received_view[target] >= threshold:
+                        inSet_view[target] = 0
+                        burn_view[numBurn] = target
+                        numBurn += 1
+
+            if numInSet == 0:
+                break
+            rounds += 1
+            for cell in range(numCells):
+                if inSet_view[cell]:
+                    odometer_view[cell] -= 1
+                    sandbox_view[cell] += threshold
+                    for edge in range(indptr_view[cell], indptr_view[cell+1]):
+                        sandbox_view[indices_view[edge]] -= 1
+    return rounds
+
+def correct_odometer(flatSandbox, odometer, graph):
+    # Topples the cells under-toppled by the pre-solve, then unfires the over-toppled ones
+    toppleCtr = topple_graph_worklist(flatSandbox, graph, odometer=odometer)[1]
+    unfireRounds = unfire_graph_odometer(flatSandbox, odometer, graph)
+    return (toppleCtr, unfireRounds)
+
+def topple_graph_presolved(flatSandbox, graph, density=None, stats=None):
+    '''
+    Stabilizes a flat pile by odometer pre-solve and exact correction. Returns
+    (flatSandpile, toppleCtr, touched) like the other graph kernels, where
+    toppleCtr counts the correction topples. If a stats dict is given it is
+    filled with the time split and how many topples each stage did.
+    '''
+    start = time()
+    odometer = presolve_odometer(flatSandbox, graph, density)
+    presolveFirings = int(odometer.sum())
+    flatSandbox -= (graph_laplacian(graph, dtype=np.int64) @ odometer)
+    presolveTime = time() - start
+
+    start = time()
+    toppleCtr, unfireRounds = correct_odometer(flatSandbox, odometer, graph)
+    fired = odometer > 0
+    touched = fired.astype(np.uint8)
+    touched[graph.indices[np.repeat(fired, graph.degrees())]] = 1
+    correctionTime = time() - start
+
+    if stats is not None:
+        stats.update({'presolveTime': presolveTime, 'correctionTime': correctionTime, 'presolveFirings': presolveFirings, 'totalFirings': int(odometer.sum()), 'correctionTopples': toppleCtr, 'unfireRounds': unfireRounds})
+    return (flatSandbox, toppleCtr, touched)
+
+
+#######################
+#  Avalanche Drops    #
+#######################
+
+'''
+Avalanche Drops:
+
+Adds grains one at a time to a stable flat pile on the CSR table, relaxing
+the pile after each grain. Only the cells an avalanche reaches are visited:
+the unstable cells are kept on a stack for the current wave and one for the
+next, so a drop costs time proportional to its avalanche and nothing is
+rescanned. Each cell is on the next stack at most once (queued flags).
+
+For drop d at sites[d] it writes:
+
+size      topples (firings, numToMove per toppling cell)
+area      distinct cells which toppled
+duration  waves
+lost      grains sent off the table
+
+Area uses a per-cell stamp of the last drop which toppled the cell (lastDrop,
+kept by the caller across batches with firstDrop numbering the batch), so
+nothing is cleared between drops. The pile must have a sink (some cell with
+fewer neighbors than the threshold) or an avalanche may never end.
+'''
+
+@boundscheck(False)
+@wraparound(False)
+@cdivision(True)
+def topple_graph_avalanches(flatSandbox, graph, sites, sizes, areas, durations, losses, lastDrop, long long firstDrop=0):
+    cdef long long cell
+    cdef long long edge
+    cdef long long target
+    cdef long long stamp
+    cdef long long numToMove
+    cdef long long size
+    cdef long long area
+    cdef long long duration
+    cdef long long lost
+    cdef Py_ssize_t drop
+    cdef Py_ssize_t idx
+    cdef Py_ssize_t numActive
+    cdef Py_ssize_t numNext
+    cdef Py_ssize_t numDrops = len(sites)
+    cdef long long threshold = graph.threshold
+    cdef long long* active
+    cdef long long* nextCells
+    cdef long long* swapCells
+
+    activeCells = np.empty(graph.numCells, dtype=np.int64)
+    nextCellsArr = np.empty(graph.numCells, dtype=np.int64)
+    queued = np.zeros(graph.numCells, dtype=np.uint8)
+
+    cdef long long[::1] sandbox_view = flatSandbox
+    cdef long long[::1] indptr_view = graph.indptr
+    cdef long long[::1] indices_view = graph.indices
+    cdef long long[::1] sites_view = sites
+    cdef long long[::1] sizes_view = sizes
+    cdef long long[::1] areas_view = areas
+    cdef long long[::1] durations_view = durations
+    cdef long long[::1] losses_view = losses
+    cdef long long[::1] lastDrop_view = lastDrop
+    cdef unsigned char[::1] queued_view = queued
+    cdef long long[::1] active_view = activeCells
+    cdef long long[::1] next_view = nextCellsArr
+    active = &active_view[0]
+    nextCells = &next_view[0]
+
+    with nogil:
+        for drop in range(numDrops):
+            stamp = firstDrop + drop
+            cell = sites_view[drop]
+            sandbox_view[cell] += 1
+            size = 0
+            area = 0
+            duration = 0
+            lost = 0
+            numActive = 0
+            if sandbox_view[cell] >= threshold:
+                active[0] = cell
+                queued_view[cell] = 1
+                numActive = 1
+            while numActive > 0:
+                duration += 1
+                numNext = 0
+                for idx in range(numActive):
+                    cell = active[idx]
+                    queued_view[cell] = 0
+                    numToMove = 1
+                    if sandbox_view[cell] >= 2 * threshold: # Rare with single grains, skips the division
+                        numToMove = sandbox_view[cell] // threshold
+                    size += numToMove
+                    if lastDrop_view[cell] != stamp:
+                        lastDrop_view[cell] = stamp
+                        area += 1
+                    lost += (threshold - (indptr_view[cell+1] - indptr_view[cell])) * numToMove
+                    sandbox_view[cell] -= (threshold * numToMove)
+                    for edge in range(indptr_view[cell], indptr_view[cell+1]):
+                        target = indices_view[edge]
+                        sandbox_view[target] += numToMove
+                        if sandbox_view[target] >= threshold and queued_view[target] == 0:
+                            queued_view[target] = 1
+                            nextCells[numNext] = target
+                            numNext += 1
+                numActive = numNext
+                swapCells = active
+                active = nextCells
+                nextCells = swapCells
+            sizes_view[drop] = size
+            areas_view[drop] = area
+            durations_view[drop] = duration
+            losses_view[drop] = lost
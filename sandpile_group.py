@@ -0,0 +1,353 @@
+import sandpile_calculations as sp
+import pile_archive
+import pile_metadata as pile_meta
+
+import argparse
+import hashlib
+import json
+import os
+from functools import lru_cache
+from time import perf_counter
+
+import numpy as np
+
+'''
+Sandpile group of each pile geometry: the recurrent stable piles with
+addition a + b = stab(a + b).
+
+Every geometry is toppled on its CSR graph (see Graph Topple Algorithms in
+sandpile_calculations), the grains a cell sends off the table going to the
+sink. Bounded squares and cylinders lose grains on their open edges. The
+closed surfaces (squarewrap, cubesurface, icosahedronsurface) lose none, so
+sink cells are taken out of the table: a sink cell has no edges and the
+edges into it are dropped, so it holds no grains and its neighbors lose the
+grains they would send it. By default the closed surfaces have cell 0 as
+their sink; --sink adds sink cells to any geometry.
+
+With maxStable = threshold - 1 on every cell (0 on the sink):
+
+    zero      = 2 * maxStable - stab(2 * maxStable), a pile >= maxStable
+                equivalent to the empty pile (it topples back to nothing
+                modulo the Laplacian)
+    identity  = stab(zero)
+    inverse   = stab(zero + identity - a) (zero >= a for stable a)
+    recurrent = stab(c + identity) == c
+
+The identity and zero piles are invariant under every symmetry of the table
+which keeps the sink, so for square piles they are stabilized on the
+fundamental domain (quotient_graph) and with the odometer pre-solve engine,
+which together are about 100x faster than the worklist on the full 256x256
+grid. Each geometry's identity is computed once: kept in memory (lru_cache)
+and written as a pile archive to identities/, keyed like the pile cache by a
+sha256 of the geometry.
+
+Run as a script it prints the identity's timing and checks the group axioms
+(identity, commutativity, associativity and inverses) on random recurrent
+piles, or adds two saved piles (--add).
+'''
+
+GROUP_TYPES = ['square', 'cylinder', 'squarewrap', 'cubesurface', 'icosahedronsurface']
+GRID_TYPES = ['square', 'cylinder', 'squarewrap']
+SURFACE_TOPPLE = {'cubesurface': 'von_neumann', 'icosahedronsurface': 'default'} # The only neighborhood of each surface
+DEFAULT_IDENTITY_DIR = 'identities'
+DEFAULT_SAMPLES = 3 # Random recurrent piles the axioms are checked on
+
+def group_geometry(pileType, xMax, yMax, zMax=None, numRows=None, topple='von_neumann', sink=None):
+    # Plain JSON description of a group (as pile_metadata records the geometry)
+    if pileType not in GROUP_TYPES:
+        raise ValueError(f'No sandpile group for {pileType} piles (types: {", ".join(GROUP_TYPES)})')
+    if pileType not in GRID_TYPES:
+        topple = SURFACE_TOPPLE[pileType]
+    elif not isinstance(topple, str):
+        topple = [list(offset) for offset in topple]
+    if pileType != 'cubesurface':
+        zMax = None
+    if pileType != 'icosahedronsurface':
+        numRows = None
+    return {'pileType': pileType, 'xMax': int(xMax), 'yMax': int(yMax), 'zMax': zMax, 'numRows': numRows, 'topple': topple,
+            'sink': sorted(int(cell) for cell in sink) if sink is not None else None}
+
+def group_key(geometry):
+    canonical = json.dumps(geometry, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def pile_graph(geometry):
+    # Graph of the pile type, without sink cells
+    pileType = geometry['pileType']
+    xMax = geometry['xMax']
+    yMax = geometry['yMax']
+    if pileType in GRID_TYPES:
+        topple = geometry['topple']
+        offsets = tuple(sp.resolve_neighborhood(topple if isinstance(topple, str) else [tuple(offset) for offset in topple]))
+        return sp.grid_graph(xMax, yMax, offsets, pileType)
+    elif pileType == 'cubesurface':
+        return sp.cubesurface_graph(xMax, yMax, geometry['zMax'])
+    return sp.icosahedron_graph(xMax, yMax, 2 * (xMax + 1), 5 * yMax)
+
+def sink_graph(graph, sinkCells):
+    # Copy of the table with the sink cells' edges and every edge into them removed
+    isSink = np.zeros(graph.numCells, dtype=bool)
+    isSink[sinkCells] = True
+    sources = np.repeat(np.arange(graph.numCells, dtype=np.int64), graph.degrees())
+    kept = ~(isSink[sources] | isSink[graph.indices])
+    indptr = np.zeros(graph.numCells + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources[kept], minlength=graph.numCells), out=indptr[1:])
+    return sp.SandpileGraph(indptr, np.ascontiguousarray(graph.indices[kept]), graph.threshold)
+
+class SandpileGroup():
+    '''
+    Group of one geometry. Piles are flat int64 arrays in the graph's cell
+    order (pile_cells and pile_arrays convert from and to the saved arrays).
+    engine is the graph engine of every stabilization ('presolve' or
+    'worklist'), symmetry the generators the identity is reduced by on grid
+    types ('none' to topple the full grid).
+    '''
+    def __init__(self, pileType, xMax, yMax, zMax=None, numRows=None, topple='von_neumann', sink=None, engine='presolve', symmetry='auto', directory=DEFAULT_IDENTITY_DIR):
+        graph = pile_graph(group_geometry(pileType, xMax, yMax, zMax, numRows, topple))
+        if sink is None and not np.any(graph.degrees() < graph.threshold):
+            sink = [0]
+        for cell in sink or []:
+            if cell < 0 or cell >= graph.numCells:
+                raise ValueError(f'Sink cell {cell} is not one of the {graph.numCells} cells')
+        self.geometry = group_geometry(pileType, xMax, yMax, zMax, numRows, topple, sink)
+        self.sink = np.array(self.geometry['sink'] or [], dtype=np.int64)
+        self.graph = sink_graph(graph, self.sink) if len(self.sink) > 0 else graph
+        self.numCells = self.graph.numCells
+        self.threshold = self.graph.threshold
+        self.engine = engine
+        self.symmetry = symmetry
+        self.directory = directory
+        self.maxStable = np.full(self.numCells, self.threshold - 1, dtype=np.int64)
+        self.maxStable[self.sink] = 0
+        self.identitySeconds = None
+        self.domainCells = self.numCells
+        self.cached = False
+
+    def stabilize(self, flatSandbox, graph=None):
+        return sp.topple_graph(np.array(flatSandbox, dtype=np.int64), self.graph if graph is None else graph, self.engine)[0]
+
+    def add(self, a, b):
+        return self.stabilize(a + b)
+
+    def zero_and_identity(self):
+        '''
+        (zero, identity) piles, from memory, the identities/ archive or
+        computed on the fundamental domain. The arrays are read only.
+        '''
+        zero, identity, seconds, domainCells, cached = group_identity(json.dumps(self.geometry, sort_keys=True), self.engine, self.symmetry, self.directory)
+        self.identitySeconds = seconds
+        self.domainCells = domainCells
+        self.cached = cached
+        return (zero, identity)
+
+    def identity(self):
+        return self.zero_and_identity()[1]
+
+    def inverse(self, a):
+        zero, identity = self.zero_and_identity()
+        return self.stabilize(zero + identity - a)
+
+    def is_recurrent(self, flatSandbox):
+        return bool(np.array_equal(self.add(flatSandbox, self.identity()), flatSandbox))
+
+    def random_recurrent(self, rng):
+        # stab(maxStable + random grains), recurrent since it is reached from the maximal stable pile
+        grains = rng.integers(0, self.threshold, self.numCells, dtype=np.int64)
+        grains[self.sink] = 0
+        return self.stabilize(self.maxStable + grains)
+
+    def compute_zero_and_identity(self):
+        # Stabilizes 2 * maxStable and then zero, on the fundamental domain where the table has symmetries
+        graph = self.graph
+        expand = None
+        maxStable = self.maxStable
+        if self.geometry['pileType'] in GRID_TYPES and self.symmetry != 'none':
+            xMax = self.geometry['xMax']
+            yMax = self.geometry['yMax']
+            perms = sp.find_symmetries(self.maxStable, self.graph, xMax, yMax, self.geometry['pileType'], self.symmetry)
+            if len(perms) > 0:
+                graph, domain, domainIndex = sp.quotient_graph(self.graph, sp.symmetry_orbits(perms, self.numCells))
+                maxStable = self.maxStable[domain]
+                expand = domainIndex
+        zero = (2 * maxStable) - self.stabilize(2 * maxStable, graph)
+        identity = self.stabilize(zero, graph)
+        if expand is not None:
+            return (zero[expand], identity[expand], graph.numCells)
+        return (zero, identity, graph.numCells)
+
+    '''
+    Pile Layout
+    '''
+
+    def pile_arrays(self, flatSandbox):
+        # Named arrays as sandpile_surface_toppling saves the pile (see pile_metadata.pile_names)
+        pileType = self.geometry['pileType']
+        xMax = self.geometry['xMax']
+        yMax = self.geometry['yMax']
+        if pileType == 'cubesurface':
+            zMax = self.geometry['zMax']
+            shapes = [(xMax, yMax), (xMax, yMax), (zMax, yMax), (zMax, yMax), (xMax, zMax), (xMax, zMax)]
+            ends = np.cumsum([shape[0] * shape[1] for shape in shapes])
+            faces = np.split(flatSandbox, ends[:-1])
+            return {face: cells.reshape(shape) for face, cells, shape in zip(pile_meta.CUBE_FACES, faces, shapes)}
+        elif pileType == 'icosahedronsurface':
+            return {'raw': flatSandbox.reshape((2 * (xMax + 1), 5 * yMax))}
+        return {'pile': flatSandbox.reshape((xMax, yMax))}
+
+    def pile_cells(self, arrays):
+        # Flat pile from the named arrays of pile_arrays
+        flatSandbox = np.concatenate([np.asarray(arrays[name], dtype=np.int64).reshape(-1) for name in pile_meta.pile_names(self.geometry['pileType'])])
+        if flatSandbox.shape[0] != self.numCells:
+            raise ValueError(f'Pile has {flatSandbox.shape[0]} cells, the {self.geometry["pileType"]} group has {self.numCells}')
+        return flatSandbox
+
+@lru_cache(maxsize=8)
+def group_identity(geometryJSON, engine, symmetry, directory):
+    # (zero, identity, seconds, domain cells, loaded from disk) of a geometry, read from or written to its archive in directory
+    geometry = json.loads(geometryJSON)
+    path = os.path.join(directory, f'{group_key(geometry)}{pile_archive.ARCHIVE_SUFFIX}')
+    if os.path.exists(path):
+        with pile_archive.PileArchive(path) as archive:
+            zero = np.array(archive.array('zero'), dtype=np.int64)
+            identity = np.array(archive.array('identity'), dtype=np.int64)
+            header = archive.header
+        cached = True
+        seconds = header['seconds']
+        domainCells = header['domainCells']
+    else:
+        group = SandpileGroup(geometry['pileType'], geometry['xMax'], geometry['yMax'], geometry['zMax'], geometry['numRows'], geometry['topple'],
+                              geometry['sink'], engine=engine, symmetry=symmetry, directory=directory)
+        start = perf_counter()
+        zero, identity, domainCells = group.compute_zero_and_identity()
+        seconds = perf_counter() - start
+        cached = False
+        metadata = pile_meta.pile_metadata(geometry['pileType'], geometry['xMax'], geometry['yMax'], geometry['zMax'], geometry['numRows'], geometry['topple'],
+                                           int(identity.sum()), 0, 'uniform', None, None)
+        arrays = group.pile_arrays(identity)
+        arrays.update({'identity': identity, 'zero': zero})
+        os.makedirs(directory, exist_ok=True)
+        pile_archive.write_archive(path, arrays, {'metadata': metadata, 'group': geometry, 'engine': engine, 'seconds': seconds, 'domainCells': int(domainCells)})
+    zero.flags.writeable = False
+    identity.flags.writeable = False
+    return (zero, identity, seconds, int(domainCells), cached)
+
+'''
+#####################
+Group Axiom Checks
+#####################
+'''
+
+def timed(function, *args):
+    start = perf_counter()
+    result = function(*args)
+    return (result, perf_counter() - start)
+
+def check_axioms(group, samples=DEFAULT_SAMPLES, seed=0):
+    '''
+    Checks the group axioms on the identity and random recurrent piles a, b, c.
+    Returns ({check: passed}, {check: seconds}).
+    '''
+    rng = np.random.default_rng(seed)
+    identity = group.identity()
+    checks = {'identity': True, 'commutative': True, 'associative': True, 'inverse': True}
+    seconds = dict.fromkeys(checks, 0.0)
+    twice, seconds['identity'] = timed(group.add, identity, identity)
+    checks['identity'] = bool(np.array_equal(twice, identity)) and bool(np.all(identity[group.sink] == 0))
+    for _ in range(samples):
+        a, b, c = [group.random_recurrent(rng) for _ in range(3)]
+        withIdentity, elapsed = timed(group.add, a, identity)
+        checks['identity'] &= bool(np.array_equal(withIdentity, a))
+        seconds['identity'] += elapsed
+        (ab, ba), elapsed = timed(lambda: (group.add(a, b), group.add(b, a)))
+        checks['commutative'] &= bool(np.array_equal(ab, ba))
+        seconds['commutative'] += elapsed
+        (left, right), elapsed = timed(lambda: (group.add(ab, c), group.add(a, group.add(b, c))))
+        checks['associative'] &= bool(np.array_equal(left, right))
+        seconds['associative'] += elapsed
+        inverse, elapsed = timed(lambda: group.add(a, group.inverse(a)))
+        checks['inverse'] &= bool(np.array_equal(inverse, identity))
+        seconds['inverse'] += elapsed
+    return (checks, seconds)
+
+def load_pile(path):
+    # (metadata, named arrays) of a saved pile: a .spile archive or a saved_piles/*_meta.json file
+    if path.endswith(pile_archive.ARCHIVE_SUFFIX):
+        with pile_archive.PileArchive(path) as archive:
+            metadata = archive.header['metadata']
+            return (metadata, {name: archive.array(name) for name in pile_meta.pile_names(metadata['pileType'])})
+    metadata = pile_meta.load_pile_metadata(path)
+    directory = os.path.dirname(path)
+    files = metadata.get('files') or []
+    if len(files) == 0:
+        raise ValueError(f'{path} lists no saved pile files')
+    if files[0].endswith(pile_archive.ARCHIVE_SUFFIX):
+        return load_pile(os.path.join(directory, files[0]))
+    return (metadata, {name: np.load(os.path.join(directory, fileName)) for name, fileName in zip(pile_meta.pile_names(metadata['pileType']), files)})
+
+def main():
+    parser = argparse.ArgumentParser(description='Identity of the sandpile group of a pile geometry, with checks of the group axioms')
+    parser.add_argument('--type', type=str, default='square', choices=GROUP_TYPES, help='Pile type')
+    parser.add_argument('--size', type=int, nargs='+', default=[128, 128], metavar='SIZE', help='xMax yMax (and zMax for cubesurface) of the pile')
+    parser.add_argument('--rows', type=int, default=8, help='numRows of an icosahedronsurface pile')
+    parser.add_argument('--topple', type=str, default='von_neumann', help='Neighborhood name of grid types')
+    parser.add_argument('--sink', type=int, nargs='+', default=None, metavar='CELL', help='Flat indices of sink cells (default: cell 0 of closed surfaces, none otherwise)')
+    parser.add_argument('--engine', type=str, default='presolve', choices=['presolve', 'worklist'], help='Graph engine of the stabilizations')
+    parser.add_argument('--symmetry', type=str, default='auto', help='Symmetry generators the identity is computed on the fundamental domain of (none for the full grid)')
+    parser.add_argument('--samples', type=int, default=DEFAULT_SAMPLES, help='Random recurrent piles to check the axioms on (0 to skip the checks)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random recurrent piles')
+    parser.add_argument('--add', type=str, nargs=2, default=None, metavar=('PILE', 'PILE'), help='Add two saved piles (.spile or _meta.json) of one geometry instead')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Path to save the identity (or sum) to as a pile archive')
+    parser.add_argument('--render', type=str, default=None, metavar='FILENOM', help='Draw the identity (or sum) to FILENOM.png')
+    parser.add_argument('--directory', type=str, default=DEFAULT_IDENTITY_DIR, help='Identity cache directory')
+    args = parser.parse_args()
+
+    if args.add is not None:
+        metadata, arrays = load_pile(args.add[0])
+        otherMetadata, otherArrays = load_pile(args.add[1])
+        mismatched = [field for field in ['pileType', 'xMax', 'yMax', 'zMax', 'numRows', 'topple'] if metadata.get(field) != otherMetadata.get(field)]
+        if len(mismatched) > 0:
+            raise ValueError(f'Piles are of different geometries ({", ".join(mismatched)})')
+        pileType = metadata['pileType']
+        xMax, yMax, zMax, numRows = metadata['xMax'], metadata['yMax'], metadata.get('zMax'), metadata.get('numRows')
+        topple = metadata['topple']
+    else:
+        pileType = args.type
+        xMax = args.size[0]
+        yMax = args.size[1] if len(args.size) > 1 else xMax
+        zMax = args.size[2] if len(args.size) > 2 else xMax
+        numRows = args.rows
+        if pileType == 'icosahedronsurface':
+            xMax, yMax = 1 + (2 * (numRows - 1)), numRows
+        topple = args.topple
+    group = SandpileGroup(pileType, xMax, yMax, zMax, numRows, topple, args.sink, engine=args.engine, symmetry=args.symmetry, directory=args.directory)
+
+    start = perf_counter()
+    identity = group.identity()
+    source = f'read from {args.directory}/ in {perf_counter() - start:.3f} sec (computed' if group.cached else 'computed'
+    print(f"Identity of the {pileType} {xMax}x{yMax} group ({group.numCells} cells, {len(group.sink)} sink cell(s)) {source} in {group.identitySeconds:.3f} sec on {group.domainCells} domain cells{')' if group.cached else ''}, {int(identity.sum())} grains.")
+    result = identity
+
+    if args.add is not None:
+        a = group.pile_cells(arrays)
+        b = group.pile_cells(otherArrays)
+        result, seconds = timed(group.add, a, b)
+        recurrent = [group.is_recurrent(pile) for pile in [a, b, result]]
+        print(f'Sum of {args.add[0]} and {args.add[1]} in {seconds:.3f} sec, recurrent: {recurrent[0]}, {recurrent[1]}, sum {recurrent[2]}.')
+    elif args.samples > 0:
+        checks, seconds = check_axioms(group, args.samples, args.seed)
+        print(f'Group axioms on {args.samples} random recurrent pile(s): ' + ', '.join(f"{check} {'ok' if passed else 'FAILED'} ({seconds[check]:.3f} sec)" for check, passed in checks.items()) + '.')
+        if not all(checks.values()):
+            raise SystemExit(1)
+
+    arrays = group.pile_arrays(result)
+    if args.output is not None:
+        metadata = pile_meta.pile_metadata(pileType, xMax, yMax, zMax, numRows, group.geometry['topple'], int(result.sum()), 0, 'uniform', None, None)
+        pile_archive.write_archive(args.output, arrays, {'metadata': metadata, 'group': group.geometry})
+        print(f'Saved to {args.output}.')
+    if args.render is not None:
+        import sandpile_sweep
+        sandpile_sweep.render_pile(pileType, {'xMax': xMax, 'yMax': yMax}, arrays, {}, args.render)
+        print(f'Drawn to {args.render}.png.')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+from functools import lru_cache
+import numpy as np
+
+'''
+Index maps for unfolding surface piles into flat arrays.
+
+Each layout is an int64 array with the shape of the unfolded array holding,
+for every cell, the flat index of the source cell it shows (-1 for cells
+outside the unfolding). A map is built once per geometry (and cached for
+later piles of the same size), so unfolding a pile is a single gather with
+no Python loop over its cells. Maps are read only, gather() returns new
+arrays.
+'''
+
+def gather(indexMap, source):
+    # Unfolded values (0 outside the unfolding) and the bound (1 inside), both int64
+    inside = indexMap >= 0
+    values = np.where(inside, source.reshape(-1)[np.maximum(indexMap, 0)], 0).astype(np.int64)
+    return (values, inside.astype(np.int64))
+
+def read_only(indexMap):
+    indexMap.setflags(write=False)
+    return indexMap
+
+#######################
+#  Cube Surface Flat  #
+#######################
+
+'''
+Cube Unfolding (cross):
+
+The left, front, right and back faces side by side in the middle band, top
+above and bottom below the front face. Sources are the faces flattened and
+concatenated in the order (left, front, right, back, top, bottom).
+'''
+
+@lru_cache(maxsize=8)
+def cube_unfolding(xMax, yMax, zMax):
+    arrW = (2 * xMax) + (2 * zMax)
+    arrH = (2 * zMax) + yMax
+    indexMap = np.full((arrW, arrH), -1, dtype=np.int64)
+
+    # (x offset, y offset, width, height) of each face in source order
+    faces = [(0, zMax, zMax, yMax), (zMax, zMax, xMax, yMax), (zMax + xMax, zMax, zMax, yMax), ((2 * zMax) + xMax, zMax, xMax, yMax),
+             (zMax, 0, xMax, zMax), (zMax, zMax + yMax, xMax, zMax)]
+    start = 0
+    for xOffset, yOffset, width, height in faces:
+        indexMap[xOffset:xOffset+width, yOffset:yOffset+height] = start + np.arange(width * height).reshape((width, height))
+        start += width * height
+    return read_only(indexMap)
+
+def unfold_cube(sandbox_front, sandbox_back, sandbox_left, sandbox_right, sandbox_top, sandbox_bottom):
+    # Returns (flatCube, flatCubeBound)
+    xMax, yMax = [int(size) for size in sandbox_front.shape]
+    zMax = int(sandbox_left.shape[0])
+    source = np.concatenate([face.reshape(-1) for face in [sandbox_left, sandbox_front, sandbox_right, sandbox_back, sandbox_top, sandbox_bottom]])
+    return gather(cube_unfolding(xMax, yMax, zMax), source)
+
+#########################
+#  Icosahedron Layouts  #
+#########################
+
+'''
+Icosahedron Strips:
+
+The raw icosahedron array is 5 strips of yMax rows (one per pair of face
+rows), 2 * (xMax + 1) cells wide. The flat layout shears each strip into a
+parallelogram of hex lattice triangles, the rotated layout turns the strips
+to run top to bottom. Sources are the raw array flattened.
+'''
+
+@lru_cache(maxsize=8)
+def icosahedron_strips(xMax, yMax):
+    # Returns (stripMap, rotatedMap)
+    arrXMax = 2 * (xMax + 1)
+    arrW = arrXMax + (5 * yMax) + 1
+    arrH = 5 * yMax
+    arrWRot = 5 * xMax + int(xMax / 2) + 9
+    arrHRot = 3 * yMax
+
+    x, strip, y = np.meshgrid(np.arange(arrXMax), np.arange(5), np.arange(yMax), indexing='ij')
+    source = (x * arrH) + y + (strip * yMax)
+
+    stripMap = np.full((arrW, arrH), -1, dtype=np.int64)
+    stripMap[x + ((yMax - 1) - y) + (strip * yMax) + 1, y + (strip * yMax)] = source
+    rotatedMap = np.full((arrWRot, arrHRot), -1, dtype=np.int64)
+    rotatedMap[(arrWRot - 3) - (x // 2) - y - (strip * (xMax + 1)), ((yMax - 1) - y) + ((x + 1) // 2)] = source
+    return (read_only(stripMap), read_only(rotatedMap))
+
+def unfold_icosahedron(sandboxRaw, xMax, yMax):
+    # Returns (stripSandpile, stripSandpileBound, stripSandpile_rot, stripSandpileBound_rot)
+    stripMap, rotatedMap = icosahedron_strips(xMax, yMax)
+    return gather(stripMap, sandboxRaw) + gather(rotatedMap, sandboxRaw)
+
+'''
+Icosahedron Faces:
+
+The 20 triangular faces cut out of the raw array, each as an (xMax, yMax)
+array: odd faces point down (row y spans x = y .. xMax - 1 - y), even faces
+point up (row y spans xMax // 2 - y .. xMax // 2 + y). Faces 4 * r .. 4 * r + 3
+come from strip r.
+'''
+
+@lru_cache(maxsize=8)
+def icosahedron_faces(xMax, yMax):
+    arrY = 5 * yMax
+    indexMap = np.full((20, xMax, yMax), -1, dtype=np.int64)
+    x, y = np.meshgrid(np.arange(xMax), np.arange(yMax), indexing='ij')
+    for side in range(20):
+        yOffset = int(side / 4) * yMax
+        col = side % 4
+        if side % 2 == 1: # odd
+            xOffset = 1 + (int(col / 3) * (xMax + 1))
+            inFace = (x >= y) & (x < xMax - y)
+            sourceX = x + y + xOffset
+        else:
+            xOffset = int(col / 2) * (xMax + 1)
+            inFace = (x >= int(xMax / 2) - y) & (x <= int(xMax / 2) + y)
+            sourceX = x - int(xMax / 2) + y + xOffset
+        indexMap[side][inFace] = (sourceX[inFace] * arrY) + y[inFace] + yOffset
+    return read_only(indexMap)
+
+def extract_icosahedron_faces(sandbox, xMax, yMax):
+    # Returns (pileArray, boundArray), lists of the 20 face arrays
+    faces, bounds = gather(icosahedron_faces(xMax, yMax), sandbox)
+    return (list(faces), list(bounds))
@@ -1,8 +1,15 @@
 import sandpile_calculations as sp
-import draw_sandpile as draw_sp
+import pile_metadata as pile_meta
+import pile_cache
+import pile_checkpoint
+import sandpile_layouts as layouts
+import export_pipeline
+import pile_archive
+import wave_metrics
 
 import argparse
 import json
+import os
 from time import time
 
 import numpy as np
@@ -12,35 +19,129 @@ def load_JSON(jsonToLoad):
         jsonData = json.load(jsonFile)
     return jsonData
 
-def main():
-    # Set command-line arguments
-    parser = argparse.ArgumentParser()
-    parser.add_argument('config', type=str, help='Path to Abelian Sandpile JSON generator')
-    parser.add_argument('-d', '--drawoutput', action='store_true', help='If flag present, open tkinter window and draw image')
-    args = parser.parse_args()
+METRICS_ENGINES = ['scan', 'worklist'] # Engines calling the metrics callback after every wave
 
-    # Read in argument values
-    config = args.config
-    drawOutput = args.drawoutput
+def check_metrics_engine(type, engine):
+    # Plane piles always topple on the scan kernel
+    if type != 'plane' and engine not in METRICS_ENGINES:
+        raise ValueError(f'Wave metrics need the scan or worklist engine, the {engine} engine has no per-wave callback')
 
-    # Load sandpile generation details from JSON file
-    spData = load_JSON(config)
-    filenom = str(spData.get('filenom') or 'AbelianSandpile')
-    title = str(spData.get('title') or 'Abelian Sandpile')
-    type = str(spData.get('pileType') or 'square')
-    drawBounded = spData.get('drawBounded') # Returns python True, False if json boolean. If not present returns None.
+def calculate_pile(type, xMax, yMax, zMax, numRows, grains, topple, dropSpots, seed=0, seedType='uniform', seedAttr=None, engine='scan', threads=0, multiscale=False, stats=None, basePile=None, baseGrains=0, progress=None, progressWaves=sp.PROGRESS_WAVES, metrics=None, symmetry='none', checkpoint=None):
+    pileTuple = None
+    if checkpoint is not None and type != 'square':
+        raise ValueError('Checkpoints are only kept for square piles')
+    if metrics is not None:
+        check_metrics_engine(type, engine)
+    if type == 'square':
+        pileTuple = sp.calculate_sandpile_grid_seeded(xMax, yMax, grains, topple, dropSpots, seed=seed, seedType=seedType, seedAttr=seedAttr, engine=engine, threads=threads, multiscale=multiscale, stats=stats, basePile=basePile, baseGrains=baseGrains, progress=progress, progressWaves=progressWaves, metrics=metrics, symmetry=symmetry, checkpoint=checkpoint)
+    elif type == 'plane':
+        pileTuple = sp.calculate_sandpile_plane_seeded(xMax, yMax, grains, topple, dropSpots, seed=seed, seedType=seedType, seedAttr=seedAttr, metrics=metrics)
+    elif type == 'cylinder' or type == 'squarewrap':
+        pileTuple = sp.calculate_sandpile_wraparound_seeded(xMax, yMax, grains, topple, dropSpots, seed=seed, seedType=seedType, seedAttr=seedAttr, shape=type, engine=engine, threads=threads, multiscale=multiscale, stats=stats, basePile=basePile, baseGrains=baseGrains, progress=progress, progressWaves=progressWaves, metrics=metrics, symmetry=symmetry)
+    elif type == 'cubesurface':
+        pileTuple = sp.calculate_sandpile_cubesurface_seeded(xMax, yMax, zMax, grains, topple, dropSpots, seed=seed, seedType=seedType, seedAttr=seedAttr, engine=engine, threads=threads, multiscale=multiscale, stats=stats, basePile=basePile, baseGrains=baseGrains, metrics=metrics)
+    elif type == 'icosahedronsurface':
+        pileTuple = sp.calculate_sandpile_icosahedronsurface_seeded(xMax, yMax, numRows, grains, topple, dropSpots, seed=seed, seedType=seedType, seedAttr=seedAttr, engine=engine, threads=threads, multiscale=multiscale, stats=stats, basePile=basePile, baseGrains=baseGrains, metrics=metrics)
+    if pileTuple is None:
+        raise ValueError(f'No {engine} kernel for {type} piles with this neighborhood')
+    return pileTuple
+
+def pile_arrays(pileTuple):
+    # Every array in a pile tuple (skips the topple counter)
+    arrays = []
+    for item in pileTuple:
+        if isinstance(item, np.ndarray):
+            arrays.append(item)
+        elif isinstance(item, (list, tuple)):
+            arrays.extend(pile_arrays(item))
+    return arrays
+
+def pile_topples(pileTuple):
+    # Topple counter of a pile tuple (cube surface tuples hold it after the three face arrays)
+    if len(pileTuple) == 4 and not isinstance(pileTuple[3], np.ndarray):
+        return pileTuple[3]
+    return pileTuple[1]
+
+def report_multiscale_savings(calculate, pileTuple, multiscaleTime):
+    '''
+    Recalculates the pile with the direct method, checks the multiscale pile is
+    identical and prints the topples and time saved.
+    '''
+    start = time()
+    directTuple = calculate(False)
+    directTime = time() - start
+    samePile = all(np.array_equal(a, b) for a, b in zip(pile_arrays(pileTuple), pile_arrays(directTuple)))
+    directTopples = pile_topples(directTuple)
+    multiscaleTopples = pile_topples(pileTuple)
+    print(f'Direct: {directTime:.3f} sec, {directTopples} topples. Multiscale: {multiscaleTime:.3f} sec, {multiscaleTopples} topples.')
+    print(f'Topples saved: {directTopples - multiscaleTopples}, Speedup: {directTime / multiscaleTime:.2f}x, Same pile: {samePile}')
+
+def report_thread_scaling(calculate, maxThreads):
+    '''
+    Times calculate(threads) for 1 to maxThreads threads, checks every run
+    gives the same stable pile as the 1 thread run, and prints the speedup.
+    '''
+    print('Threads | Calculation time (sec) | Speedup | Topples | Same pile')
+    baseTime = None
+    basePile = None
+    for threads in range(1, maxThreads + 1):
+        start = time()
+        pileTuple = calculate(threads)
+        calc_time = time() - start
+        arrays = pile_arrays(pileTuple)
+        if baseTime is None:
+            baseTime = calc_time
+            basePile = arrays
+        samePile = all(np.array_equal(a, b) for a, b in zip(arrays, basePile))
+        toppleCtr = pile_topples(pileTuple)
+        print(f'{threads:7} | {calc_time:22.3f} | {baseTime / calc_time:6.2f}x | {toppleCtr} | {samePile}')
+
+def report_svg_writers(svgArgs, svgKwargs):
+    '''
+    Writes the same SVG with the svgwrite writer and the compact streaming
+    writer (to {filenom}_svgwrite.svg and {filenom}.svg) and prints the file
+    size and write time of each.
+    '''
+    import draw_sandpile as draw_sp
+    filenom = svgKwargs['filenom']
+    results = []
+    for writer, suffix in [(draw_sp.SandpileSvg, '_svgwrite'), (draw_sp.SandpileSvgCompact, '')]:
+        start = time()
+        sandpileSvg = writer(*svgArgs, **dict(svgKwargs, filenom=filenom + suffix))
+        sandpileSvg.draw_sandbox()
+        results.append((writer.__name__, time() - start, os.path.getsize(sandpileSvg.imgFilenom)))
+    print('SVG writer | Write time (sec) | Size (MB)')
+    for name, writeTime, fileSize in results:
+        print(f'{name:18} | {writeTime:16.3f} | {fileSize / (1024 * 1024):9.2f}')
+    print(f'Compact writer: {results[0][1] / results[1][1]:.2f}x faster, {results[0][2] / results[1][2]:.2f}x smaller.')
+
+def save_pile_arrays(exporter, filenom, arrays, metadata, header, archive=True, compress=True, packBits=True):
+    '''
+    Writes a run's pile arrays ({name: array}, see pile_metadata.npy_file) as
+    one saved_piles/{filenom}.spile archive with the header, or as .npy files,
+    and the pile metadata next to them.
+    '''
+    if archive:
+        exporter.submit(pile_archive.write_archive, pile_archive.archive_path(filenom), arrays, header, compress=compress, packBits=packBits)
+    else:
+        for name, array in arrays.items():
+            exporter.save(f'saved_piles/{pile_meta.npy_file(filenom, name)}', array)
+    pile_meta.save_pile_metadata(filenom, metadata, archive=archive)
+
+def pile_params(spData):
+    '''
+    Reads the physics fields of a pile config (geometry, neighborhood, grains,
+    seed and drop spots) into a dict of calculate_pile keyword arguments.
+    '''
+    type = str(spData.get('pileType') or 'square') # (square, plane, cylinder, squarewrap, cubesurface, icosahedronsurface)
     xMax = int(spData.get('xMax') or 101)
     yMax = int(spData.get('yMax') or 101)
     zMax = int(spData.get('zMax') or xMax)
     grains = int(spData.get('grains') or 0)
-    topple = spData.get('topple') or 'von_neumann'
+    topple = spData.get('topple') or 'von_neumann' # Neighborhood name, or a list of [dx, dy] offsets (threshold is the number of offsets)
     seed = int(spData.get('initialSeed') or 0)
     seedType = str(spData.get('seedType') or 'uniform')
     seedAttrRaw = spData.get('seedAttributes') or None
-    imgPxWidth = int(spData.get('imagePixelWidth') or 1)
-    tkPxWidth = int(spData.get('tkinterPixelWidth') or 1)
-    colors = spData.get('colors') or None
-    bgColor = spData.get('backgroundColor') or None
 
     # Icosahedron Surface Params (for now only 1 topple called 'default' since not technically von_neumann)
     # Triangle size is numRows tall, 1 + 2 * (numRows - 1) wide
@@ -49,12 +150,6 @@ def main():
         xMax = 1 + (2 * (numRows - 1))
         yMax = numRows
 
-    # Parse border parameters
-    borderData = spData.get('border') or {}
-    bWidth = borderData.get('width') or 0
-    bColor = borderData.get('color') or '#000000'
-    bStyle = borderData.get('style') or 'all'
-
     # Find additional drop-spots (if specified)
     dropSpots = None
     dropSpotsRaw = spData.get('dropSpots') or []
@@ -66,9 +161,7 @@ def main():
         mult = rawDrop.get('mult') or (1.0 / len(dropSpotsRaw))
         face = rawDrop.get('face') or "top" # For icosahedron this will be a number 1-20
         dropSpots.append((x, y, mult, face))
-    drawDropSpots = spData.get('drawDropSpots') # Returns python True, False if json boolean. If not present returns None.
-    dropSpotColor = spData.get('dropSpotColor') or '#06d6a0' # [#d8315b, #dd2d4a, #ff006e, #f72585, #ef476f, #f15bb5, #ff70a6, #f49cbb]
-    
+
     dropType = spData.get('dropType') or 'point' # (point, line_x, line_y, cross_xy)
     dropParam = spData.get('dropParam') or {}
     dropSpotsOn = dropParam.get('dropSpotsOn') or 1
@@ -96,23 +189,169 @@ def main():
     seedAttr = None
     if seedType == 'checker':
         seedAttr = (int(seedAttrRaw['seed1']), int(seedAttrRaw['seed2']))
+    return {'type': type, 'xMax': xMax, 'yMax': yMax, 'zMax': zMax, 'numRows': numRows, 'grains': grains, 'topple': topple, 'dropSpots': dropSpots,
+            'seed': seed, 'seedType': seedType, 'seedAttr': seedAttr}
+
+def main():
+    # Drawing is only imported by the runs drawing piles (sweep workers import this module without it)
+    import draw_sandpile as draw_sp
+
+    # Set command-line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config', type=str, help='Path to Abelian Sandpile JSON generator')
+    parser.add_argument('-d', '--drawoutput', action='store_true', help='If flag present, open tkinter window and draw image')
+    parser.add_argument('-t', '--threads', type=int, default=None, help='Threads for the parallel engine (overrides the config, 0 uses every core)')
+    parser.add_argument('--compare-direct', action='store_true', help='If flag present with multiscale on, also run the direct method and report the topples saved')
+    parser.add_argument('--incremental', type=str, default=None, help='Path to a saved pile metadata file (saved_piles/*_meta.json) or pile archive (saved_piles/*.spile) to add this config\'s extra grains to instead of toppling from zero')
+    parser.add_argument('--no-cache', action='store_true', help='If flag present, always recalculate the pile instead of using the pile cache')
+    parser.add_argument('--compare-svg', action='store_true', help='If flag present, also write the SVG with the svgwrite writer and report size and time against the compact writer')
+    parser.add_argument('-w', '--export-workers', type=int, default=None, help='Processes writing the saved piles and images (overrides the config, 0 uses every core, 1 writes them in order)')
+    parser.add_argument('--live', action='store_true', help='If flag present, open the tkinter window before toppling and redraw it every liveWaves waves (square and cylinder piles, scan and worklist engines)')
+    parser.add_argument('--metrics', type=str, default=None, help='Path of a JSONL file for per-wave toppling metrics (overrides the config, every pile type on the scan or worklist engine)')
+    parser.add_argument('--checkpoint', type=str, default=None, help='Directory of the memory mapped pile and its checkpoints (overrides the config, square piles, scan and worklist engines)')
+    parser.add_argument('--resume', action='store_true', help='If flag present, continue from the last checkpoint in the checkpoint directory')
+    parser.add_argument('--scaling', action='store_true', help='If flag present, time the parallel engine from 1 to --threads threads and exit')
+    args = parser.parse_args()
+
+    # Read in argument values
+    config = args.config
+    drawOutput = args.drawoutput or args.live
+
+    # Load sandpile generation details from JSON file
+    spData = load_JSON(config)
+    filenom = str(spData.get('filenom') or 'AbelianSandpile')
+    title = str(spData.get('title') or 'Abelian Sandpile')
+    drawBounded = spData.get('drawBounded') # Returns python True, False if json boolean. If not present returns None.
+    imgPxWidth = int(spData.get('imagePixelWidth') or 1)
+    tkPxWidth = int(spData.get('tkinterPixelWidth') or 1)
+    colors = spData.get('colors') or None
+    bgColor = spData.get('backgroundColor') or None
+    engine = str(spData.get('engine') or 'scan') # (scan, worklist, vectorized, parallel, presolve)
+    threads = int(spData.get('threads') or 0)
+    useCache = spData.get('cache') != False and not args.no_cache # Reuse piles with the same physics config from the pile cache
+    cacheDir = str(spData.get('cacheDir') or pile_cache.DEFAULT_CACHE_DIR)
+    cacheSizeMB = float(spData.get('cacheSizeMB') or pile_cache.DEFAULT_CACHE_SIZE_MB)
+    multiscale = spData.get('multiscale') == True # Stabilize by grain doubling (same stable pile, fewer topples for big drops)
+    saveSvg = spData.get('svg') == True or args.compare_svg # Also save the image as a compact SVG (square and cylinder piles)
+    liveWaves = int(spData.get('liveWaves') or sp.PROGRESS_WAVES) # Waves between redraws of the live tkinter preview
+    exportWorkers = int(spData.get('exportWorkers') or 0) # Processes writing the saved piles and images (0 uses every core)
+    metricsFile = spData.get('metricsFile') or None # JSONL file of per-wave toppling metrics (scan and worklist engines)
+    metricsWaves = int(spData.get('metricsWaves') or 1) # Waves summed into each line of the metrics file
+    saveArchive = spData.get('archive') != False # Save the pile arrays in one bit-packed .spile archive instead of .npy files
+    archiveCompress = spData.get('archiveCompress') != False # zlib compress the archive chunks
+    archivePackBits = spData.get('archivePackBits') != False # Pack 1, 2 and 4 bit values several to a byte (false with archiveCompress false: the arrays load as memory mapped views)
+    checkpointDir = spData.get('checkpointDir') or None # Directory of the memory mapped pile and its checkpoints (square piles, scan and worklist engines)
+    checkpointWaves = int(spData.get('checkpointWaves') or 0) # Waves between checkpoints (0 checkpoints by time only)
+    checkpointSeconds = float(spData.get('checkpointSeconds') or pile_checkpoint.CHECKPOINT_SECONDS) # Seconds between checkpoints
+    symmetry = str(spData.get('symmetry') or 'none') # Topple one fundamental domain of symmetric square and wrap-around piles (none, auto, D2, D4, translation)
+    if args.threads is not None:
+        threads = args.threads
+    if args.export_workers is not None:
+        exportWorkers = args.export_workers
+    if args.metrics is not None:
+        metricsFile = args.metrics
+    if args.checkpoint is not None:
+        checkpointDir = args.checkpoint
+    if args.resume and checkpointDir is None:
+        raise ValueError('--resume needs a checkpoint directory (--checkpoint or checkpointDir)')
+    if useCache and (metricsFile is not None or checkpointDir is not None or args.live):
+        # A cache hit skips toppling, which writes the metrics and checkpoints and redraws the live window
+        useCache = False
+        print('Pile cache skipped: wave metrics, checkpoints and the live preview need the pile toppled.')
+
+    # Physics fields of the pile (geometry, neighborhood, grains, seed, drop spots)
+    pileParams = pile_params(spData)
+    type, xMax, yMax, zMax, numRows = [pileParams[key] for key in ['type', 'xMax', 'yMax', 'zMax', 'numRows']]
+    if metricsFile is not None:
+        check_metrics_engine(type, engine)
+    grains, topple, dropSpots = [pileParams[key] for key in ['grains', 'topple', 'dropSpots']]
+    seed, seedType, seedAttr = [pileParams[key] for key in ['seed', 'seedType', 'seedAttr']]
+
+    # Parse border parameters
+    borderData = spData.get('border') or {}
+    bWidth = borderData.get('width') or 0
+    bColor = borderData.get('color') or '#000000'
+    bStyle = borderData.get('style') or 'all'
+
+    drawDropSpots = spData.get('drawDropSpots') # Returns python True, False if json boolean. If not present returns None.
+    dropSpotColor = spData.get('dropSpotColor') or '#06d6a0' # [#d8315b, #dd2d4a, #ff006e, #f72585, #ef476f, #f15bb5, #ff70a6, #f49cbb]
+
+    metadata = pile_meta.pile_metadata(type, xMax, yMax, zMax, numRows, topple, grains, seed, seedType, seedAttr, dropSpots)
+
+    # Start from a saved stable pile of the same setup with fewer grains
+    basePile = None
+    baseGrains = 0
+    baseBound = None
+    if args.incremental != None:
+        basePile, baseGrains, baseBound = pile_meta.load_base_pile(args.incremental, metadata)
+        print(f'Incremental from {args.incremental} ({baseGrains} grains), adding {grains - baseGrains} grains.')
+    if type == 'plane' and basePile is not None:
+        raise ValueError('Plane piles grow to fit their grains, they can not start from a saved pile')
+
+    # Time the parallel engine over 1..N threads instead of drawing the pile
+    if args.scaling == True:
+        maxThreads = threads if threads > 0 else (os.cpu_count() or 1)
+        report_thread_scaling(lambda t: calculate_pile(type, xMax, yMax, zMax, numRows, grains, topple, dropSpots, seed=seed, seedType=seedType, seedAttr=seedAttr, engine='parallel', threads=t), maxThreads)
+        return
+
+    # Open the tkinter window before toppling and redraw it from the pile as it topples
+    sandpileTk = None
+    progress = None
+    if args.live and type in ['square', 'cylinder', 'squarewrap']:
+        sandpileTk = draw_sp.SandpileTk(xMax, yMax, np.zeros((xMax, yMax), dtype=np.int64), title=title, sideLength=tkPxWidth, colors=colors, bgColor=bgColor, bColor=bColor, bWidth=bWidth, bStyle=bStyle)
+        sandpileTk.draw_sandbox()
+        progress = lambda pile, toppleCtr: sandpileTk.update_sandbox(pile, title=f'{title} ({toppleCtr} topples)')
 
     # Calculate the sandpile
     start = time()
-    pileTuple = None
     sink = None
-    if type == 'square':
-        pileTuple = sp.calculate_sandpile_grid_seeded(xMax, yMax, grains, topple, dropSpots, seed=seed, seedType=seedType, seedAttr=seedAttr)
-    elif type == 'cylinder' or type == 'squarewrap':
-        pileTuple = sp.calculate_sandpile_wraparound_seeded(xMax, yMax, grains, topple, dropSpots, seed=seed, seedType=seedType, seedAttr=seedAttr, shape=type)
-    elif type == 'cubesurface':
-        pileTuple = sp.calculate_sandpile_cubesurface_seeded(xMax, yMax, zMax, grains, topple, dropSpots, seed=seed, seedType=seedType, seedAttr=seedAttr)
-    elif type == 'icosahedronsurface':
-        pileTuple = sp.calculate_sandpile_icosahedronsurface_seeded(xMax, yMax, numRows, grains, topple, dropSpots, seed=seed, seedType=seedType, seedAttr=seedAttr)
+    stats = {}
+    pileTuple = None
+    cache = None
+    if useCache:
+        cache = pile_cache.PileCache(cacheDir, cacheSizeMB)
+        pileTuple = cache.get(metadata)
+    cacheHit = pileTuple is not None
+    if not cacheHit:
+        waveMetrics = None
+        if metricsFile is not None:
+            waveMetrics = wave_metrics.WaveMetrics(metricsFile, metricsWaves)
+        checkpoint = None
+        if checkpointDir is not None:
+            checkpoint = pile_checkpoint.PileCheckpoint(checkpointDir, (xMax, yMax), metadata, checkpointWaves, checkpointSeconds, resume=args.resume)
+            if checkpoint.resumed:
+                print(f'Resuming from the checkpoint in {checkpointDir} at wave {checkpoint.waves} ({checkpoint.topples} topples).')
+            elif args.resume:
+                print(f'No checkpoint in {checkpointDir}, starting from the seeded pile.')
+        pileTuple = calculate_pile(type, xMax, yMax, zMax, numRows, grains, topple, dropSpots, seed=seed, seedType=seedType, seedAttr=seedAttr, engine=engine, threads=threads, multiscale=multiscale, stats=stats, basePile=basePile, baseGrains=baseGrains, progress=progress, progressWaves=liveWaves, metrics=waveMetrics, symmetry=symmetry, checkpoint=checkpoint)
+        if checkpoint is not None:
+            print(f'Checkpoints: {checkpoint.saves} saved to {checkpointDir}.')
+        if waveMetrics is not None:
+            waveMetrics.close()
+            print(f'Wave metrics: {waveMetrics.waves} waves in {waveMetrics.lines} lines of {metricsFile}.')
+
+        # Cells the saved pile toppled or spread to are part of this pile's bound too
+        if baseBound is not None and len(pileTuple) == 3:
+            pileTuple = (pileTuple[0], pileTuple[1], pileTuple[2] | baseBound)
+        if cache is not None and basePile is None: # An incremental run's toppleCtr only counts the extra grains' topples
+            cache.put(metadata, pileTuple)
 
     end =  time()
     calc_time = end - start
+    if cache is not None:
+        print(f"{'Hit' if cacheHit else 'Miss'} for pile {pile_cache.pile_key(metadata)[:16]}. {cache.report()}")
+
+    if 'domainCells' in stats:
+        print(f"Symmetry reduced the pile from {stats['symmetryCells']} to {stats['domainCells']} cells ({stats['symmetryCells'] / stats['domainCells']:.1f}x).")
+    if engine == 'presolve' and 'presolveTime' in stats:
+        print(f"Pre-solve time = {stats['presolveTime']:.3f} sec ({stats['presolveFirings']} of {stats['totalFirings']} topples), Correction time = {stats['correctionTime']:.3f} sec ({stats['correctionTopples']} topples, {stats['unfireRounds']} unfire rounds).")
+
+    if multiscale and args.compare_direct and not cacheHit:
+        report_multiscale_savings(lambda ms: calculate_pile(type, xMax, yMax, zMax, numRows, grains, topple, dropSpots, seed=seed, seedType=seedType, seedAttr=seedAttr, engine=engine, threads=threads, multiscale=ms), pileTuple, calc_time)
 
+    # Saves and renders run as jobs on a process pool while the remaining ones are queued
+    exporter = export_pipeline.ExportPipeline(exportWorkers)
+    archiveHeader = {'metadata': metadata, 'config': spData, 'toppleCtr': int(pile_topples(pileTuple)), 'calcTime': calc_time}
     if type == 'cubesurface':
         toppleCtr = pileTuple[3]
         print(f'Calculation time = {calc_time} sec, Topples: {toppleCtr}.')
@@ -124,19 +363,12 @@ def main():
         sandbox_top = pileTuple[2][0]
         sandbox_bottom = pileTuple[2][1]
 
-        np.save(f'saved_piles/{filenom}_front.npy', sandbox_front)
-        np.save(f'saved_piles/{filenom}_back.npy', sandbox_back)
-        np.save(f'saved_piles/{filenom}_left.npy', sandbox_left)
-        np.save(f'saved_piles/{filenom}_right.npy', sandbox_right)
-        np.save(f'saved_piles/{filenom}_top.npy', sandbox_top)
-        np.save(f'saved_piles/{filenom}_bottom.npy', sandbox_bottom)
+        # Copies, the drop spots may be drawn into the faces before the arrays are written
+        savedArrays = dict(zip(pile_meta.CUBE_FACES, [face.copy() for face in [sandbox_front, sandbox_back, sandbox_left, sandbox_right, sandbox_top, sandbox_bottom]]))
 
         arrW = (2 * xMax) + (2 * zMax)
         arrH = (2 * zMax) + yMax
 
-        flatCube = np.zeros((arrW, arrH), dtype = np.int64)
-        flatCubeBound = np.zeros((arrW, arrH), dtype = np.int64)
-
         numVertices = (2 * xMax * yMax) + (2 * xMax * zMax) + (2 * yMax * zMax)
         numEdges = (2 * (((xMax - 1) * yMax) + ((yMax - 1) * xMax))) + (4 * xMax)
         numEdges += (2 * (((xMax - 1) * zMax) + ((zMax - 1) * xMax))) + (4 * zMax)
@@ -164,33 +396,10 @@ def main():
                 elif face == 'bottom':
                     sandbox_bottom[dx][dy] = val
 
-        for x in range(zMax):
-            for y in range(yMax):
-                flatCube[x][y+zMax] = sandbox_left[x][y]
-                flatCubeBound[x][y+zMax] = 1
-        for x in range(xMax):
-            for y in range(yMax):
-                flatCube[x+zMax][y+zMax] = sandbox_front[x][y]
-                flatCubeBound[x+zMax][y+zMax] = 1
-        for x in range(zMax):
-            for y in range(yMax):
-                flatCube[x+zMax+xMax][y+zMax] = sandbox_right[x][y]
-                flatCubeBound[x+zMax+xMax][y+zMax] = 1
-        for x in range(xMax):
-            for y in range(yMax):
-                flatCube[x+(2*zMax)+xMax][y+zMax] = sandbox_back[x][y]
-                flatCubeBound[x+(2*zMax)+xMax][y+zMax] = 1
-        for x in range(xMax):
-            for y in range(zMax):
-                flatCube[x+zMax][y] = sandbox_top[x][y]
-                flatCubeBound[x+zMax][y] = 1
-        for x in range(xMax):
-            for y in range(zMax):
-                flatCube[x+zMax][y+zMax+yMax] = sandbox_bottom[x][y]
-                flatCubeBound[x+zMax][y+zMax+yMax] = 1
-
-        np.save(f'saved_piles/{filenom}_flatcube.npy', flatCube)
-        np.save(f'saved_piles/{filenom}_flatcube_bound.npy', flatCubeBound)
+        flatCube, flatCubeBound = layouts.unfold_cube(sandbox_front, sandbox_back, sandbox_left, sandbox_right, sandbox_top, sandbox_bottom)
+
+        savedArrays['flatcube'] = flatCube
+        savedArrays['flatcube_bound'] = flatCubeBound
 
         bound_front = None
         bound_back = None
@@ -206,27 +415,17 @@ def main():
             bound_top = pileTuple[6][0]
             bound_bottom = pileTuple[6][1]
 
-            np.save(f'saved_piles/{filenom}_front_bound.npy', bound_front)
-            np.save(f'saved_piles/{filenom}_back_bound.npy', bound_back)
-            np.save(f'saved_piles/{filenom}_left_bound.npy', bound_left)
-            np.save(f'saved_piles/{filenom}_right_bound.npy', bound_right)
-            np.save(f'saved_piles/{filenom}_top_bound.npy', bound_top)
-            np.save(f'saved_piles/{filenom}_bottom_bound.npy', bound_bottom)
-
-        sandpileImg = draw_sp.SandpileImg(xMax, yMax, sandbox_front, bound=bound_front, sink=None, filenom=f'images/{filenom}_front', sideLength=imgPxWidth, colors=colors, bgColor=bgColor, bColor=bColor, bWidth=bWidth, bStyle=bStyle)
-        sandpileImg.draw_sandbox()
-        sandpileImg = draw_sp.SandpileImg(xMax, yMax, sandbox_back, bound=bound_back, sink=None, filenom=f'images/{filenom}_back', sideLength=imgPxWidth, colors=colors, bgColor=bgColor, bColor=bColor, bWidth=bWidth, bStyle=bStyle)
-        sandpileImg.draw_sandbox()
-        sandpileImg = draw_sp.SandpileImg(zMax, yMax, sandbox_left, bound=bound_left, sink=None, filenom=f'images/{filenom}_left', sideLength=imgPxWidth, colors=colors, bgColor=bgColor, bColor=bColor, bWidth=bWidth, bStyle=bStyle)
-        sandpileImg.draw_sandbox()
-        sandpileImg = draw_sp.SandpileImg(zMax, yMax, sandbox_right, bound=bound_right, sink=None, filenom=f'images/{filenom}_right', sideLength=imgPxWidth, colors=colors, bgColor=bgColor, bColor=bColor, bWidth=bWidth, bStyle=bStyle)
-        sandpileImg.draw_sandbox()
-        sandpileImg = draw_sp.SandpileImg(xMax, zMax, sandbox_top, bound=bound_top, sink=None, filenom=f'images/{filenom}_top', sideLength=imgPxWidth, colors=colors, bgColor=bgColor, bColor=bColor, bWidth=bWidth, bStyle=bStyle)
-        sandpileImg.draw_sandbox()
-        sandpileImg = draw_sp.SandpileImg(xMax, zMax, sandbox_bottom, bound=bound_bottom, sink=None, filenom=f'images/{filenom}_bottom', sideLength=imgPxWidth, colors=colors, bgColor=bgColor, bColor=bColor, bWidth=bWidth, bStyle=bStyle)
-        sandpileImg.draw_sandbox()
-        sandpileImg = draw_sp.SandpileImg(arrW, arrH, flatCube, bound=flatCubeBound, sink=None, filenom=f'images/{filenom}_flat', sideLength=imgPxWidth, colors=colors, bgColor=bgColor, bColor=bColor, bWidth=bWidth, bStyle=bStyle)
-        sandpileImg.draw_sandbox()
+            for face, faceBound in zip(pile_meta.CUBE_FACES, [bound_front, bound_back, bound_left, bound_right, bound_top, bound_bottom]):
+                savedArrays[f'{face}_bound'] = faceBound
+        save_pile_arrays(exporter, filenom, savedArrays, metadata, archiveHeader, saveArchive, archiveCompress, archivePackBits)
+
+        exporter.render(draw_sp.SandpileImg, 'draw_sandbox', xMax, yMax, sandbox_front, bound=bound_front, sink=None, filenom=f'images/{filenom}_front', sideLength=imgPxWidth, colors=colors, bgColor=bgColor, bColor=bColor, bWidth=bWidth, bStyle=bStyle)
+        exporter.render(draw_sp.SandpileImg, 'draw_sandbox', xMax, yMax, sandbox_back, bound=bound_back, sink=None, filenom=f'images/{filenom}_back', sideLength=imgPxWidth, colors=colors, bgColor=bgColor, bColor=bColor, bWidth=bWidth, bStyle=bStyle)
+        exporter.render(draw_sp.SandpileImg, 'draw_sandbox', zMax, yMax, sandbox_left, bound=bound_left, sink=None, filenom=f'images/{filenom}_left', sideLength=imgPxWidth, colors=colors, bgColor=bgColor, bColor=bColor, bWidth=bWidth, bStyle=bStyle)
+        exporter.render(draw_sp.SandpileImg, 'draw_sandbox', zMax, yMax, sandbox_right, bound=bound_right, sink=None, filenom=f'images/{filenom}_right', sideLength=imgPxWidth, colors=colors, bgColor=bgColor, bColor=bColor, bWidth=bWidth, bStyle=bStyle)
+        exporter.render(draw_sp.SandpileImg, 'draw_sandbox', xMax, zMax, sandbox_top, bound=bound_top, sink=None, filenom=f'images/{filenom}_top', sideLength=imgPxWidth, colors=colors, bgColor=bgColor, bColor=bColor, bWidth=bWidth, bStyle=bStyle)
+        exporter.render(draw_sp.SandpileImg, 'draw_sandbox', xMax, zMax, sandbox_bottom, bound=bound_bottom, sink=None, filenom=f'images/{filenom}_bottom', sideLength=imgPxWidth, colors=colors, bgColor=bgColor, bColor=bColor, bWidth=bWidth, bStyle=bStyle)
+        exporter.render(draw_sp.SandpileImg, 'draw_sandbox', arrW, arrH, flatCube, bound=flatCubeBound, sink=None, filenom=f'images/{filenom}_flat', sideLength=imgPxWidth, colors=colors, bgColor=bgColor, bColor=bColor, bWidth=bWidth, bStyle=bStyle)
     elif type == 'icosahedronsurface':
         # Hex Lattice Draws Triangles'
         pileArr = pileTuple[0]
@@ -242,8 +441,7 @@ def main():
                 orientation = 'inverted'
             #np.save(f'saved_piles/{filenom}_{i:02}.npy', sandpile)
             #np.save(f'saved_piles/{filenom}_{i:02}_bound.npy', bound)
-            sandpileImg = draw_sp.SandpileImgExtended(xMax, yMax, sandpile, bound=bound, sink=None, filenom=f'images/{filenom}_{i:02}', sideLength=imgPxWidth, colors=colors, bgColor=bgColor, lattice='hex', orientation=orientation)
-            sandpileImg.draw_hex_sandbox()
+            exporter.render(draw_sp.SandpileImgExtended, 'draw_hex_sandbox', xMax, yMax, sandpile, bound=bound, sink=None, filenom=f'images/{filenom}_{i:02}', sideLength=imgPxWidth, colors=colors, bgColor=bgColor, lattice='hex', orientation=orientation)
 
         sandboxRaw = pileTuple[3]
         arrXMax = 2 * (xMax + 1)
@@ -253,60 +451,57 @@ def main():
         arrWRot = 5 * xMax + int(xMax / 2) + 9
         arrHRot = 3 * yMax
 
-        stripSandpile = np.zeros((arrW, arrH), dtype = np.int64)
-        stripSandpileBound = np.zeros((arrW, arrH), dtype = np.int64)
-        stripSandpile_rot = np.zeros((arrWRot, arrHRot), dtype = np.int64)
-        stripSandpileBound_rot = np.zeros((arrWRot, arrHRot), dtype = np.int64)
-
-        for strip in range(5):
-            yOffset = strip * yMax
-            for y in range(yMax):
-                xOffset = ((yMax-1) - y) + yOffset + 1
-                for x in range(arrXMax):
-                    x0 = x + xOffset
-                    y0 = y + yOffset
-
-                    x1 = (arrWRot - 3) - int(x/2) - y - ((strip * (xMax+1)))
-                    y1 = ((yMax-1) - y) + int((x+1)/2)
-                    stripSandpile_rot[x1][y1] = sandboxRaw[x][y+yOffset]
-                    stripSandpileBound_rot[x1][y1] = 1
-
-                    stripSandpile[x0][y0] = sandboxRaw[x][y+yOffset]
-                    stripSandpileBound[x0][y0] = 1
-
-        np.save(f'saved_piles/{filenom}_strips.npy', stripSandpile)
-        np.save(f'saved_piles/{filenom}_strips_bound.npy', stripSandpileBound)
-        np.save(f'saved_piles/{filenom}_strips_rot.npy', stripSandpile_rot)
-        np.save(f'saved_piles/{filenom}_strips_rot_bound.npy', stripSandpileBound_rot)
-
-        sandpileImg = draw_sp.SandpileImgExtended(arrW, arrH, stripSandpile, bound=stripSandpileBound, sink=None, filenom=f'images/{filenom}_flat', sideLength=imgPxWidth, colors=colors, bgColor=bgColor, lattice='hex', orientation=orientation)
-        sandpileImg.draw_hex_sandbox()
-        sandpileImg = draw_sp.SandpileImgExtended(arrWRot, arrHRot, stripSandpile_rot, bound=stripSandpileBound_rot, sink=None, filenom=f'images/{filenom}_flat_rot', sideLength=imgPxWidth, colors=colors, bgColor=bgColor, lattice='hex', orientation=orientation)
-        sandpileImg.draw_hex_sandbox()
+        stripSandpile, stripSandpileBound, stripSandpile_rot, stripSandpileBound_rot = layouts.unfold_icosahedron(sandboxRaw, xMax, yMax)
+
+        savedArrays = {'raw': sandboxRaw, 'strips': stripSandpile, 'strips_bound': stripSandpileBound, 'strips_rot': stripSandpile_rot, 'strips_rot_bound': stripSandpileBound_rot}
+        save_pile_arrays(exporter, filenom, savedArrays, metadata, archiveHeader, saveArchive, archiveCompress, archivePackBits)
+
+        exporter.render(draw_sp.SandpileImgExtended, 'draw_hex_sandbox', arrW, arrH, stripSandpile, bound=stripSandpileBound, sink=None, filenom=f'images/{filenom}_flat', sideLength=imgPxWidth, colors=colors, bgColor=bgColor, lattice='hex', orientation=orientation)
+        exporter.render(draw_sp.SandpileImgExtended, 'draw_hex_sandbox', arrWRot, arrHRot, stripSandpile_rot, bound=stripSandpileBound_rot, sink=None, filenom=f'images/{filenom}_flat_rot', sideLength=imgPxWidth, colors=colors, bgColor=bgColor, lattice='hex', orientation=orientation)
     else:
         toppleCtr = pileTuple[1]
 
-        # Save sandpile calculation to numpy array file (binary file format)
+        # Save sandpile calculation (one archive, or numpy array files)
         sandpile = pileTuple[0]
+        savedArrays = {'pile': sandpile}
         sandpileGrains = np.sum(sandpile) # TODO: This does not take bound into account, also want to calculate average
         print(f'Calculation time = {calc_time} sec, Topples: {toppleCtr}, Sandpile Grains: {sandpileGrains}/{grains}.')
 
+        # Plane piles come back cropped, drawn at their own size
+        if type == 'plane':
+            xMax, yMax = sandpile.shape
+            print(f'Plane pile size = {xMax} x {yMax}, offset = {tuple(int(o) for o in pileTuple[3])}.')
+            savedArrays['offset'] = pileTuple[3]
+
         bound = None
-        if (drawBounded == True or drawBounded == None) and len(pileTuple) == 3:
+        if (drawBounded == True or drawBounded == None) and len(pileTuple) >= 3:
             bound = pileTuple[2]
-        np.save(f'saved_piles/{filenom}.npy', sandpile)
-        if len(pileTuple) == 3:
-            np.save(f'saved_piles/{filenom}_bound.npy', pileTuple[2])
+        if len(pileTuple) >= 3:
+            savedArrays['bound'] = pileTuple[2]
+        save_pile_arrays(exporter, filenom, savedArrays, metadata, archiveHeader, saveArchive, archiveCompress, archivePackBits)
 
         # Save sandpile image to PNG file
-        sandpileImg = draw_sp.SandpileImg(xMax, yMax, sandpile, bound=bound, sink=sink, filenom=f'images/{filenom}', sideLength=imgPxWidth, colors=colors, bgColor=bgColor, bColor=bColor, bWidth=bWidth, bStyle=bStyle)
-        sandpileImg.draw_sandbox()
-
-        # Draw sandpile image to the screen using tkinter
-        if drawOutput == True:
+        exporter.render(draw_sp.SandpileImg, 'draw_sandbox', xMax, yMax, sandpile, bound=bound, sink=sink, filenom=f'images/{filenom}', sideLength=imgPxWidth, colors=colors, bgColor=bgColor, bColor=bColor, bWidth=bWidth, bStyle=bStyle)
+
+        # Save sandpile image to SVG file
+        if saveSvg == True:
+            svgArgs = (xMax, yMax, sandpile)
+            svgKwargs = {'bound': bound, 'sink': sink, 'filenom': f'images/{filenom}', 'sideLength': imgPxWidth, 'colors': colors, 'bgColor': bgColor}
+            if args.compare_svg:
+                report_svg_writers(svgArgs, svgKwargs)
+            else:
+                draw_sp.SandpileSvgCompact(*svgArgs, **svgKwargs).draw_sandbox()
+
+        # Draw sandpile image to the screen using tkinter (once every file is written)
+        exporter.close()
+        if sandpileTk is not None:
+            sandpileTk.update_sandbox(sandpile, bound=bound, title=title)
+            sandpileTk.main_loop()
+        elif drawOutput == True:
             sandpileTk = draw_sp.SandpileTk(xMax, yMax, sandpile, bound=bound, sink=sink, title=title, sideLength=tkPxWidth, colors=colors, bgColor=bgColor, bColor=bColor, bWidth=bWidth, bStyle=bStyle)
             sandpileTk.draw_sandbox()
             sandpileTk.main_loop()
+    exporter.close()
 
 # Command: python .\sandpile_surface_toppling.py .\pile_config\Cylinder_LineX_09drops_100k_01.json
 if __name__ == '__main__':
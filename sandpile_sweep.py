@@ -0,0 +1,310 @@
+import sandpile_surface_toppling as sst
+import pile_archive
+import pile_metadata as pile_meta
+import export_pipeline
+
+import argparse
+import contextlib
+import copy
+import csv
+import glob
+import io
+import itertools
+import json
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from time import perf_counter
+
+
+'''
+Sweep runner: calculates many pile configs in one command on a process pool.
+
+Jobs come from pile config files (a directory of them or glob patterns) or
+from a parameter grid expanded from a template config:
+
+    {
+        "template": "pile_config/Cylinder_LineX_09drops_100k_01.json",
+        "grid": {
+            "grains": {"start": 20000, "stop": 100001, "step": 20000},
+            "topple": ["von_neumann", "moore"],
+            "dropParam.dropSpotShift": [5, 10]
+        }
+    }
+
+Every combination of the grid values (lists, or start/stop/step ranges as
+Python's range) is set into a copy of the template (a dotted key sets a
+nested field) and named {filenom}_{key}{value}_... . The template may also
+be given inline as a dict.
+
+Jobs are admitted to the pool while the workers are not all busy and the
+estimated memory of the running jobs stays within the memory budget (a job
+too big for the budget runs alone). Each job writes its pile archive (and
+a PNG with --render) to the output directory. As jobs finish a row of the
+summary table (time, topples, grains retained) is appended to summary.csv.
+
+Workers only import what their job needs: the toppling kernels always,
+draw_sandpile (and PIL) only when rendering.
+'''
+
+JOB_BASE_BYTES = 64 << 20 # Interpreter, numpy and the kernel module of a worker
+ENGINE_CELL_BYTES = {'scan': 32, 'worklist': 48, 'vectorized': 96, 'parallel': 48, 'presolve': 256} # Rough peak bytes per cell while toppling (pile, bound and the engine's work arrays)
+RENDER_PIXEL_BYTES = 16 # RGBA image and the uint32 composite of SandpileImg
+MEMORY_FRACTION = 0.75 # Share of the available memory used as the default budget
+SUMMARY_FIELDS = ['job', 'pileType', 'xMax', 'yMax', 'grains', 'topple', 'engine', 'seconds', 'topples', 'grainsRetained', 'memoryMB', 'status']
+
+'''
+####
+Jobs
+####
+'''
+
+def config_paths(patterns):
+    # Pile config files of directories (every .json in them) and glob patterns
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.extend(sorted(glob.glob(os.path.join(pattern, '*.json'))))
+        else:
+            paths.extend(sorted(glob.glob(pattern)))
+    return paths
+
+def grid_values(spec):
+    if isinstance(spec, dict):
+        return list(range(spec['start'], spec['stop'], spec.get('step') or 1))
+    elif isinstance(spec, list):
+        return spec
+    return [spec]
+
+def set_key(config, key, value):
+    # Sets a dotted key ('dropParam.dropSpotShift') in a config dict
+    keys = key.split('.')
+    for part in keys[:-1]:
+        config = config.setdefault(part, {})
+    config[keys[-1]] = value
+
+def value_label(value):
+    if not isinstance(value, str):
+        value = json.dumps(value)
+    return re.sub(r'[^A-Za-z0-9._-]+', '', value)
+
+def expand_grid(sweep):
+    # Configs of every combination of the grid values
+    template = sweep['template']
+    if isinstance(template, str):
+        template = sst.load_JSON(template)
+    grid = sweep.get('grid') or {}
+    keys = list(grid.keys())
+    configs = []
+    for values in itertools.product(*[grid_values(grid[key]) for key in keys]):
+        config = copy.deepcopy(template)
+        for key, value in zip(keys, values):
+            set_key(config, key, value)
+        labels = [f"{key.split('.')[-1]}{value_label(value)}" for key, value in zip(keys, values)]
+        config['filenom'] = '_'.join([str(template.get('filenom') or 'AbelianSandpile')] + labels)
+        configs.append(config)
+    return configs
+
+def job_cells(params):
+    if params['type'] == 'cubesurface':
+        return 2 * ((params['xMax'] * params['yMax']) + (params['xMax'] * params['zMax']) + (params['yMax'] * params['zMax']))
+    elif params['type'] == 'icosahedronsurface':
+        return 20 * params['xMax'] * params['yMax'] * 2
+    elif params['type'] == 'plane':
+        return max(params['xMax'] * params['yMax'], params['grains']) # Plane piles grow to about one cell per grain
+    return params['xMax'] * params['yMax']
+
+def job_memory(config, render):
+    # Rough peak bytes of a job, for admission
+    with contextlib.redirect_stdout(io.StringIO()):
+        params = sst.pile_params(config)
+    cells = job_cells(params)
+    memory = JOB_BASE_BYTES + (cells * ENGINE_CELL_BYTES.get(str(config.get('engine') or 'scan'), 64))
+    if render:
+        sideLength = int(config.get('imagePixelWidth') or 1)
+        memory += cells * sideLength * sideLength * RENDER_PIXEL_BYTES
+    return memory
+
+def make_jobs(configs, render):
+    # (name, config, memory) of each config, names made unique
+    jobs = []
+    names = set()
+    for idx, config in enumerate(configs):
+        name = str(config.get('filenom') or 'AbelianSandpile')
+        if name in names:
+            name = f'{name}_{idx}'
+        names.add(name)
+        jobs.append({'name': name, 'config': config, 'memory': job_memory(config, render)})
+    return jobs
+
+def available_memory():
+    # MemAvailable from /proc/meminfo, else the free physical pages
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES')
+
+'''
+###########
+Job Workers
+###########
+'''
+
+def pile_arrays(type, pileTuple):
+    # Named arrays of a pile tuple, as sandpile_surface_toppling saves them
+    if type == 'cubesurface':
+        arrays = dict(zip(pile_meta.CUBE_FACES, [pileTuple[0][0], pileTuple[0][1], pileTuple[1][0], pileTuple[1][1], pileTuple[2][0], pileTuple[2][1]]))
+        if len(pileTuple) == 7:
+            bounds = [pileTuple[4][0], pileTuple[4][1], pileTuple[5][0], pileTuple[5][1], pileTuple[6][0], pileTuple[6][1]]
+            arrays.update({f'{face}_bound': bound for face, bound in zip(pile_meta.CUBE_FACES, bounds)})
+        return arrays
+    elif type == 'icosahedronsurface':
+        return {'raw': pileTuple[3]}
+    arrays = {'pile': pileTuple[0]}
+    if len(pileTuple) >= 3:
+        arrays['bound'] = pileTuple[2]
+    if type == 'plane':
+        arrays['offset'] = pileTuple[3]
+    return arrays
+
+def render_pile(pileType, params, arrays, config, filenom):
+    # PNG of the pile, drawn as sandpile_surface_toppling draws it (without drop spots)
+    import draw_sandpile as draw_sp
+    import render_tiles
+    import sandpile_layouts as layouts
+    settings = render_tiles.render_settings(config)
+    drawBounded = settings.pop('drawBounded')
+    if pileType == 'icosahedronsurface':
+        strips, stripsBound = layouts.unfold_icosahedron(arrays['raw'], params['xMax'], params['yMax'])[:2]
+        draw_sp.SandpileImgExtended(strips.shape[0], strips.shape[1], strips, bound=stripsBound, filenom=filenom, sideLength=settings['sideLength'], colors=settings['colors'], bgColor=settings['bgColor'], lattice='hex').draw_hex_sandbox()
+        return
+    if pileType == 'cubesurface':
+        pile, bound = layouts.unfold_cube(*[arrays[face] for face in pile_meta.CUBE_FACES])
+    else:
+        pile = arrays['pile']
+        bound = arrays.get('bound') if drawBounded else None
+    draw_sp.SandpileImg(pile.shape[0], pile.shape[1], pile, bound=bound, filenom=filenom, **settings).draw_sandbox()
+
+def run_job(job, outputDir, render):
+    '''
+    Calculates one job's pile and writes its archive (and image) to
+    outputDir. Returns its summary row, failures included.
+    '''
+    config = job['config']
+    name = job['name']
+    row = {'job': name, 'pileType': config.get('pileType') or 'square', 'xMax': config.get('xMax'), 'yMax': config.get('yMax'), 'grains': config.get('grains'),
+           'topple': value_label(config.get('topple') or 'von_neumann'), 'engine': config.get('engine') or 'scan', 'memoryMB': round(job['memory'] / (1 << 20), 1)}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            params = sst.pile_params(config)
+            pileType = params['type']
+            start = perf_counter()
+            pileTuple = sst.calculate_pile(pileType, params['xMax'], params['yMax'], params['zMax'], params['numRows'], params['grains'], params['topple'], params['dropSpots'],
+                                           seed=params['seed'], seedType=params['seedType'], seedAttr=params['seedAttr'], engine=str(config.get('engine') or 'scan'),
+                                           threads=int(config.get('threads') or 0), multiscale=config.get('multiscale') == True, stats={}, symmetry=str(config.get('symmetry') or 'none'))
+            seconds = perf_counter() - start
+            arrays = pile_arrays(pileType, pileTuple)
+            toppleCtr = int(sst.pile_topples(pileTuple))
+            metadata = pile_meta.pile_metadata(pileType, params['xMax'], params['yMax'], params['zMax'], params['numRows'], params['topple'], params['grains'],
+                                               params['seed'], params['seedType'], params['seedAttr'], params['dropSpots'])
+            pileDir = os.path.join(outputDir, 'saved_piles')
+            pile_archive.write_archive(pile_archive.archive_path(name, pileDir), arrays, {'metadata': metadata, 'config': config, 'toppleCtr': toppleCtr, 'calcTime': seconds})
+            pile_meta.save_pile_metadata(name, metadata, pileDir, archive=True)
+            if render:
+                render_pile(pileType, params, arrays, config, os.path.join(outputDir, 'images', name))
+        row.update({'seconds': round(seconds, 4), 'topples': toppleCtr, 'grainsRetained': int(sum(int(arrays[key].sum()) for key in pile_meta.pile_names(pileType))), 'status': 'ok'})
+    except Exception as error:
+        row['status'] = f'{error.__class__.__name__}: {error}'
+    return row
+
+'''
+#########
+Scheduler
+#########
+'''
+
+def run_sweep(jobs, outputDir, workers=0, memoryBytes=None, render=False, summaryPath=None):
+    '''
+    Runs the jobs on a pool of workers (one runs them in order in this
+    process), admitting pending jobs in order as workers and memory free up,
+    and appends each finished job's row to the summary table. Returns the
+    rows in finishing order.
+    '''
+    workers = export_pipeline.resolve_workers(workers)
+    if memoryBytes is None:
+        memoryBytes = MEMORY_FRACTION * available_memory()
+    for subDir in ['saved_piles', 'images']:
+        os.makedirs(os.path.join(outputDir, subDir), exist_ok=True)
+    summaryPath = summaryPath or os.path.join(outputDir, 'summary.csv')
+    rows = []
+
+    with open(summaryPath, 'w', newline='') as summaryFile:
+        writer = csv.DictWriter(summaryFile, SUMMARY_FIELDS)
+        writer.writeheader()
+        summaryFile.flush()
+
+        def finish(row):
+            writer.writerow(row)
+            summaryFile.flush()
+            rows.append(row)
+            print(f"[{len(rows)}/{len(jobs)}] {row['job']}: {row['status']}, {row.get('seconds', '-')} sec, {row.get('topples', '-')} topples, {row.get('grainsRetained', '-')} grains retained.")
+
+        if workers == 1:
+            for job in jobs:
+                finish(run_job(job, outputDir, render))
+            return rows
+
+        pending = list(jobs)
+        running = {}
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while len(pending) > 0 or len(running) > 0:
+                # First pending jobs fitting in the memory left, any job once nothing runs
+                idx = 0
+                while idx < len(pending) and len(running) < workers:
+                    usedMemory = sum(job['memory'] for job in running.values())
+                    if len(running) == 0 or usedMemory + pending[idx]['memory'] <= memoryBytes:
+                        job = pending.pop(idx)
+                        running[executor.submit(run_job, job, outputDir, render)] = job
+                    else:
+                        idx += 1
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    try:
+                        row = future.result()
+                    except Exception as error: # The worker died (e.g. killed for memory)
+                        row = {'job': job['name'], 'memoryMB': round(job['memory'] / (1 << 20), 1), 'status': f'{error.__class__.__name__}: {error}'}
+                    finish(row)
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description='Calculate many pile configs on a process pool')
+    parser.add_argument('configs', nargs='*', help='Pile config files: directories (every .json in them) or glob patterns')
+    parser.add_argument('--grid', type=str, default=None, help='Sweep JSON with a template config and a grid of values to expand')
+    parser.add_argument('-o', '--output', type=str, default='sweeps', help='Directory for the saved piles, images and summary.csv')
+    parser.add_argument('-w', '--workers', type=int, default=0, help='Worker processes (0 uses every core, 1 runs the jobs in order in this process)')
+    parser.add_argument('--memory-mb', type=float, default=None, help=f'Memory budget of the running jobs (default {MEMORY_FRACTION:.0%} of the available memory)')
+    parser.add_argument('--render', action='store_true', help='If flag present, also draw each pile to a PNG')
+    args = parser.parse_args()
+
+    configs = [sst.load_JSON(path) for path in config_paths(args.configs)]
+    if args.grid is not None:
+        configs.extend(expand_grid(sst.load_JSON(args.grid)))
+    if len(configs) == 0:
+        raise ValueError('No pile configs to run')
+    jobs = make_jobs(configs, args.render)
+    memoryBytes = None if args.memory_mb is None else args.memory_mb * (1 << 20)
+
+    start = perf_counter()
+    rows = run_sweep(jobs, args.output, args.workers, memoryBytes, args.render)
+    wallTime = perf_counter() - start
+    jobTime = sum(row.get('seconds') or 0 for row in rows)
+    failed = sum(1 for row in rows if row['status'] != 'ok')
+    print(f"{len(rows)} jobs ({failed} failed) in {wallTime:.3f} sec, {jobTime:.3f} sec of toppling. Summary: {os.path.join(args.output, 'summary.csv')}.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import json
+
+import numpy as np
+import pytest
+
+sp = pytest.importorskip('sandpile_calculations', reason='build the extension first: python compile_calc_library.py build_ext --inplace')
+import avalanche_statistics as aval
+
+'''
+Avalanche records against dropping each grain and relaxing the whole pile
+on the worklist kernel with an odometer: the same stable piles, sizes
+(total firings), areas (cells which fired) and lost grains, across batch
+boundaries. Then the .npy records and _meta.json written by main().
+'''
+
+def reference_drops(graph, flatSandbox, sites):
+    flatSandbox = flatSandbox.copy()
+    records = []
+    for site in sites:
+        before = int(flatSandbox.sum()) + 1
+        flatSandbox[site] += 1
+        odometer = np.zeros(graph.numCells, dtype=np.int64)
+        flatSandbox = sp.topple_graph_worklist(flatSandbox, graph, odometer)[0]
+        records.append((int(odometer.sum()), int(np.count_nonzero(odometer)), before - int(flatSandbox.sum())))
+    return (flatSandbox, records)
+
+@pytest.mark.parametrize('type, topple', [('square', 'von_neumann'), ('square', 'moore'), ('cylinder', 'von_neumann')])
+def test_records_match_full_relaxation(type, topple):
+    graph = aval.lattice_graph(type, 12, 9, topple)
+    start = aval.start_pile(graph, 'max')
+    run = aval.AvalancheRun(graph, start.copy(), seed=3)
+    records = np.zeros(300, dtype=aval.AVALANCHE_DTYPE)
+    run.run(300, records, batch=64)
+    flatSandbox, expected = reference_drops(graph, start, records['site'])
+    assert np.array_equal(run.flatSandbox, flatSandbox)
+    assert [tuple(int(value) for value in record) for record in records[['size', 'area', 'lost']]] == expected
+    assert np.array_equal(records['duration'] > 0, records['size'] > 0)
+    assert run.numDropped == 300
+
+def test_fixed_site_and_saved_start(tmp_path):
+    graph = aval.lattice_graph('square', 7, 7, 'von_neumann')
+    unstable = np.full((7, 7), 5, dtype=np.int64)
+    np.save(tmp_path / 'start.npy', unstable)
+    start = aval.start_pile(graph, str(tmp_path / 'start.npy')) # Saved piles are relaxed first
+    assert int(start.max()) < graph.threshold
+    run = aval.AvalancheRun(graph, start.copy(), site=24)
+    sites, sizes, areas, durations, losses = run.drop(40)
+    assert (sites == 24).all()
+    assert list(sizes) == [record[0] for record in reference_drops(graph, start, sites)[1]]
+
+def test_closed_lattice_rejected():
+    with pytest.raises(ValueError, match='no cells losing grains'):
+        aval.lattice_graph('squarewrap', 6, 6, 'von_neumann')
+
+def test_main_writes_records(tmp_path, monkeypatch):
+    output = str(tmp_path / 'avalanches.npy')
+    monkeypatch.setattr('sys.argv', ['avalanche_statistics.py', '--size', '10', '10', '--drops', '500', '--warmup', '50', '--seed', '2', '-o', output])
+    aval.main()
+    records = np.load(output, mmap_mode='r')
+    assert records.dtype == aval.AVALANCHE_DTYPE
+    assert len(records) == 500
+    with open(str(tmp_path / 'avalanches_meta.json')) as metaFile:
+        meta = json.load(metaFile)
+    assert meta['summary']['drops'] == 500
+    assert meta['summary']['topples'] == int(records['size'].sum())
+    assert meta['summary']['lost'] == int(records['lost'].sum())
@@ -0,0 +1,195 @@
+import math
+
+import numpy as np
+import pytest
+from PIL import Image, ImageColor, ImageDraw
+
+import draw_sandpile as draw_sp
+
+'''
+The NumPy renderers against the per-pixel and per-polygon renderers they
+replaced (ported below from the original draw_sandpile), pixel for pixel.
+'''
+
+COLORS = ['#03045E', '#00B4D8', '#90E0EF', '#CAF0F8']
+
+def random_pile(xMax, yMax, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 6, (xMax, yMax), dtype=np.int64)
+
+def saved_pixels(path):
+    with Image.open(path) as image:
+        return np.asarray(image.convert('RGBA'))
+
+def reference_square(xMax, yMax, sandpile, bound, sink, sideLength, colors, bgColor, bWidth, bColor, bStyle, width=None, height=None):
+    # Original SandpileImg.draw_sandbox: one putpixel per image pixel
+    imgColors = [ImageColor.getcolor(color, 'RGBA') for color in colors]
+    borderColor = ImageColor.getcolor(bColor, 'RGBA')
+    sandpile = np.mod(sandpile, len(colors))
+    width = xMax * sideLength if width is None else width
+    height = yMax * sideLength if height is None else height
+    image = Image.new('RGBA', (math.ceil(width), math.ceil(height)), bgColor or colors[0])
+    bMin = bWidth
+    bMax = sideLength - bWidth
+    for x in range(xMax):
+        for y in range(yMax):
+            if sink[x, y] != 0 or bound[x, y] != 1:
+                continue
+            for i in range(sideLength):
+                for j in range(sideLength):
+                    if bStyle == 'all':
+                        onBorder = i < bMin or i >= bMax or j < bMin or j >= bMax
+                    else:
+                        onBorder = not ((i >= bMin and i < bMax) or (j >= bMin and j < bMax))
+                    image.putpixel(((x * sideLength) + i, (y * sideLength) + j), borderColor if onBorder else imgColors[sandpile[x, y]])
+    return np.asarray(image)
+
+@pytest.mark.parametrize('sideLength', [1, 2, 3, 5])
+@pytest.mark.parametrize('bWidth', [0, 1, 2])
+@pytest.mark.parametrize('bStyle', ['all', 'corners'])
+def test_square_matches_putpixel(tmp_path, sideLength, bWidth, bStyle):
+    xMax, yMax = 13, 9
+    sandpile = random_pile(xMax, yMax)
+    bound = (random_pile(xMax, yMax, 1) > 0).astype(np.uint8)
+    sink = np.zeros((xMax, yMax), dtype=np.uint8)
+    sink[4:6, 3:5] = 1
+    filenom = str(tmp_path / 'square')
+    image = draw_sp.SandpileImg(xMax, yMax, sandpile, bound=bound, sink=sink, filenom=filenom, sideLength=sideLength, colors=COLORS, bgColor='#FFFFFF', bWidth=bWidth, bColor='#FF0000', bStyle=bStyle)
+    image.draw_sandbox()
+    expected = reference_square(xMax, yMax, sandpile, bound, sink, sideLength, COLORS, '#FFFFFF', bWidth, '#FF0000', bStyle)
+    assert np.array_equal(saved_pixels(filenom + '.png'), expected)
+
+def test_square_padded_canvas(tmp_path):
+    # A canvas larger than the pile keeps the background outside it
+    xMax, yMax = 7, 5
+    sandpile = random_pile(xMax, yMax)
+    ones = np.ones((xMax, yMax), dtype=np.uint8)
+    filenom = str(tmp_path / 'padded')
+    draw_sp.SandpileImg(xMax, yMax, sandpile, filenom=filenom, sideLength=3, colors=COLORS, width=30.5, height=20).draw_sandbox()
+    expected = reference_square(xMax, yMax, sandpile, ones, 1 - ones, 3, COLORS, None, 0, '#000000', 'all', width=30.5, height=20)
+    assert np.array_equal(saved_pixels(filenom + '.png'), expected)
+
+def reference_extended(lattice, xMax, yMax, sandpile, bound, sideLength, colors, orientation='normal'):
+    # Original SandpileImgExtended: one ImageDraw polygon per cell, in the same order
+    imgColors = [ImageColor.getcolor(color, 'RGBA') for color in colors]
+    sandpile = np.mod(sandpile, len(colors))
+    s = sideLength
+    r3 = math.sqrt(3.0)
+    width = xMax * s
+    height = yMax * s
+    if lattice == 'hex':
+        width = math.ceil(xMax / 2.0) * s
+        height = yMax * (math.sqrt(3) / 2.0) * s
+    elif lattice == 'tri':
+        width = (1.5 * xMax * s) + s
+        height = (r3 * s * yMax) + ((r3 / 2.0) * s)
+    elif lattice == 'trihex':
+        width = xMax * (math.sqrt(3) / 2.0) * s
+        height = (yMax * 0.75 * s) + s
+    image = Image.new('RGBA', (math.ceil(width), math.ceil(height)), colors[0])
+    draw = ImageDraw.Draw(image)
+    polygon = lambda points, x, y: draw.polygon(points, fill=imgColors[sandpile[x, y]])
+
+    if lattice == 'hex':
+        downTriangle = 1 if orientation == 'inverted' else 0
+        for x in range(xMax):
+            for y in range(yMax):
+                if bound[x, y] != 1:
+                    continue
+                x0 = x * (s / 2.0)
+                y0 = y * (r3 / 2.0) * s
+                x1 = x0 + (s / 2.0)
+                x2 = x0 + s
+                y1 = y0 + ((r3 / 2.0) * s)
+                if (x + y) % 2 == downTriangle:
+                    polygon(((x0, y0), (x2, y0), (x1, y1)), x, y)
+                else:
+                    polygon(((x0, y1), (x2, y1), (x1, y0)), x, y)
+    elif lattice == 'tri':
+        for x in range(xMax):
+            for y in range(yMax):
+                if bound[x, y] != 1:
+                    continue
+                x1 = (x * 1.5 * s) + (0.5 * s)
+                y1 = (y * r3 * s) + ((x % 2) * ((r3 / 2.0) * s))
+                x0 = x1 - (0.5 * s)
+                x2 = x1 + s
+                x3 = x1 + (1.5 * s)
+                y2 = y1 + ((r3 / 2.0) * s)
+                y3 = y1 + (r3 * s)
+                polygon(((x0, y2), (x1, y1), (x2, y1), (x3, y2), (x2, y3), (x1, y3)), x, y)
+    else:
+        for y in range(yMax):
+            xStart, xStep = {1: (0, 2), 3: (1, 2)}.get(y % 4, (0, 1))
+            for x in range(xStart, xMax, xStep):
+                if bound[x, y] != 1:
+                    continue
+                x0 = x * ((r3 / 2.0) * s)
+                y0 = (y * s) - (int(y / 4) * s)
+                if x % 2 == 0:
+                    y0 = y0 + (0.5 * s)
+                    if y % 4 == 2:
+                        y0 = y0 - s
+                xh = x0 + ((r3 / 2.0) * s)
+                if y % 2 == 1:
+                    polygon(((x0, y0), (xh, y0 - (0.5 * s)), (x0 + (r3 * s), y0), (xh, y0 + (0.5 * s))), x, y)
+                elif (y % 4 == 0) == (x % 2 == 0):
+                    polygon(((x0, y0), (xh, y0 - (0.5 * s)), (xh, y0 + (0.5 * s)), (x0, y0 + s)), x, y)
+                else:
+                    polygon(((x0, y0), (xh, y0 + (0.5 * s)), (xh, y0 + (1.5 * s)), (x0, y0 + s)), x, y)
+    return np.asarray(image)
+
+EXTENDED_DRAWS = {'hex': 'draw_hex_sandbox', 'tri': 'draw_tri_sandbox', 'trihex': 'draw_tri_hex_sandbox'}
+
+@pytest.mark.parametrize('sideLength', [3, 8, 13])
+@pytest.mark.parametrize('lattice', ['hex', 'tri', 'trihex'])
+def test_extended_matches_polygons(tmp_path, lattice, sideLength):
+    xMax, yMax = 17, 12
+    sandpile = random_pile(xMax, yMax)
+    bound = (random_pile(xMax, yMax, 2) > 0).astype(np.uint8)
+    filenom = str(tmp_path / lattice)
+    image = draw_sp.SandpileImgExtended(xMax, yMax, sandpile, bound=bound, filenom=filenom, sideLength=sideLength, colors=COLORS, lattice=lattice)
+    getattr(image, EXTENDED_DRAWS[lattice])()
+    assert np.array_equal(saved_pixels(filenom + '.png'), reference_extended(lattice, xMax, yMax, sandpile, bound, sideLength, COLORS))
+
+def test_inverted_hex_matches_polygons(tmp_path):
+    xMax, yMax = 11, 7
+    sandpile = random_pile(xMax, yMax)
+    ones = np.ones((xMax, yMax), dtype=np.uint8)
+    filenom = str(tmp_path / 'inverted')
+    draw_sp.SandpileImgExtended(xMax, yMax, sandpile, filenom=filenom, sideLength=10, colors=COLORS, lattice='hex', orientation='inverted').draw_hex_sandbox()
+    assert np.array_equal(saved_pixels(filenom + '.png'), reference_extended('hex', xMax, yMax, sandpile, ones, 10, COLORS, 'inverted'))
+
+def svg_cells(path, xMax, yMax, sideLength, colors):
+    # Color index of every cell covered by the compact SVG's paths, -1 where only the background shows
+    import re
+    import xml.etree.ElementTree as ET
+    cells = np.full((xMax, yMax), -1, dtype=np.int64)
+    groups = 0
+    for group in ET.parse(path).getroot().iter('{http://www.w3.org/2000/svg}g'):
+        if 'fill' not in group.attrib:
+            continue
+        groups += 1
+        val = colors.index(group.attrib['fill'])
+        for path in group:
+            for x, y, w in re.findall(r'M(\d+) (\d+)h(\d+)v' + str(sideLength) + r'h-\3z', path.attrib['d']):
+                x, y, w = int(x) // sideLength, int(y) // sideLength, int(w) // sideLength
+                assert (cells[x:x + w, y] == -1).all()
+                cells[x:x + w, y] = val
+    return cells, groups
+
+@pytest.mark.parametrize('rowsPerWrite', [1, 4, 64])
+def test_svg_compact_cells(tmp_path, monkeypatch, rowsPerWrite):
+    monkeypatch.setattr(draw_sp, 'SVG_ROWS_PER_WRITE', rowsPerWrite)
+    xMax, yMax = 19, 14
+    sandpile = random_pile(xMax, yMax) % 3 # Fewer values so there are runs to merge
+    bound = (random_pile(xMax, yMax, 3) > 0).astype(np.uint8)
+    sink = np.zeros((xMax, yMax), dtype=np.uint8)
+    sink[2:5, 6:9] = 1
+    filenom = str(tmp_path / 'compact')
+    draw_sp.SandpileSvgCompact(xMax, yMax, sandpile, bound=bound, sink=sink, filenom=filenom, sideLength=3, colors=COLORS).draw_sandbox()
+    cells, groups = svg_cells(filenom + '.svg', xMax, yMax, 3, COLORS)
+    expected = np.where((sink == 0) & (bound == 1), sandpile % len(COLORS), -1)
+    assert np.array_equal(cells, expected)
+    # One group per color per band of rows
+    assert groups <= len(COLORS) * math.ceil(yMax / rowsPerWrite)
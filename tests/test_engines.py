@@ -0,0 +1,129 @@
+import numpy as np
+import pytest
+
+sp = pytest.importorskip('sandpile_calculations', reason='build the extension first: python compile_calc_library.py build_ext --inplace')
+
+'''
+Every engine and mode against the scan kernel on small piles: the worklist
+engines give the same stable pile and topple count (and bound where they keep
+one), the other engines, multiscale, symmetry and incremental runs give the
+same stable pile, and a plane pile is the middle of a large bounded square.
+'''
+
+NEIGHBORHOODS = list(sp.NEIGHBORHOOD_OFFSETS)
+PILE_ENGINES = ['vectorized', 'parallel', 'presolve']
+SIZE = 25
+GRAINS = 3000
+CENTER = [(SIZE // 2, SIZE // 2, 1.0)]
+OFF_CENTER = [(5, 8, 0.6), (17, 12, 0.4)]
+
+def grid_pile(topple, dropSpots=CENTER, grains=GRAINS, **kwargs):
+    return sp.calculate_sandpile_grid_seeded(SIZE, SIZE, grains, topple, list(dropSpots), **kwargs)
+
+def wrap_pile(shape, topple='von_neumann', dropSpots=OFF_CENTER, grains=700, **kwargs):
+    # 700 grains are below the 2 * 25 * 25 edges of the squarewrap, so it stabilizes
+    return sp.calculate_sandpile_wraparound_seeded(SIZE, SIZE, grains, topple, list(dropSpots), shape=shape, **kwargs)
+
+@pytest.mark.parametrize('topple', NEIGHBORHOODS)
+def test_grid_worklist_matches_scan(topple):
+    scan = grid_pile(topple, OFF_CENTER)
+    worklist = grid_pile(topple, OFF_CENTER, engine='worklist')
+    assert np.array_equal(worklist[0], scan[0])
+    assert worklist[1] == scan[1]
+    assert np.array_equal(worklist[2], scan[2])
+
+@pytest.mark.parametrize('engine', PILE_ENGINES)
+@pytest.mark.parametrize('topple', NEIGHBORHOODS)
+def test_grid_engines_match_scan(topple, engine):
+    assert np.array_equal(grid_pile(topple, OFF_CENTER, engine=engine)[0], grid_pile(topple, OFF_CENTER)[0])
+
+@pytest.mark.parametrize('topple', NEIGHBORHOODS)
+def test_grid_multiscale_matches_scan(topple):
+    scan = grid_pile(topple, OFF_CENTER, grains=20000)
+    multiscale = grid_pile(topple, OFF_CENTER, grains=20000, multiscale=True)
+    assert np.array_equal(multiscale[0], scan[0])
+    assert np.array_equal(multiscale[2], scan[2])
+
+@pytest.mark.parametrize('topple', NEIGHBORHOODS)
+def test_grid_symmetry_matches_scan(topple):
+    assert np.array_equal(grid_pile(topple, symmetry='auto')[0], grid_pile(topple)[0])
+
+@pytest.mark.parametrize('topple', ['von_neumann', 'moore', 'knightleft'])
+def test_grid_incremental_matches_scan(topple):
+    base = grid_pile(topple, OFF_CENTER, grains=1000)
+    incremental = grid_pile(topple, OFF_CENTER, basePile=base[0], baseGrains=1000)
+    assert np.array_equal(incremental[0], grid_pile(topple, OFF_CENTER)[0])
+
+@pytest.mark.parametrize('topple', ['von_neumann', 'moore', 'pinwheelleft'])
+def test_plane_matches_large_square(topple):
+    plane, _, _, offset = sp.calculate_sandpile_plane_seeded(SIZE, SIZE, GRAINS, topple, list(CENTER))
+    # A bounded square large enough that no grains reach its edges
+    bigSize = 201
+    shift = (bigSize // 2) - (SIZE // 2)
+    square = sp.calculate_sandpile_grid_seeded(bigSize, bigSize, GRAINS, topple, [(SIZE // 2 + shift, SIZE // 2 + shift, 1.0)])[0]
+    x0 = offset[0] + shift
+    y0 = offset[1] + shift
+    assert np.array_equal(square[x0:x0 + plane.shape[0], y0:y0 + plane.shape[1]], plane)
+    assert square.sum() == plane.sum()
+
+@pytest.mark.parametrize('shape', ['cylinder', 'squarewrap'])
+def test_wraparound_engines_match_scan(shape):
+    scan = wrap_pile(shape)
+    worklist = wrap_pile(shape, engine='worklist')
+    assert np.array_equal(worklist[0], scan[0])
+    assert worklist[1] == scan[1]
+    for engine in PILE_ENGINES:
+        assert np.array_equal(wrap_pile(shape, engine=engine)[0], scan[0]), engine
+    assert np.array_equal(wrap_pile(shape, multiscale=True)[0], scan[0])
+    assert np.array_equal(wrap_pile(shape, dropSpots=CENTER, symmetry='auto')[0], wrap_pile(shape, dropSpots=CENTER)[0])
+    base = wrap_pile(shape, grains=300)
+    assert np.array_equal(wrap_pile(shape, basePile=base[0], baseGrains=300)[0], scan[0])
+
+@pytest.mark.parametrize('shape', ['cylinder', 'squarewrap'])
+def test_wraparound_other_neighborhoods_scan(shape):
+    # No scan kernel for these, the scan engine topples them on the graph worklist
+    scan = wrap_pile(shape, topple='moore')
+    worklist = wrap_pile(shape, topple='moore', engine='worklist')
+    assert scan is not None
+    assert np.array_equal(scan[0], worklist[0])
+    assert scan[1] == worklist[1]
+
+def cube_pile(**kwargs):
+    # 600 grains are below the 2 * 6 * 8 * 8 edges of the cube surface
+    return sp.calculate_sandpile_cubesurface_seeded(8, 8, 8, 600, 'von_neumann', [(3, 4, 1.0, 'top')], **kwargs)
+
+def test_cubesurface_engines_match_scan():
+    scan = cube_pile()
+    worklist = cube_pile(engine='worklist')
+    assert all(np.array_equal(a, b) for a, b in zip(worklist[:3], scan[:3]))
+    assert worklist[3] == scan[3]
+    for kwargs in [{'engine': engine} for engine in PILE_ENGINES] + [{'multiscale': True}]:
+        assert all(np.array_equal(a, b) for a, b in zip(cube_pile(**kwargs)[:3], scan[:3])), kwargs
+
+def ico_pile(**kwargs):
+    numRows = 6
+    return sp.calculate_sandpile_icosahedronsurface_seeded(1 + (2 * (numRows - 1)), numRows, numRows, 700, 'default', [(0, numRows - 1, 1.0, 1)], **kwargs)
+
+def test_icosahedronsurface_engines_match_scan():
+    scan = ico_pile()
+    worklist = ico_pile(engine='worklist')
+    assert np.array_equal(worklist[3], scan[3])
+    assert worklist[1] == scan[1]
+    for kwargs in [{'engine': engine} for engine in PILE_ENGINES] + [{'multiscale': True}]:
+        assert np.array_equal(ico_pile(**kwargs)[3], scan[3]), kwargs
+
+def test_custom_neighborhood_offsets():
+    assert sp.resolve_neighborhood([[1, 0], [-1, 0], [0, 2], [0, -2]]) == [(1, 0), (-1, 0), (0, 2), (0, -2)]
+    for offsets in [[[1.5, 0], [-1, 0]], [[1.0, 0], [-1, 0]], [[True, 0], [-1, 0]], [[1, 0, 0]], [[0, 0], [1, 0]], []]:
+        with pytest.raises(ValueError):
+            sp.resolve_neighborhood(offsets)
+
+def test_repeated_offsets_match_scan():
+    # A repeated offset sends that many grains, the threshold counts it each time
+    offsets = [(1, 0), (1, 0), (-1, 0), (0, 1), (0, -1)]
+    scan = grid_pile(offsets, OFF_CENTER)
+    assert np.array_equal(grid_pile(offsets, OFF_CENTER, engine='worklist')[0], scan[0])
+    assert grid_pile(offsets, OFF_CENTER, engine='worklist')[1] == scan[1]
+    for engine in PILE_ENGINES:
+        assert np.array_equal(grid_pile(offsets, OFF_CENTER, engine=engine)[0], scan[0]), engine
+    assert int(scan[0].max()) == len(offsets) - 1
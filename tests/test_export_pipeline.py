@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+import pytest
+
+import draw_sandpile as draw_sp
+import export_pipeline
+
+'''
+The export pipeline writes the same files through the process pool as in
+order in this process, passes arrays through shared memory as snapshots,
+raises a failed job's error on close and frees its shared memory blocks.
+'''
+
+def random_pile(seed=0):
+    return np.random.default_rng(seed).integers(0, 4, (23, 17), dtype=np.int64)
+
+def write_exports(pipeline, directory, pile):
+    pipeline.save(os.path.join(directory, 'pile.npy'), pile)
+    pipeline.save(os.path.join(directory, 'bound.npy'), pile > 1)
+    pipeline.render(draw_sp.SandpileImg, 'draw_sandbox', 23, 17, pile, filenom=os.path.join(directory, 'image'), sideLength=3, colors=['#000000', '#FF0000', '#00FF00', '#0000FF'])
+
+def failing_job(array):
+    raise ValueError(f'failed on {array.shape}')
+
+def test_share_attach_round_trip():
+    blocks = []
+    pile = random_pile()
+    shared = export_pipeline.share_arrays([pile, {'faces': [pile[:3], pile.T]}, 'text', 5], blocks)
+    pile[0, 0] = 99 # The shared copy is a snapshot taken when it was shared
+    attachBlocks = []
+    attached = export_pipeline.attach_arrays(shared, attachBlocks)
+    try:
+        original = random_pile()
+        assert np.array_equal(attached[0], original)
+        assert np.array_equal(attached[1]['faces'][0], original[:3])
+        assert np.array_equal(attached[1]['faces'][1], original.T)
+        assert attached[2:] == ['text', 5]
+    finally:
+        del attached
+        for block in attachBlocks:
+            block.close()
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+def test_pool_matches_serial(tmp_path):
+    pile = random_pile()
+    for name, workers in [('serial', 1), ('pool', 2)]:
+        os.mkdir(tmp_path / name)
+        with export_pipeline.ExportPipeline(workers) as pipeline:
+            write_exports(pipeline, str(tmp_path / name), pile)
+    for filename in ['pile.npy', 'bound.npy', 'image.png']:
+        with open(tmp_path / 'serial' / filename, 'rb') as serialFile, open(tmp_path / 'pool' / filename, 'rb') as poolFile:
+            assert serialFile.read() == poolFile.read(), filename
+    assert np.array_equal(np.load(tmp_path / 'pool' / 'pile.npy'), random_pile())
+
+def test_queued_arrays_are_snapshots(tmp_path):
+    pile = random_pile()
+    with export_pipeline.ExportPipeline(2) as pipeline:
+        pipeline.save(str(tmp_path / 'pile.npy'), pile)
+        pile[:] = 0
+    assert np.array_equal(np.load(tmp_path / 'pile.npy'), random_pile())
+
+def test_failure_raises_on_close_and_frees_blocks():
+    pipeline = export_pipeline.ExportPipeline(2)
+    pipeline.submit(failing_job, random_pile())
+    names = [block.name for block in pipeline.blocks]
+    with pytest.raises(ValueError, match='failed on'):
+        pipeline.close()
+    assert pipeline.blocks == []
+    from multiprocessing import shared_memory
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
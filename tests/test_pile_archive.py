@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+import pile_archive
+
+'''
+.spile archives read back every array exactly (bit packed or whole bytes,
+compressed or not), rows() reads bands across chunk edges, and only
+uncompressed whole byte arrays load as memory mapped views.
+'''
+
+def sample_arrays():
+    rng = np.random.default_rng(0)
+    return {'pile': rng.integers(0, 4, (37, 29), dtype=np.int64), 'bound': rng.integers(0, 2, (37, 29)).astype(bool),
+            'wide': rng.integers(-70000, 70000, (11, 3), dtype=np.int64), 'big': np.array([0, 1 << 40], dtype=np.int64),
+            'faces': rng.integers(0, 16, (6, 5, 4), dtype=np.int64), 'count': np.array(123456789, dtype=np.int64),
+            'constant': np.full((4, 4), 3, dtype=np.int64), 'empty': np.zeros((0, 5), dtype=np.int64)}
+
+@pytest.mark.parametrize('compress', [True, False])
+@pytest.mark.parametrize('packBits', [True, False])
+def test_round_trip(tmp_path, monkeypatch, compress, packBits):
+    monkeypatch.setattr(pile_archive, 'CHUNK_CELLS', 100) # Several chunks per array
+    arrays = sample_arrays()
+    path = str(tmp_path / 'pile.spile')
+    pile_archive.write_archive(path, arrays, {'toppleCtr': 42}, compress=compress, packBits=packBits)
+    with pile_archive.PileArchive(path) as archive:
+        assert archive.header['toppleCtr'] == 42
+        assert archive.names() == list(arrays)
+        assert archive.entries['pile']['bits'] == (2 if packBits else 8)
+        assert len(archive.entries['pile']['chunks']) == 13
+        for name, array in archive.load_all().items():
+            assert np.array_equal(array, arrays[name]), name
+            if not archive.is_view(name):
+                assert array.dtype == arrays[name].dtype, name
+
+@pytest.mark.parametrize('packBits', [True, False])
+def test_chunked_rows(tmp_path, monkeypatch, packBits):
+    monkeypatch.setattr(pile_archive, 'CHUNK_CELLS', 64) # 2 rows of 29 cells per chunk
+    pile = sample_arrays()['pile']
+    path = str(tmp_path / 'pile.spile')
+    pile_archive.write_archive(path, {'pile': pile}, packBits=packBits)
+    with pile_archive.PileArchive(path) as archive:
+        for start, stop in [(0, 1), (1, 2), (3, 8), (5, 6), (0, 37), (36, 50), (20, 10), (-5, 3)]:
+            assert np.array_equal(archive.rows('pile', start, stop), pile[max(0, start):stop]), (start, stop)
+
+def test_uncompressed_whole_byte_arrays_are_views(tmp_path):
+    arrays = sample_arrays()
+    # Packed, only arrays which need whole bytes anyway (and min 0) are views
+    for compress, packBits, expected in [(True, True, []), (True, False, []), (False, True, ['big'])]:
+        path = str(tmp_path / f'{compress}{packBits}.spile')
+        pile_archive.write_archive(path, arrays, compress=compress, packBits=packBits)
+        with pile_archive.PileArchive(path) as archive:
+            assert [name for name in archive.names() if archive.is_view(name)] == expected
+    path = str(tmp_path / 'views.spile')
+    pile_archive.write_archive(path, arrays, compress=False, packBits=False)
+    with pile_archive.PileArchive(path) as archive:
+        views = [name for name in archive.names() if archive.is_view(name)]
+        assert views == ['pile', 'bound', 'big', 'faces', 'constant']
+        pile = archive.rows('pile', 4, 9)
+        assert isinstance(pile, np.memmap)
+        assert pile.dtype == np.uint8
+        assert not pile.flags.writeable
+        assert np.array_equal(pile, arrays['pile'][4:9])
+        assert archive.array('big').dtype == np.uint64
+
+def test_to_npy(tmp_path, monkeypatch):
+    monkeypatch.setattr(pile_archive, 'CHUNK_CELLS', 100)
+    arrays = sample_arrays()
+    path = str(tmp_path / 'pile.spile')
+    pile_archive.write_archive(path, arrays)
+    with pile_archive.PileArchive(path) as archive:
+        for name in ['pile', 'wide', 'count']:
+            archive.to_npy(name, str(tmp_path / f'{name}.npy'))
+            loaded = np.load(tmp_path / f'{name}.npy')
+            assert loaded.dtype == arrays[name].dtype
+            assert np.array_equal(loaded, arrays[name])
+
+def test_not_an_archive(tmp_path):
+    path = tmp_path / 'pile.spile'
+    path.write_bytes(b'NOTAPILE' + bytes(16))
+    with pytest.raises(ValueError, match='not a pile archive'):
+        pile_archive.PileArchive(str(path))
@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+
+import pile_cache
+import pile_metadata as pile_meta
+
+def square_metadata(grains=1000, topple='von_neumann'):
+    return pile_meta.pile_metadata('square', 9, 9, None, None, topple, grains, 0, 'uniform', None, [(4, 4, 1.0)])
+
+def test_key_uses_physics_fields_only():
+    metadata = square_metadata()
+    rendered = dict(metadata, colors=['#000000'], imagePixelWidth=4, engine='worklist')
+    assert pile_cache.pile_key(rendered) == pile_cache.pile_key(metadata)
+    assert pile_cache.pile_key(square_metadata(grains=1001)) != pile_cache.pile_key(metadata)
+    assert pile_cache.pile_key(square_metadata(topple='moore')) != pile_cache.pile_key(metadata)
+
+def test_pile_tuples_round_trip(tmp_path):
+    cache = pile_cache.PileCache(str(tmp_path))
+    pile = np.arange(81, dtype=np.int64).reshape((9, 9)) % 4
+    faces = [np.full((3, 3), face, dtype=np.int64) for face in range(6)]
+    for grains, pileTuple in [(1, (pile, 1234, pile > 1)), (2, (faces, 55, pile, pile))]:
+        cache.put(square_metadata(grains), pileTuple)
+        cached = cache.get(square_metadata(grains))
+        assert len(cached) == len(pileTuple)
+        for item, cachedItem in zip(pileTuple, cached):
+            if isinstance(item, list):
+                assert all(np.array_equal(a, b) for a, b in zip(item, cachedItem))
+            elif isinstance(item, np.ndarray):
+                assert np.array_equal(item, cachedItem)
+            else:
+                assert item == cachedItem
+    assert cache.get(square_metadata(3)) is None
+    assert (cache.hits, cache.misses) == (2, 1)
+
+def test_evicts_least_recently_used(tmp_path):
+    pile = np.zeros((64, 64), dtype=np.int64)
+    cache = pile_cache.PileCache(str(tmp_path))
+    cache.put(square_metadata(1), (pile, 1))
+    entrySize = cache.size()
+    cache.sizeLimit = (3 * entrySize) + (entrySize // 2)
+    for grains in [2, 3]:
+        cache.put(square_metadata(grains), (pile, grains))
+    # Entries keep their order by modification time, set it so the test does not depend on the clock
+    for age, grains in enumerate([1, 2, 3]):
+        os.utime(cache.entry_path(pile_cache.pile_key(square_metadata(grains))), (1000 + age, 1000 + age))
+    assert cache.get(square_metadata(1)) is not None # Refreshes entry 1, entry 2 is now the oldest
+    cache.put(square_metadata(4), (pile, 4))
+    assert cache.get(square_metadata(2)) is None
+    for grains in [1, 3, 4]:
+        assert cache.get(square_metadata(grains))[1] == grains
+    assert cache.size() <= cache.sizeLimit
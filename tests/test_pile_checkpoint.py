@@ -0,0 +1,72 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+sp = pytest.importorskip('sandpile_calculations', reason='build the extension first: python compile_calc_library.py build_ext --inplace')
+import pile_checkpoint
+
+'''
+A run stopped after a few checkpoints and resumed (with the working files
+left half way through a wave) ends with the same pile, bound and topples as
+an uninterrupted run, on the scan and worklist kernels.
+'''
+
+SIZE = 31
+GRAINS = 20000
+DROP_SPOTS = [(10, 12, 0.7), (20, 17, 0.3)]
+METADATA = {'pileType': 'square', 'xMax': SIZE, 'yMax': SIZE, 'grains': GRAINS}
+
+class Interrupted(Exception):
+    pass
+
+class StoppingCheckpoint(pile_checkpoint.PileCheckpoint):
+    # Dies partway through the run, after stopSaves checkpoints
+    stopSaves = 3
+
+    def __call__(self, waves, toppleCtr):
+        super().__call__(waves, toppleCtr)
+        if self.saves >= self.stopSaves:
+            self.sandbox[:5] += 1 # A half toppled wave in the working file
+            raise Interrupted()
+
+def grid_pile(engine, checkpoint=None):
+    return sp.calculate_sandpile_grid_seeded(SIZE, SIZE, GRAINS, 'von_neumann', list(DROP_SPOTS), engine=engine, checkpoint=checkpoint)
+
+@pytest.mark.parametrize('engine', ['scan', 'worklist'])
+def test_resume_matches_uninterrupted(tmp_path, engine):
+    directory = str(tmp_path / 'checkpoint')
+    expected = grid_pile(engine)
+    with pytest.raises(Interrupted):
+        grid_pile(engine, StoppingCheckpoint(directory, (SIZE, SIZE), METADATA, every=5, seconds=0))
+    with open(os.path.join(directory, pile_checkpoint.CHECKPOINT_FILE)) as stateFile:
+        state = json.load(stateFile)
+    assert state['slot'] == 0 # Slots alternate 0, 1, 0
+    checkpoint = pile_checkpoint.PileCheckpoint(directory, (SIZE, SIZE), METADATA, every=5, seconds=0, resume=True)
+    assert checkpoint.resumed
+    assert (checkpoint.waves, checkpoint.topples) == (state['waves'], state['topples'])
+    assert 0 < checkpoint.topples < expected[1]
+    resumed = grid_pile(engine, checkpoint)
+    assert np.array_equal(resumed[0], expected[0])
+    assert resumed[1] == expected[1]
+    assert np.array_equal(resumed[2], expected[2])
+
+def test_fresh_run_ignores_old_checkpoint(tmp_path):
+    directory = str(tmp_path / 'checkpoint')
+    with pytest.raises(Interrupted):
+        grid_pile('scan', StoppingCheckpoint(directory, (SIZE, SIZE), METADATA, every=5, seconds=0))
+    checkpoint = pile_checkpoint.PileCheckpoint(directory, (SIZE, SIZE), METADATA, every=0, seconds=0)
+    assert not checkpoint.resumed
+    assert not os.path.exists(os.path.join(directory, pile_checkpoint.CHECKPOINT_FILE))
+    assert np.array_equal(grid_pile('scan', checkpoint)[0], grid_pile('scan')[0])
+    assert checkpoint.saves == 0
+
+def test_resume_checks_metadata_and_engine(tmp_path):
+    directory = str(tmp_path / 'checkpoint')
+    with pytest.raises(Interrupted):
+        grid_pile('scan', StoppingCheckpoint(directory, (SIZE, SIZE), METADATA, every=5, seconds=0))
+    with pytest.raises(ValueError, match='different pile'):
+        pile_checkpoint.PileCheckpoint(directory, (SIZE, SIZE), dict(METADATA, grains=GRAINS + 1), resume=True)
+    with pytest.raises(ValueError, match='scan or worklist'):
+        grid_pile('vectorized', pile_checkpoint.PileCheckpoint(directory, (SIZE, SIZE), METADATA, resume=True))
@@ -0,0 +1,37 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import pile_metadata as pile_meta
+
+def square_metadata(grains):
+    return pile_meta.pile_metadata('square', 9, 9, None, None, 'von_neumann', grains, 0, 'uniform', None, [(4, 4, 1.0)])
+
+def test_metadata_compatible():
+    pile_meta.check_compatible(square_metadata(100), square_metadata(200))
+    with pytest.raises(ValueError):
+        pile_meta.check_compatible(square_metadata(300), square_metadata(200))
+    other = square_metadata(200)
+    other['topple'] = 'moore'
+    with pytest.raises(ValueError):
+        pile_meta.check_compatible(square_metadata(100), other)
+
+def test_load_base_pile_npy(tmp_path):
+    pile = np.arange(81, dtype=np.int64).reshape((9, 9)) % 4
+    np.save(tmp_path / 'base.npy', pile)
+    np.save(tmp_path / 'base_bound.npy', (pile > 0).astype(np.uint8))
+    pile_meta.save_pile_metadata('base', square_metadata(100), str(tmp_path))
+    basePile, baseGrains, baseBound = pile_meta.load_base_pile(pile_meta.metadata_path('base', str(tmp_path)), square_metadata(200))
+    assert np.array_equal(basePile, pile)
+    assert baseGrains == 100
+    assert np.array_equal(baseBound, pile > 0)
+
+def test_load_base_pile_without_files(tmp_path):
+    # A metadata dump without the files list is a clear error, not an IndexError
+    path = os.path.join(tmp_path, 'bare_meta.json')
+    with open(path, 'w') as jsonFile:
+        json.dump(square_metadata(100), jsonFile)
+    with pytest.raises(ValueError, match='lists no saved pile files'):
+        pile_meta.load_base_pile(path, square_metadata(200))
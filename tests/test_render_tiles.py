@@ -0,0 +1,112 @@
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import draw_sandpile as draw_sp
+import pile_archive
+import render_tiles
+
+'''
+Tiled renders against SandpileImg drawing the whole pile at once: the band
+PNG decodes to the same pixels (in order or from a process pool), the top
+Deep Zoom level stitches back into them and every lower level is the box
+filtered level above it.
+'''
+
+CONFIG = {'imagePixelWidth': 3, 'colors': ['#03045E', '#00B4D8', '#90E0EF', '#CAF0F8'], 'backgroundColor': '#FFFFFF',
+          'border': {'width': 1, 'color': '#FF0000', 'style': 'corners'}}
+
+def saved_pile(directory, xMax=41, yMax=27):
+    rng = np.random.default_rng(0)
+    pile = rng.integers(0, 4, (xMax, yMax), dtype=np.int64)
+    bound = (rng.integers(0, 5, (xMax, yMax)) > 0).astype(np.int64)
+    np.save(os.path.join(directory, 'pile.npy'), pile)
+    np.save(os.path.join(directory, 'pile_bound.npy'), bound)
+    return (pile, bound)
+
+def full_render(pile, bound, settings):
+    return draw_sp.SandpileImg(pile.shape[0], pile.shape[1], pile, bound=bound, sideLength=settings['sideLength'], colors=settings['colors'],
+                               bgColor=settings['bgColor'], bWidth=settings['bWidth'], bColor=settings['bColor'], bStyle=settings['bStyle']).render_pixels()
+
+def saved_pixels(path):
+    with Image.open(path) as image:
+        return np.asarray(image.convert('RGBA'))
+
+def test_adler32_combine():
+    rng = np.random.default_rng(1)
+    for length1, length2 in [(0, 5), (5, 0), (1, 1), (1000, 70000), (65521, 65521), (123457, 3)]:
+        first = rng.integers(0, 256, length1, dtype=np.uint8).tobytes()
+        second = rng.integers(0, 256, length2, dtype=np.uint8).tobytes()
+        assert render_tiles.adler32_combine(zlib.adler32(first), zlib.adler32(second), length2) == zlib.adler32(first + second)
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_band_png_matches_full_render(tmp_path, monkeypatch, workers):
+    monkeypatch.setattr(draw_sp, 'RENDER_BAND_PIXELS', 1000) # Bands of 6 pixel rows (2 cells of 123 pixels)
+    pile, bound = saved_pile(str(tmp_path))
+    paths, _, _ = render_tiles.open_source(str(tmp_path / 'pile.npy'))
+    settings = render_tiles.render_settings(CONFIG)
+    output = str(tmp_path / 'pile.png')
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        numBands = render_tiles.write_png(paths, settings, output, executor, workers)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    assert numBands == 14
+    assert np.array_equal(saved_pixels(output), full_render(pile, bound, settings))
+
+def test_render_tile_offsets(tmp_path):
+    pile, bound = saved_pile(str(tmp_path))
+    paths, _, _ = render_tiles.open_source(str(tmp_path / 'pile.npy'))
+    settings = render_tiles.render_settings(CONFIG)
+    full = full_render(pile, bound, settings)
+    for px, py, width, height in [(0, 0, 5, 5), (1, 2, 7, 4), (100, 70, 23, 11), (122, 80, 1, 1)]:
+        assert np.array_equal(render_tiles.render_tile(paths, settings, px, py, width, height), full[py:py + height, px:px + width])
+
+def test_dzi_pyramid(tmp_path):
+    pile, bound = saved_pile(str(tmp_path))
+    paths, _, _ = render_tiles.open_source(str(tmp_path / 'pile.npy'))
+    settings = render_tiles.render_settings(CONFIG)
+    full = full_render(pile, bound, settings) # 81 x 123 pixels, 7 levels below the top
+    tileSize = 32
+    output = str(tmp_path / 'pile.dzi')
+    render_tiles.write_dzi(paths, settings, output, tileSize)
+    with open(output) as dziFile:
+        assert 'Width="123" Height="81"' in dziFile.read()
+    tilesDir = str(tmp_path / 'pile_files')
+    assert sorted(int(level) for level in os.listdir(tilesDir)) == list(range(8))
+
+    def stitched(level):
+        width, height = render_tiles.level_size(123, 81, level, 7)
+        canvas = Image.new('RGBA', (width, height))
+        for col in range(-(-width // tileSize)):
+            for row in range(-(-height // tileSize)):
+                with Image.open(render_tiles.tile_path(tilesDir, level, col, row)) as tile:
+                    assert tile.size == (min(tileSize, width - (col * tileSize)), min(tileSize, height - (row * tileSize)))
+                    canvas.paste(tile, (col * tileSize, row * tileSize))
+        return canvas
+
+    assert np.array_equal(np.asarray(stitched(7)), full)
+    for level in range(6, -1, -1):
+        assert np.array_equal(np.asarray(stitched(level)), np.asarray(stitched(level + 1).reduce(2))), level
+    assert stitched(0).size == (1, 1)
+
+def test_archive_source(tmp_path):
+    pile, bound = saved_pile(str(tmp_path))
+    path = str(tmp_path / 'pile.spile')
+    pile_archive.write_archive(path, {'pile': pile, 'bound': bound}, {'metadata': {'pileType': 'square'}, 'config': CONFIG})
+    scratch = tmp_path / 'scratch'
+    scratch.mkdir()
+    paths, metadata, config = render_tiles.open_source(path, scratch=str(scratch))
+    assert metadata['pileType'] == 'square'
+    settings = render_tiles.render_settings(config)
+    assert settings['sideLength'] == 3
+    output = str(tmp_path / 'archive.png')
+    render_tiles.write_png(paths, settings, output)
+    assert np.array_equal(saved_pixels(output), full_render(pile, bound, settings))
+    with pytest.raises(ValueError, match='no array'):
+        render_tiles.open_source(path, 'flatcube', str(scratch))
@@ -0,0 +1,89 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+sp = pytest.importorskip('sandpile_calculations', reason='build the extension first: python compile_calc_library.py build_ext --inplace')
+import pile_archive
+import pile_metadata as pile_meta
+import sandpile_group
+
+'''
+The group axioms on every geometry, the identity from the fundamental
+domain and pre-solve against the full grid on the worklist, the identities/
+cache, and loading saved piles to add.
+'''
+
+GEOMETRIES = [('square', 9, 7, None, None, 'von_neumann'), ('square', 8, 8, None, None, 'moore'), ('cylinder', 8, 6, None, None, 'von_neumann'),
+              ('squarewrap', 6, 6, None, None, 'von_neumann'), ('cubesurface', 4, 3, 5, None, None), ('icosahedronsurface', 5, 3, None, 3, None)]
+
+@pytest.fixture(autouse=True)
+def fresh_identities():
+    sandpile_group.group_identity.cache_clear()
+    yield
+    sandpile_group.group_identity.cache_clear()
+
+@pytest.mark.parametrize('geometry', GEOMETRIES, ids=[geometry[0] for geometry in GEOMETRIES])
+def test_group_axioms(tmp_path, geometry):
+    group = sandpile_group.SandpileGroup(*geometry, directory=str(tmp_path))
+    checks, seconds = sandpile_group.check_axioms(group, samples=2, seed=1)
+    assert checks == {'identity': True, 'commutative': True, 'associative': True, 'inverse': True}
+    identity = group.identity()
+    assert group.is_recurrent(identity)
+    assert not group.is_recurrent(np.zeros(group.numCells, dtype=np.int64))
+    assert int(identity.max()) < group.threshold
+    if geometry[0] in ['squarewrap', 'cubesurface', 'icosahedronsurface']:
+        assert list(group.sink) == [0] # Closed surfaces get a sink
+
+@pytest.mark.parametrize('pileType, topple', [('square', 'von_neumann'), ('square', 'moore'), ('cylinder', 'von_neumann'), ('squarewrap', 'von_neumann')])
+def test_identity_domain_matches_full_grid(tmp_path, pileType, topple):
+    reduced = sandpile_group.SandpileGroup(pileType, 12, 12, topple=topple, directory=str(tmp_path / 'reduced'))
+    full = sandpile_group.SandpileGroup(pileType, 12, 12, topple=topple, engine='worklist', symmetry='none', directory=str(tmp_path / 'full'))
+    assert np.array_equal(reduced.identity(), full.identity())
+    assert full.domainCells == 144
+    if pileType == 'square':
+        assert reduced.domainCells < 144
+
+def test_identity_cached_on_disk(tmp_path):
+    group = sandpile_group.SandpileGroup('square', 10, 10, directory=str(tmp_path))
+    identity = np.array(group.identity())
+    assert not group.cached
+    assert not group.identity().flags.writeable
+    assert len([name for name in os.listdir(tmp_path) if name.endswith(pile_archive.ARCHIVE_SUFFIX)]) == 1
+    sandpile_group.group_identity.cache_clear()
+    again = sandpile_group.SandpileGroup('square', 10, 10, directory=str(tmp_path))
+    assert np.array_equal(again.identity(), identity)
+    assert again.cached
+    # Another sink is another group
+    other = sandpile_group.SandpileGroup('square', 10, 10, sink=[55], directory=str(tmp_path))
+    assert other.identity()[55] == 0
+    assert not other.cached
+
+def test_bad_sink_and_type():
+    with pytest.raises(ValueError, match='not one of the'):
+        sandpile_group.SandpileGroup('square', 4, 4, sink=[16])
+    with pytest.raises(ValueError, match='No sandpile group'):
+        sandpile_group.SandpileGroup('plane', 4, 4)
+
+def test_load_pile(tmp_path):
+    group = sandpile_group.SandpileGroup('cubesurface', 3, 3, 3, directory=str(tmp_path))
+    pile = group.random_recurrent(np.random.default_rng(0))
+    arrays = group.pile_arrays(pile)
+    metadata = pile_meta.pile_metadata('cubesurface', 3, 3, 3, None, 'von_neumann', int(pile.sum()), 0, 'uniform', None, None)
+    directory = str(tmp_path / 'saved')
+    os.mkdir(directory)
+    pile_archive.write_archive(os.path.join(directory, 'archived.spile'), arrays, {'metadata': metadata})
+    pile_meta.save_pile_metadata('archived', metadata, directory, archive=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, pile_meta.npy_file('npy', name)), array)
+    pile_meta.save_pile_metadata('npy', metadata, directory)
+    for path in ['archived.spile', 'archived_meta.json', 'npy_meta.json']:
+        loaded = sandpile_group.load_pile(os.path.join(directory, path))[1]
+        assert np.array_equal(group.pile_cells(loaded), pile), path
+    metaPath = os.path.join(directory, 'empty_meta.json')
+    for emptyMetadata in [dict(metadata, files=[]), metadata]: # metadata has no files field
+        with open(metaPath, 'w') as metaFile:
+            json.dump(emptyMetadata, metaFile)
+        with pytest.raises(ValueError, match='lists no saved pile files'):
+            sandpile_group.load_pile(metaPath)
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+import sandpile_layouts as layouts
+
+'''
+The cached index map unfoldings against the per-cell loops they replaced
+(ported below from the original main() and icosahedron toppling), on random
+piles of a few sizes.
+'''
+
+def random_array(shape, seed=0):
+    return np.random.default_rng(seed).integers(0, 50, shape, dtype=np.int64)
+
+def reference_cube(front, back, left, right, top, bottom):
+    xMax, yMax = front.shape
+    zMax = left.shape[0]
+    flatCube = np.zeros(((2 * xMax) + (2 * zMax), (2 * zMax) + yMax), dtype=np.int64)
+    flatCubeBound = np.zeros(flatCube.shape, dtype=np.int64)
+    placements = [(left, 0, zMax), (front, zMax, zMax), (right, zMax + xMax, zMax), (back, (2 * zMax) + xMax, zMax),
+                  (top, zMax, 0), (bottom, zMax, zMax + yMax)]
+    for face, xOffset, yOffset in placements:
+        for x in range(face.shape[0]):
+            for y in range(face.shape[1]):
+                flatCube[x + xOffset][y + yOffset] = face[x][y]
+                flatCubeBound[x + xOffset][y + yOffset] = 1
+    return (flatCube, flatCubeBound)
+
+def reference_strips(sandboxRaw, xMax, yMax):
+    arrXMax = 2 * (xMax + 1)
+    arrWRot = 5 * xMax + int(xMax / 2) + 9
+    stripSandpile = np.zeros((arrXMax + (5 * yMax) + 1, 5 * yMax), dtype=np.int64)
+    stripSandpileBound = np.zeros(stripSandpile.shape, dtype=np.int64)
+    stripSandpile_rot = np.zeros((arrWRot, 3 * yMax), dtype=np.int64)
+    stripSandpileBound_rot = np.zeros(stripSandpile_rot.shape, dtype=np.int64)
+    for strip in range(5):
+        yOffset = strip * yMax
+        for y in range(yMax):
+            xOffset = ((yMax - 1) - y) + yOffset + 1
+            for x in range(arrXMax):
+                x1 = (arrWRot - 3) - int(x / 2) - y - (strip * (xMax + 1))
+                y1 = ((yMax - 1) - y) + int((x + 1) / 2)
+                stripSandpile_rot[x1][y1] = sandboxRaw[x][y + yOffset]
+                stripSandpileBound_rot[x1][y1] = 1
+                stripSandpile[x + xOffset][y + yOffset] = sandboxRaw[x][y + yOffset]
+                stripSandpileBound[x + xOffset][y + yOffset] = 1
+    return (stripSandpile, stripSandpileBound, stripSandpile_rot, stripSandpileBound_rot)
+
+def reference_faces(sandbox, xMax, yMax):
+    pileArray = []
+    boundArray = []
+    for side in range(20):
+        tempArr = np.zeros((xMax, yMax), dtype=np.int64)
+        boundTempArr = np.zeros((xMax, yMax), dtype=np.int64)
+        yOffset = int(side / 4) * yMax
+        col = side % 4
+        for y in range(yMax):
+            if side % 2 == 1: # odd
+                xOffset = 1 + (int(col / 3) * (xMax + 1))
+                xRange = range((y * 2) + xOffset, xMax + xOffset)
+                xShift = -y
+            else:
+                xOffset = int(col / 2) * (xMax + 1)
+                xRange = range(xOffset, (y * 2) + xOffset + 1)
+                xShift = int(xMax / 2) - y
+            for xSource in xRange:
+                tempArr[(xSource - xOffset) + xShift][y] = sandbox[xSource][y + yOffset]
+                boundTempArr[(xSource - xOffset) + xShift][y] = 1
+        pileArray.append(tempArr)
+        boundArray.append(boundTempArr)
+    return (pileArray, boundArray)
+
+@pytest.mark.parametrize('xMax, yMax, zMax', [(4, 4, 4), (5, 3, 7), (1, 6, 2)])
+def test_unfold_cube_matches_loops(xMax, yMax, zMax):
+    shapes = [(xMax, yMax), (xMax, yMax), (zMax, yMax), (zMax, yMax), (xMax, zMax), (xMax, zMax)]
+    faces = [random_array(shape, seed) for seed, shape in enumerate(shapes)]
+    flatCube, flatCubeBound = layouts.unfold_cube(*faces)
+    expected = reference_cube(*faces)
+    assert np.array_equal(flatCube, expected[0])
+    assert np.array_equal(flatCubeBound, expected[1])
+
+@pytest.mark.parametrize('numRows', [2, 5, 8])
+def test_icosahedron_layouts_match_loops(numRows):
+    xMax = 1 + (2 * (numRows - 1))
+    yMax = numRows
+    sandboxRaw = random_array((2 * (xMax + 1), 5 * yMax))
+    for result, expected in zip(layouts.unfold_icosahedron(sandboxRaw, xMax, yMax), reference_strips(sandboxRaw, xMax, yMax)):
+        assert np.array_equal(result, expected)
+    faces, bounds = layouts.extract_icosahedron_faces(sandboxRaw, xMax, yMax)
+    expectedFaces, expectedBounds = reference_faces(sandboxRaw, xMax, yMax)
+    assert len(faces) == 20
+    assert all(np.array_equal(a, b) for a, b in zip(faces, expectedFaces))
+    assert all(np.array_equal(a, b) for a, b in zip(bounds, expectedBounds))
+
+def test_maps_are_cached_read_only():
+    assert layouts.cube_unfolding(3, 4, 5) is layouts.cube_unfolding(3, 4, 5)
+    assert not layouts.icosahedron_faces(5, 3).flags.writeable
+    # Unfolding returns new arrays, never the cached map
+    flatCube, _ = layouts.unfold_cube(*[np.ones(shape, dtype=np.int64) for shape in [(3, 4), (3, 4), (5, 4), (5, 4), (3, 5), (3, 5)]])
+    flatCube[0, 0] = 7
+    assert flatCube.flags.writeable
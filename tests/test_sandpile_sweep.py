@@ -0,0 +1,56 @@
+import csv
+import os
+
+import numpy as np
+import pytest
+
+sp = pytest.importorskip('sandpile_calculations', reason='build the extension first: python compile_calc_library.py build_ext --inplace')
+import pile_archive
+import sandpile_sweep as sweep
+
+'''
+Grid expansion and job naming, and sweeps on the pool and in order writing
+the same piles (those of calculating each config alone), a summary row per
+job and failed jobs as rows instead of errors.
+'''
+
+TEMPLATE = {'filenom': 'sq', 'pileType': 'square', 'xMax': 21, 'yMax': 21, 'grains': 2000, 'imagePixelWidth': 1,
+            'colors': ['#CAF0F8', '#00B4D8', '#90E0EF', '#03045E'], 'dropParam': {'dropSpotShift': 0}}
+
+def test_expand_grid():
+    configs = sweep.expand_grid({'template': TEMPLATE, 'grid': {'grains': {'start': 1000, 'stop': 3001, 'step': 1000}, 'topple': ['von_neumann', 'moore'],
+                                                                'dropParam.dropSpotShift': 5}})
+    assert len(configs) == 6
+    assert configs[0]['filenom'] == 'sq_grains1000_topplevon_neumann_dropSpotShift5'
+    assert [(config['grains'], config['topple']) for config in configs[:3]] == [(1000, 'von_neumann'), (1000, 'moore'), (2000, 'von_neumann')]
+    assert all(config['dropParam'] == {'dropSpotShift': 5} for config in configs)
+    assert TEMPLATE['dropParam'] == {'dropSpotShift': 0} # The template is copied
+
+def test_job_names_unique():
+    jobs = sweep.make_jobs([TEMPLATE, TEMPLATE, dict(TEMPLATE, filenom='other')], render=False)
+    assert [job['name'] for job in jobs] == ['sq', 'sq_1', 'other']
+    assert jobs[0]['memory'] > sweep.JOB_BASE_BYTES
+    assert sweep.make_jobs([TEMPLATE], render=True)[0]['memory'] > jobs[0]['memory']
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_run_sweep(tmp_path, workers):
+    configs = sweep.expand_grid({'template': TEMPLATE, 'grid': {'grains': [1500, 2500], 'topple': ['von_neumann', 'moore']}})
+    configs.append(dict(TEMPLATE, filenom='broken', topple='no_such_neighborhood'))
+    jobs = sweep.make_jobs(configs, render=True)
+    outputDir = str(tmp_path / 'sweep')
+    # A budget below one job: the jobs still run, one at a time
+    rows = sweep.run_sweep(jobs, outputDir, workers=workers, memoryBytes=1, render=True)
+    assert sorted(row['job'] for row in rows) == sorted(job['name'] for job in jobs)
+    with open(os.path.join(outputDir, 'summary.csv')) as summaryFile:
+        summary = {row['job']: row for row in csv.DictReader(summaryFile)}
+    assert summary['broken']['status'].startswith('ValueError')
+    for config in configs[:-1]:
+        row = summary[config['filenom']]
+        assert row['status'] == 'ok'
+        pile, topples, bound = sp.calculate_sandpile_grid_seeded(21, 21, config['grains'], config['topple'], [(10, 10, 1.0)])
+        with pile_archive.PileArchive(os.path.join(outputDir, 'saved_piles', f"{config['filenom']}.spile")) as archive:
+            assert np.array_equal(archive.array('pile'), pile)
+            assert archive.header['toppleCtr'] == topples
+        assert int(row['topples']) == topples
+        assert int(row['grainsRetained']) == int(pile.sum())
+        assert os.path.exists(os.path.join(outputDir, 'images', f"{config['filenom']}.png"))
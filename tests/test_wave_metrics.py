@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+import wave_metrics
+
+'''
+The wave metrics writer on made up records (windows of waves, multiscale
+levels, the estimate) and on the toppling kernels' records: a metrics run
+gives the same stable pile, its last line has the run's topples and the
+grains lost off the edges add up.
+'''
+
+def record(wave, topples, excess, unstable=2, lost=1):
+    return {'wave': wave, 'unstable': unstable, 'topples': topples, 'excess': excess, 'lost': lost,
+            'scanTime': 0.5, 'relaxTime': 0.25, 'touched': 9, 'bbox': [0, 2, 0, 2]}
+
+def test_windows_and_levels(tmp_path):
+    path = str(tmp_path / 'metrics.jsonl')
+    with wave_metrics.WaveMetrics(path, every=3, statusSeconds=1e9) as metrics:
+        for wave in range(1, 8):
+            metrics(record(wave, wave * 2, 100 - wave))
+        for wave in range(1, 3): # A multiscale run's next level restarts the waves
+            metrics(record(wave, 20 + wave, 10))
+    lines = wave_metrics.load_metrics(path)
+    assert [(line['level'], line['wave'], line['waves']) for line in lines] == [(0, 3, 3), (0, 6, 3), (0, 7, 1), (1, 2, 2)]
+    assert lines[0]['unstable'] == 6
+    assert lines[0]['lost'] == 3
+    assert lines[0]['scanTime'] == pytest.approx(1.5)
+    assert (lines[1]['topples'], lines[1]['excess']) == (12, 94)
+    assert lines[-1]['topples'] == 22
+    assert metrics.waves == 9
+    assert metrics.lines == 4
+
+def test_estimate_needs_falling_excess():
+    metrics = wave_metrics.WaveMetrics(statusSeconds=1e9)
+    assert metrics.estimate(100, 1.0) is None # No rate yet
+    assert metrics.estimate(120, 2.0) is None # Growing
+    assert metrics.estimate(60, 3.0) is None # Smoothed rate still negative: 0.2 * 60 + 0.8 * -20
+    assert metrics.estimate(0, 4.0) == 0.0
+    fresh = wave_metrics.WaveMetrics(statusSeconds=1e9)
+    fresh.estimate(100, 1.0)
+    assert fresh.estimate(80, 2.0) == pytest.approx(4.0) # 80 grains left falling 20 per second
+
+@pytest.fixture
+def calc():
+    return pytest.importorskip('sandpile_calculations', reason='build the extension first: python compile_calc_library.py build_ext --inplace')
+
+@pytest.mark.parametrize('engine', ['scan', 'worklist'])
+@pytest.mark.parametrize('topple', ['von_neumann', 'moore'])
+def test_grid_metrics_run(calc, tmp_path, engine, topple):
+    grains = 4000
+    dropSpots = [(9, 11, 1.0)]
+    plain = calc.calculate_sandpile_grid_seeded(21, 21, grains, topple, list(dropSpots), engine=engine)
+    path = str(tmp_path / 'metrics.jsonl')
+    with wave_metrics.WaveMetrics(path, every=5, statusSeconds=1e9) as metrics:
+        measured = calc.calculate_sandpile_grid_seeded(21, 21, grains, topple, list(dropSpots), engine=engine, metrics=metrics)
+    assert np.array_equal(measured[0], plain[0])
+    assert measured[1] == plain[1]
+    lines = wave_metrics.load_metrics(path)
+    assert sum(line['waves'] for line in lines) == metrics.waves
+    assert lines[-1]['topples'] == plain[1]
+    assert sum(line['lost'] for line in lines) == grains - int(plain[0].sum())
+
+def test_surface_metrics_run(calc, tmp_path):
+    args = (8, 8, 8, 600, 'von_neumann', [(3, 4, 1.0, 'top')])
+    plain = calc.calculate_sandpile_cubesurface_seeded(*args)
+    path = str(tmp_path / 'cube.jsonl')
+    with wave_metrics.WaveMetrics(path, statusSeconds=1e9) as metrics:
+        measured = calc.calculate_sandpile_cubesurface_seeded(*args, metrics=metrics)
+    assert all(np.array_equal(a, b) for a, b in zip(measured[:3], plain[:3]))
+    assert wave_metrics.load_metrics(path)[-1]['topples'] == plain[3]
+
+def test_uninstrumented_engines_rejected(calc):
+    sst = pytest.importorskip('sandpile_surface_toppling')
+    for engine in ['vectorized', 'parallel', 'presolve']:
+        with pytest.raises(ValueError, match='scan or worklist'):
+            sst.calculate_pile('square', 9, 9, None, None, 100, 'von_neumann', [(4, 4, 1.0)], engine=engine, metrics=wave_metrics.WaveMetrics())
+    sst.check_metrics_engine('plane', 'vectorized') # Plane piles topple on the scan kernel whatever the engine
@@ -0,0 +1,105 @@
+import json
+from time import perf_counter
+
+'''
+Wave metrics collector for the metrics callbacks of the toppling kernels.
+
+A WaveMetrics object is passed as metrics= to the calculate functions and
+called with each wave's record (see Wave Metrics in sandpile_calculations).
+Every `every` waves it writes one JSON line with the summed counts of those
+waves (unstable, lost, scanTime, relaxTime), the latest running values
+(topples, excess, touched, bbox), the elapsed seconds and a rough estimate
+of the seconds left, and prints a status line at most every statusSeconds.
+
+The estimate follows the excess (grains above the stable height in the
+toppling cells), which falls to 0 as the pile settles: the seconds left are
+the current excess over its smoothed rate of decrease. Early in a run, while
+the excess still grows, there is no estimate (None). A multiscale run
+restarts its wave count at each level, the records carry the level.
+'''
+
+SMOOTHING = 0.2 # Weight of the newest window in the smoothed rate of decrease of the excess
+
+class WaveMetrics():
+    def __init__(self, path=None, every=1, statusSeconds=5.0):
+        self.file = open(path, 'w') if path else None
+        self.every = max(1, int(every))
+        self.statusSeconds = statusSeconds
+        self.start = perf_counter()
+        self.lastStatus = self.start
+        self.level = 0
+        self.lastWave = 0
+        self.waves = 0
+        self.lines = 0
+        self.excessRate = None
+        self.lastExcess = None
+        self.lastTime = self.start
+        self.window = None
+        self.latest = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
+
+    def __call__(self, record):
+        if record['wave'] <= self.lastWave: # A new multiscale level
+            self.flush()
+            self.level += 1
+        self.lastWave = record['wave']
+        self.waves += 1
+        self.latest = record
+        if self.window is None:
+            self.window = {'waves': 0, 'unstable': 0, 'lost': 0, 'scanTime': 0.0, 'relaxTime': 0.0}
+        self.window['waves'] += 1
+        for key in ['unstable', 'lost', 'scanTime', 'relaxTime']:
+            self.window[key] += record[key]
+        if self.window['waves'] >= self.every:
+            self.flush()
+
+    def estimate(self, excess, now):
+        # Seconds left from the smoothed rate the excess falls at (None while it is not falling)
+        if self.lastExcess is not None and now > self.lastTime:
+            rate = (self.lastExcess - excess) / (now - self.lastTime)
+            self.excessRate = rate if self.excessRate is None else ((SMOOTHING * rate) + ((1 - SMOOTHING) * self.excessRate))
+        self.lastExcess = excess
+        self.lastTime = now
+        if self.excessRate is None or self.excessRate <= 0:
+            return None
+        return excess / self.excessRate
+
+    def flush(self):
+        # Writes the waves collected since the last line
+        if self.window is None:
+            return
+        now = perf_counter()
+        latest = self.latest
+        line = {'level': self.level, 'wave': latest['wave']}
+        line.update(self.window)
+        line.update({'topples': latest['topples'], 'excess': latest['excess'], 'touched': latest['touched'], 'bbox': latest['bbox'],
+                     'elapsed': now - self.start, 'eta': self.estimate(latest['excess'], now)})
+        self.window = None
+        if self.file is not None:
+            self.file.write(json.dumps(line) + '\n')
+            self.lines += 1
+        if now - self.lastStatus >= self.statusSeconds:
+            self.lastStatus = now
+            print(status_line(line))
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def status_line(line):
+    eta = 'unknown' if line['eta'] is None else f"{line['eta']:.1f} sec"
+    level = f"level {line['level']}, " if line['level'] > 0 else ''
+    return f"{level}wave {line['wave']}: {line['topples']} topples, excess {line['excess']}, {line['touched']} cells touched, elapsed {line['elapsed']:.1f} sec, left ~{eta}"
+
+def load_metrics(path):
+    # Reads a metrics file back as a list of dicts
+    with open(path) as metricsFile:
+        return [json.loads(line) for line in metricsFile if line.strip()]